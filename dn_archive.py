@@ -0,0 +1,125 @@
+import io
+import os
+import zipfile
+import tarfile
+
+# Tried in order on encrypted zip members
+PASSWORDS = [b'infected']
+
+# Larger members are reported as errors instead of being read into memory
+MAX_MEMBER_SIZE = 256 << 20
+
+# gzip, bzip2 and xz streams are assumed to hold a tar
+COMPRESSED_MAGIC = [b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00']
+
+def archive_kind(head):
+    # 'zip', 'tar' or None from the first 512 bytes of a file
+    if head[:4] in (b'PK\x03\x04', b'PK\x05\x06'):
+        return 'zip'
+    if head[257:262] == b'ustar' or any(head.startswith(magic) for magic in COMPRESSED_MAGIC):
+        return 'tar'
+    return None
+
+class PrefixedStream(io.RawIOBase):
+    # A stream that can't seek, with the bytes already read from it put back in front
+
+    def __init__(self, prefix, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        data = self.fileobj.read(len(buffer)) or b''
+        buffer[:len(data)] = data
+        return len(data)
+
+def read_head(fileobj, size=512):
+    # (first size bytes, stream to read the whole file from). A pipe may return fewer bytes than
+    # asked for, so it is read until size bytes or the end, which are then put back in front of it
+    if fileobj.seekable():
+        start = fileobj.tell()
+        head = fileobj.read(size)
+        fileobj.seek(start)
+        return head, fileobj
+    head = b''
+    while len(head) < size:
+        chunk = fileobj.read(size - len(head))
+        if not chunk:
+            break
+        head += chunk
+    return head, io.BufferedReader(PrefixedStream(head, fileobj))
+
+def is_archive(path):
+    try:
+        with open(path, 'rb') as f:
+            return archive_kind(f.read(512)) is not None
+    except OSError:
+        return False
+
+def read_zip_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, passwords):
+    # (data, error)
+    try:
+        if not info.flag_bits & 1:
+            return archive.read(info), None
+        for password in passwords:
+            try:
+                return archive.read(info, pwd=password), None
+            except RuntimeError: # Bad password
+                continue
+        return None, 'Encrypted with an unknown password'
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+def iter_zip(fileobj, name, passwords, max_size):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            member = f'{name}!{info.filename}'
+            if info.file_size > max_size:
+                yield member, None, f'Member is {info.file_size} bytes, more than the limit of {max_size}'
+                continue
+            yield member, *read_zip_member(archive, info, passwords)
+
+def iter_tar(fileobj, name, max_size):
+    # Stream mode reads members in order without seeking, so pipes work and memory stays flat
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            member = f'{name}!{info.name}'
+            if info.size > max_size:
+                yield member, None, f'Member is {info.size} bytes, more than the limit of {max_size}'
+                continue
+            yield member, archive.extractfile(info).read(), None
+
+def iter_samples(path_or_file, name=None, passwords=PASSWORDS, max_size=MAX_MEMBER_SIZE):
+    # Lazily yield (name, data, error) for each file in a zip or tar, or the file itself if it
+    # isn't an archive. Only one member is held in memory at a time and nothing touches the disk.
+    if isinstance(path_or_file, (str, os.PathLike)):
+        with open(path_or_file, 'rb') as f:
+            yield from iter_samples(f, name or str(path_or_file), passwords, max_size)
+        return
+    name = name or getattr(path_or_file, 'name', None) or '<stream>'
+    head, fileobj = read_head(path_or_file)
+    kind = archive_kind(head)
+    try:
+        if kind == 'zip':
+            if not fileobj.seekable():
+                # The zip directory is at the end of the file, so a pipe has to be buffered
+                yield from iter_zip(io.BytesIO(fileobj.read()), name, passwords, max_size)
+            else:
+                yield from iter_zip(fileobj, name, passwords, max_size)
+        elif kind == 'tar':
+            yield from iter_tar(fileobj, name, max_size)
+        else:
+            yield name, fileobj.read(), None
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        yield name, None, f'{type(e).__name__}: {e}'
@@ -0,0 +1,260 @@
+import struct
+import metadata_util as mu
+import dn_constants as const
+
+# Parameter types of attribute constructors, see parse_type
+SZARRAY = 0x1D
+SYSTEM_TYPE = 0x50
+BOXED = 0x51
+ENUM = 0x55
+
+# Arrays and boxed values nested deeper than this are refused. Attribute arguments are never
+# more than an object[] of arrays, so only crafted blobs come close
+MAX_NESTING = 8
+
+# Framework enums used by common attributes that aren't Int32
+KNOWN_ENUM_TYPES = {
+    'System.Security.SecurityRuleSet': 0x05
+}
+
+class BlobReader:
+    # Cursor over one signature or custom attribute blob
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, fmt):
+        value = struct.unpack_from(fmt, self.data, self.offset)[0]
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def byte(self):
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def compressed(self):
+        value, size = mu.decode_compressed_uint(self.data, self.offset)
+        self.offset += size
+        return value
+
+    def ser_string(self):
+        # SerString: 0xFF for null, otherwise a compressed length and UTF-8 bytes
+        if self.data[self.offset] == 0xFF:
+            self.offset += 1
+            return None
+        length = self.compressed()
+        if self.offset + length > len(self.data):
+            raise ValueError(f'String of {length} bytes runs past the end of the blob')
+        value = bytes(self.data[self.offset:self.offset + length]).decode('utf-8', errors='replace')
+        self.offset += length
+        return value
+
+class AttributeDecoder:
+    # Decodes CustomAttribute rows of one module. Constructors are resolved to their attribute
+    # type and parameter list once and cached, so every further row using them is a dict lookup.
+
+    def __init__(self, metadata: mu.Metadata):
+        self.metadata = metadata
+        self.ctors = {}
+        self.enum_types = {}
+        self.type_defs = None # Full name -> TypeDef row, built on first use
+
+    def type_name(self, table_name, row):
+        # Full name of a TypeDef or TypeRef row, None for anything else
+        if table_name not in ('TypeDef', 'TypeRef') or not self.metadata.check_row(table_name, row):
+            return None
+        table = self.metadata.get_table(table_name)
+        names = []
+        seen = set()
+        while row not in seen:
+            seen.add(row)
+            name = self.metadata.get_string(table.column('TypeName')[row - 1])
+            namespace = self.metadata.get_string(table.column('TypeNamespace')[row - 1])
+            names.append(f'{namespace}.{name}' if namespace else name)
+            if table_name != 'TypeRef':
+                break
+            # Nested types are scoped by their enclosing TypeRef
+            scope_table, row = table.get_coded('ResolutionScope', row)
+            if scope_table != 'TypeRef' or not self.metadata.check_row(scope_table, row):
+                break
+        return '/'.join(reversed(names))
+
+    def type_def_or_ref(self, reader: BlobReader):
+        # TypeDefOrRefOrSpecEncoded: the table tag lives in the low 2 bits
+        value = reader.compressed()
+        tag = value & 3
+        if tag >= len(const.TYPE_DEF_OR_REF):
+            raise ValueError(f'Invalid TypeDefOrRef tag {tag}')
+        return const.TYPE_DEF_OR_REF[tag], value >> 2
+
+    def enum_underlying_type(self, table_name, row):
+        # Enums defined in this module store their underlying type on the value__ field.
+        # Enums from other assemblies can't be resolved without them, and are almost always Int32
+        key = (table_name, row)
+        if key not in self.enum_types:
+            element_type = KNOWN_ENUM_TYPES.get(self.type_name(table_name, row), 0x08)
+            if table_name == 'TypeDef' and self.metadata.check_row(table_name, row):
+                for field_row in self.metadata.get_list('TypeDef', 'FieldList', row):
+                    flags, name, signature = self.metadata.get_row('Field', field_row)
+                    if self.metadata.get_string(name) == 'value__':
+                        data = self.metadata.get_blob(signature)
+                        if len(data) >= 2 and data[1] in const.ELEMENT_TYPE_FORMATS:
+                            element_type = data[1]
+                        break
+            self.enum_types[key] = element_type
+        return self.enum_types[key]
+
+    def named_enum_type(self, enum_name):
+        # Underlying type of an enum known only by name, as in named and boxed arguments
+        if self.type_defs is None:
+            self.type_defs = {self.type_name('TypeDef', row): row for row in range(1, self.metadata.table_rowcounts.get('TypeDef', 0) + 1)}
+        if enum_name in self.type_defs:
+            return self.enum_underlying_type('TypeDef', self.type_defs[enum_name])
+        return KNOWN_ENUM_TYPES.get(enum_name, 0x08)
+
+    def parse_type(self, reader: BlobReader, depth=0):
+        # One constructor parameter as an element type code, with (SZARRAY, element) for arrays
+        # and (ENUM, underlying type) for enums
+        element_type = reader.byte()
+        while element_type in (0x1F, 0x20): # Custom modifiers
+            self.type_def_or_ref(reader)
+            element_type = reader.byte()
+        if element_type == SZARRAY:
+            if depth >= MAX_NESTING:
+                raise ValueError(f'Arrays nested more than {MAX_NESTING} deep')
+            return (SZARRAY, self.parse_type(reader, depth + 1))
+        if element_type == 0x11:
+            return (ENUM, self.enum_underlying_type(*self.type_def_or_ref(reader)))
+        if element_type == 0x12:
+            # Only System.Type is a valid class parameter besides string and object
+            self.type_def_or_ref(reader)
+            return SYSTEM_TYPE
+        if element_type == 0x1C:
+            return BOXED
+        if element_type in const.ELEMENT_TYPE_FORMATS or element_type == 0x0E:
+            return element_type
+        raise ValueError(f'Unsupported attribute parameter type {const.ELEMENT_TYPES.get(element_type, hex(element_type))}')
+
+    def parse_ctor_signature(self, data):
+        reader = BlobReader(data)
+        calling_convention = reader.byte()
+        if calling_convention & 0x10: # Generic
+            reader.compressed()
+        param_count = reader.compressed()
+        if reader.byte() != 0x01:
+            raise ValueError('Constructor does not return void')
+        return [self.parse_type(reader) for i in range(param_count)]
+
+    def resolve_ctor(self, type_table, type_row):
+        # (attribute type name, parameter types) of a CustomAttribute Type column value
+        key = (type_table, type_row)
+        if key in self.ctors:
+            return self.ctors[key]
+        name = None
+        signature = None
+        if self.metadata.check_row(type_table, type_row):
+            if type_table == 'MemberRef':
+                member_refs = self.metadata.get_table('MemberRef')
+                parent_table, parent_row = member_refs.get_coded('Class', type_row)
+                name = self.type_spec_name(parent_row) if parent_table == 'TypeSpec' else self.type_name(parent_table, parent_row)
+                signature = member_refs.column('Signature')[type_row - 1]
+            elif type_table == 'MethodDef':
+                name = self.type_name('TypeDef', self.metadata.get_owner('TypeDef', 'MethodList', type_row))
+                signature = self.metadata.get_table('MethodDef').column('Signature')[type_row - 1]
+        try:
+            params = self.parse_ctor_signature(self.metadata.get_blob(signature)) if signature is not None else None
+        except (ValueError, IndexError) as e:
+            params = str(e)
+        self.ctors[key] = name, params
+        return name, params
+
+    def type_spec_name(self, row):
+        # Generic attributes are instantiated through a TypeSpec: GENERICINST CLASS type args...
+        if not self.metadata.check_row('TypeSpec', row):
+            return None
+        data = self.metadata.get_blob(self.metadata.get_table('TypeSpec').column('Signature')[row - 1])
+        if len(data) < 2 or data[0] != 0x15:
+            return None
+        return self.type_name(*self.type_def_or_ref(BlobReader(data[2:])))
+
+    def read_value(self, reader: BlobReader, element_type, depth=0):
+        if isinstance(element_type, tuple):
+            kind, inner = element_type
+            if kind == ENUM:
+                return self.read_value(reader, inner, depth)
+            count = reader.read('<I')
+            if count == 0xFFFFFFFF:
+                return None
+            if count > len(reader.data) - reader.offset:
+                raise ValueError(f'Array of {count} elements runs past the end of the blob')
+            return [self.read_value(reader, inner, depth) for i in range(count)]
+        if element_type == BOXED:
+            # Each boxed value spells out its own type, which can be another array of boxed values
+            if depth >= MAX_NESTING:
+                raise ValueError(f'Boxed values nested more than {MAX_NESTING} deep')
+            return self.read_value(reader, self.read_field_or_prop_type(reader), depth + 1)
+        if element_type in (0x0E, SYSTEM_TYPE):
+            return reader.ser_string()
+        value = reader.read(const.ELEMENT_TYPE_FORMATS[element_type])
+        return chr(value) if element_type == 0x03 else value
+
+    def read_field_or_prop_type(self, reader: BlobReader, depth=0):
+        # Types of named and boxed arguments are spelled out in the blob itself
+        element_type = reader.byte()
+        if element_type == SZARRAY:
+            if depth >= MAX_NESTING:
+                raise ValueError(f'Arrays nested more than {MAX_NESTING} deep')
+            return (SZARRAY, self.read_field_or_prop_type(reader, depth + 1))
+        if element_type == ENUM:
+            # Only the enum's assembly qualified name is given
+            return (ENUM, self.named_enum_type((reader.ser_string() or '').split(',')[0]))
+        if element_type in const.ELEMENT_TYPE_FORMATS or element_type in (0x0E, SYSTEM_TYPE, BOXED):
+            return element_type
+        raise ValueError(f'Unsupported named argument type {element_type:#x}')
+
+    def decode_value(self, params, data):
+        # ECMA-335 II.23.3: prolog, fixed arguments in constructor order, then named arguments
+        reader = BlobReader(data)
+        if reader.read('<H') != 0x0001:
+            raise ValueError('Missing custom attribute prolog')
+        args = [self.read_value(reader, element_type) for element_type in params]
+        named = {}
+        for i in range(reader.read('<H')):
+            kind = reader.byte()
+            if kind not in (0x53, 0x54):
+                raise ValueError(f'Invalid named argument kind {kind:#x}')
+            element_type = self.read_field_or_prop_type(reader)
+            name = reader.ser_string()
+            named[name] = self.read_value(reader, element_type)
+        return args, named
+
+    def decode(self, row):
+        # {'type', 'args', 'named'} for one CustomAttribute row, with 'error' if the value didn't parse
+        custom_attributes = self.metadata.get_table('CustomAttribute')
+        attribute = {'type': None, 'args': None, 'named': None}
+        try:
+            attribute['type'], params = self.resolve_ctor(*custom_attributes.get_coded('Type', row))
+            if not isinstance(params, list):
+                attribute['error'] = params or 'Could not resolve the constructor'
+                return attribute
+            attribute['args'], attribute['named'] = self.decode_value(params, self.metadata.get_blob(custom_attributes.column('Value')[row - 1]))
+        except (ValueError, IndexError, struct.error) as e:
+            attribute['error'] = str(e)
+        return attribute
+
+def attributes_of(metadata: mu.Metadata, parent_table):
+    # Every attribute attached to rows of parent_table (e.g. Assembly), in one pass over the table
+    if not metadata.table_rowcounts.get('CustomAttribute') or '#Blob' not in metadata.heaps:
+        return []
+    decoder = AttributeDecoder(metadata)
+    parent_tag = const.HAS_CUSTOM_ATTRIBUTE.index(parent_table)
+    parent_tags, parent_rows = metadata.get_table('CustomAttribute').coded('Parent')
+    attributes = []
+    for i, tag in enumerate(parent_tags):
+        if metadata.limits and i & 0xFFF == 0:
+            metadata.limits.check_time()
+        if tag == parent_tag:
+            attributes.append(decoder.decode(i + 1))
+    return attributes
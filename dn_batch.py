@@ -0,0 +1,241 @@
+import os
+import sys
+import glob
+import json
+import hashlib
+import time
+import itertools
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import dn_extract
+import dn_archive
+import dn_cache
+import dn_resources
+import dn_stats
+import metadata_util as mu
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def iter_paths(specs):
+    # Each spec is a file, a directory (walked recursively), a glob, or - for a list of specs on stdin
+    for spec in specs:
+        if spec == '-':
+            yield from iter_paths(line.strip() for line in sys.stdin if line.strip())
+        elif os.path.isdir(spec):
+            for root, dirs, files in os.walk(spec):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif glob.has_magic(spec):
+            for match in sorted(glob.iglob(spec, recursive=True)):
+                if os.path.isdir(match):
+                    yield from iter_paths([match])
+                else:
+                    yield match
+        else:
+            yield spec
+
+def on_alarm(signum, frame):
+    raise mu.ParseViolation('time_budget', 'Sample was stopped by the watchdog')
+
+def set_watchdog(limits: mu.Limits):
+    # Hard stop for time spent outside of the parser's own checks, e.g. inside pefile.
+    # Signals only work in the main thread, so this is skipped anywhere else.
+    if not limits or not limits.time_budget or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, limits.time_budget)
+    return True
+
+def limit_memory(limits: mu.Limits):
+    # Pool initializer: cap the worker's address space so a runaway sample raises MemoryError
+    if resource is not None and limits and limits.memory_budget:
+        resource.setrlimit(resource.RLIMIT_AS, (limits.memory_budget, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+def extract_record(path_or_bytes, name, limits: mu.Limits, collect_stats=False, resources: dn_resources.ResourceOptions = None):
+    try:
+        watchdog = set_watchdog(limits)
+        try:
+            stats = dn_stats.FileStats(name) if collect_stats else None
+            record = dn_extract.extract(path_or_bytes, name=name, limits=limits, stats=stats, resources=resources).to_dict()
+            if stats:
+                record['stats'] = stats.to_dict()
+            return record
+        finally:
+            if watchdog:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except mu.ParseViolation as violation:
+        # The watchdog fired outside of extract_pe, e.g. while pefile was loading the file
+        return {'name': name, 'is_dotnet': None, 'violations': [violation.to_dict()]}
+
+def scan_data(name, data, hash_file=False, limits: mu.Limits = None, collect_stats=False, resources: dn_resources.ResourceOptions = None):
+    try:
+        record = extract_record(data, name, limits, collect_stats, resources)
+    except Exception as e:
+        record = {'name': name, 'error': f'{type(e).__name__}: {e}'}
+    if hash_file:
+        record['sha256'] = hashlib.sha256(data).hexdigest()
+    record['path'] = name
+    return record
+
+def scan_file(path, hash_file=False, limits: mu.Limits = None, collect_stats=False, resources: dn_resources.ResourceOptions = None):
+    try:
+        if hash_file:
+            with open(path, 'rb') as f:
+                return scan_data(path, f.read(), True, limits, collect_stats, resources)
+        record = extract_record(path, path, limits, collect_stats, resources)
+    except Exception as e:
+        record = {'name': path, 'error': f'{type(e).__name__}: {e}'}
+    record['path'] = path
+    return record
+
+def from_cache(record, path):
+    # Identical files share one stored report, so the name may come from another path
+    record['name'] = path
+    record['path'] = path
+    record['cached'] = True
+    return record
+
+def iter_sample_jobs(samples, cache, mode):
+    # Archive members and stdin have no stat to check, so the cache is looked up by hash
+    for name, data, error in samples:
+        if error is not None:
+            yield name, None, {'name': name, 'path': name, 'error': error}, None
+            continue
+        record = cache.get(hashlib.sha256(data).hexdigest(), mode) if cache is not None else None
+        yield name, None, from_cache(record, name) if record is not None else None, data
+
+def iter_jobs(paths, cache, mode, archives=False, passwords=dn_archive.PASSWORDS):
+    # (path, stat, cached record or None, data or None). Unchanged files are answered from the
+    # cache using only their mtime and size, so they are never read or hashed. mode is the
+    # dn_cache.cache_mode of the run.
+    for path in paths:
+        if archives and dn_archive.is_archive(path):
+            yield from iter_sample_jobs(dn_archive.iter_samples(path, passwords=passwords), cache, mode)
+            continue
+        if cache is None:
+            yield path, None, None, None
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            yield path, None, None, None
+            continue
+        record = cache.get_by_stat(path, stat, mode)
+        yield path, stat, from_cache(record, path) if record is not None else None, None
+
+def store(record, stat, cache, mode):
+    # Deterministic parse errors are cached too, only unreadable files (no hash) are not.
+    # Strict mode violations depend on the limits used, so they aren't either.
+    if cache is not None and 'sha256' in record and not record.get('violations'):
+        if stat is not None:
+            cache.put(record['path'], stat, record, mode)
+        else:
+            cache.put_report(record, mode) # Archive member or stdin
+    return record
+
+def submit(executor, path, data, hash_files, limits, collect_stats, resources):
+    if data is None:
+        return executor.submit(scan_file, path, hash_files, limits, collect_stats, resources)
+    return executor.submit(scan_data, path, data, hash_files, limits, collect_stats, resources)
+
+def start_pool(workers, limits: mu.Limits):
+    return ProcessPoolExecutor(max_workers=workers, initializer=limit_memory, initargs=(limits,))
+
+def restart_pool(broken, workers, limits: mu.Limits):
+    # Its futures have all failed or are about to, so there is nothing to wait for
+    broken.shutdown(wait=False)
+    return start_pool(workers, limits)
+
+def collect(done, pending, cache, mode):
+    # Records for the finished futures, and the pools that turned out to be broken. A worker killed
+    # at the memory budget or crashed in native code breaks its whole pool, failing every scan
+    # still in it, not only its own
+    records = []
+    broken = set()
+    for future in done:
+        path, stat, executor = pending.pop(future)
+        try:
+            records.append(store(future.result(), stat, cache, mode))
+        except BrokenProcessPool:
+            records.append({'name': path, 'error': 'BrokenProcessPool: The worker process died while scanning the sample', 'path': path})
+            broken.add(executor)
+    return records, broken
+
+def scan(paths, workers=None, cache=None, limits: mu.Limits = None, archives=False, passwords=dn_archive.PASSWORDS, samples=None, collect_stats=False, resources: dn_resources.ResourceOptions = None):
+    # Yield one record per path as results complete. Submissions are capped so huge
+    # corpora don't queue millions of futures up front. With archives, zip and tar files are
+    # expanded into their members. samples is an iterable of (name, data, error) to scan as well.
+    # With collect_stats, freshly parsed records carry a dn_stats.FileStats dict under 'stats'.
+    # Non-default resources options change the reports and may dump files, so they skip the cache.
+    if resources is not None:
+        cache = None
+    hash_files = cache is not None
+    mode = dn_cache.cache_mode(limits)
+    jobs = iter_jobs(paths, cache, mode, archives, passwords)
+    if samples is not None:
+        jobs = itertools.chain(iter_sample_jobs(samples, cache, mode), jobs)
+    # The memory budget is applied to worker processes only, never to the caller
+    if workers == 1 and not (limits and limits.memory_budget):
+        for path, stat, record, data in jobs:
+            if record is None:
+                record = store(scan_file(path, hash_files, limits, collect_stats, resources) if data is None else scan_data(path, data, hash_files, limits, collect_stats, resources), stat, cache, mode)
+            yield record
+        return
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * 4
+    executor = start_pool(workers, limits)
+    try:
+        pending = {}
+        for path, stat, record, data in jobs:
+            if record is not None:
+                yield record
+                continue
+            try:
+                future = submit(executor, path, data, hash_files, limits, collect_stats, resources)
+            except BrokenProcessPool:
+                # The pool broke after its last results were collected
+                executor = restart_pool(executor, workers, limits)
+                future = submit(executor, path, data, hash_files, limits, collect_stats, resources)
+            pending[future] = path, stat, executor
+            if len(pending) >= max_pending:
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                records, broken = collect(done, pending, cache, mode)
+                yield from records
+                if executor in broken:
+                    executor = restart_pool(executor, workers, limits)
+        while pending:
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            records, broken = collect(done, pending, cache, mode)
+            yield from records
+    finally:
+        executor.shutdown(wait=True)
+
+def run_batch(specs, workers=None, cache=None, limits: mu.Limits = None, archives=False, passwords=dn_archive.PASSWORDS, samples=None, stats: dn_stats.RunStats = None, out=sys.stdout, err=sys.stderr, resources: dn_resources.ResourceOptions = None):
+    count = 0
+    errors = 0
+    cached = 0
+    violations = 0
+    start = time.perf_counter()
+    for record in scan(iter_paths(specs), workers, cache, limits, archives, passwords, samples, stats is not None, resources):
+        count += 1
+        file_stats = record.pop('stats', None)
+        if stats is not None and file_stats:
+            stats.add(file_stats)
+        if 'error' in record:
+            errors += 1
+        if record.get('violations'):
+            violations += 1
+        if record.get('cached'):
+            cached += 1
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    err.write(f'Processed {count} files ({errors} errors, {violations} with violations, {cached} from cache) in {elapsed:.2f}s: {rate:.1f} files/sec\n')
+    return count, errors
@@ -0,0 +1,171 @@
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pefile
+import dn_batch
+import dn_extract
+import dn_stats
+import dn_synth
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def time_call(func, *args, repeat=1):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best
+
+def full_load(path):
+    pefile.PE(path).close()
+
+def fast_load(path):
+    dn_extract.load_pe(path).close()
+
+def compare_pe_loading(paths, repeat=1):
+    print("{:<60} {:>12} {:>12} {:>10}".format('File', 'Full (ms)', 'Fast (ms)', 'Speedup'))
+    total_full = 0.0
+    total_fast = 0.0
+    for path in paths:
+        try:
+            full = time_call(full_load, path, repeat=repeat)
+            fast = time_call(fast_load, path, repeat=repeat)
+        except pefile.PEFormatError:
+            continue
+        total_full += full
+        total_fast += fast
+        print(f'{path[-60:]:<60} {full * 1000:>12.2f} {fast * 1000:>12.2f} {full / fast:>9.1f}x')
+    if total_fast:
+        print(f'{"Total":<60} {total_full * 1000:>12.2f} {total_fast * 1000:>12.2f} {total_full / total_fast:>9.1f}x')
+
+def phase_times(path_or_bytes, totals):
+    # Adds the seconds spent in each dn_extract phase to totals
+    stats = dn_stats.FileStats()
+    dn_extract.extract(path_or_bytes, stats=stats)
+    for phase, entry in stats.phases.items():
+        totals[phase] = totals.get(phase, 0.0) + entry['seconds']
+    return totals
+
+def print_phases(totals, count):
+    total = sum(totals.values())
+    print("{:<14} {:>14} {:>8}".format('Phase', 'ms per file', 'Share'))
+    for phase in dn_stats.PHASES:
+        elapsed = totals.get(phase, 0.0)
+        print(f'{phase:<14} {elapsed * 1000 / count:>14.3f} {elapsed / total * 100 if total else 0:>7.1f}%')
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None
+
+def run_corpus(scenario, count, repeat=1):
+    # Runs in a fresh process so peak RSS only covers this corpus. Samples are generated one at a
+    # time and only parsing is timed, keeping the fastest of repeat parses of each. rss_growth_kb is
+    # how far the peak rose after the first sample was built, i.e. what parsing took on top of
+    # holding one sample
+    totals = {}
+    elapsed = 0.0
+    sample_size = None
+    start_rss = None
+    for name, data in dn_synth.iter_corpus(scenario, count):
+        if start_rss is None:
+            sample_size = len(data)
+            start_rss = peak_rss_kb()
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            phases = phase_times(data, {})
+            run = time.perf_counter() - start
+            if best is None or run < best:
+                best, best_phases = run, phases
+        for phase, seconds in best_phases.items():
+            totals[phase] = totals.get(phase, 0.0) + seconds
+        elapsed += best
+        del data
+    peak_rss = peak_rss_kb()
+    return {
+        'scenario': scenario,
+        'count': count,
+        'sample_size': sample_size,
+        'files_per_sec': count / elapsed if elapsed > 0 else 0.0,
+        'phases_ms': {phase: totals.get(phase, 0.0) * 1000 / count for phase in dn_stats.PHASES},
+        'peak_rss_kb': peak_rss,
+        'rss_growth_kb': peak_rss - start_rss if peak_rss is not None else None
+    }
+
+def format_kb(kb):
+    return f'{kb / 1024:.1f}' if kb is not None else 'n/a'
+
+def synthetic_benchmark(scenarios, sizes, repeat=1):
+    results = []
+    print("{:<14} {:>7} {:>12} {:>12} {:>14} {:>16}   {}".format('Scenario', 'Files', 'Size', 'Files/sec', 'Peak RSS (MB)', 'RSS growth (MB)', 'Slowest phase'))
+    for scenario in scenarios:
+        for count in sizes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_corpus, scenario, count, repeat).result()
+            slowest = max(result['phases_ms'], key=result['phases_ms'].get)
+            print(f'{scenario:<14} {count:>7} {result["sample_size"]:>12} {result["files_per_sec"]:>12.1f} {format_kb(result["peak_rss_kb"]):>14} {format_kb(result["rss_growth_kb"]):>16}   {slowest} ({result["phases_ms"][slowest]:.3f} ms)')
+            results.append(result)
+    return results
+
+def check_baseline(results, baseline, tolerance):
+    # Names of the runs that got slower than the baseline by more than tolerance (0.2 = 20%)
+    previous = {(result['scenario'], result['count']): result['files_per_sec'] for result in baseline}
+    slower = []
+    for result in results:
+        before = previous.get((result['scenario'], result['count']))
+        if before and result['files_per_sec'] < before * (1 - tolerance):
+            slower.append(f'{result["scenario"]}/{result["count"]}: {result["files_per_sec"]:.1f} files/sec, baseline {before:.1f}')
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parser on real files or a synthetic corpus.')
+    parser.add_argument('file', nargs='*', help='Files, directories or globs to benchmark.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Keep the best of this many runs per file.')
+    parser.add_argument('--phases', action='store_true', help='Time each extraction phase over the files instead of comparing pefile loading.')
+    parser.add_argument('--synthetic', action='store_true', help='Benchmark generated corpora (see dn_synth.py) instead of files.')
+    parser.add_argument('-s', '--scenario', action='append', choices=dn_synth.SCENARIOS, help='Synthetic scenarios to run (default: all).')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10], help='Synthetic corpus sizes to run.')
+    parser.add_argument('--json', help='Write the synthetic results here, e.g. to use as a baseline later.')
+    parser.add_argument('--baseline', help='Fail if any synthetic run is slower than in this --json file.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown against --baseline (default: 0.2 = 20%%).')
+    args = parser.parse_args()
+    if args.synthetic:
+        results = synthetic_benchmark(args.scenario or list(dn_synth.SCENARIOS), args.sizes, args.repeat)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                slower = check_baseline(results, json.load(f), args.tolerance)
+            for line in slower:
+                print(f'SLOWER: {line}')
+            sys.exit(1 if slower else 0)
+        return
+    if not args.file:
+        parser.error('No files given')
+    if args.phases:
+        totals = {}
+        count = 0
+        start = time.perf_counter()
+        for path in dn_batch.iter_paths(args.file):
+            try:
+                phase_times(path, totals)
+            except Exception:
+                continue
+            count += 1
+        elapsed = time.perf_counter() - start
+        if count:
+            print_phases(totals, count)
+            print(f'{count} files in {elapsed:.2f}s: {count / elapsed:.1f} files/sec')
+        return
+    compare_pe_loading(dn_batch.iter_paths(args.file), args.repeat)
+
+if __name__ == '__main__':
+    main()
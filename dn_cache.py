@@ -0,0 +1,151 @@
+import os
+import json
+import sqlite3
+import argparse
+import dn_extract
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    sha256 TEXT NOT NULL,
+    parser_version INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    report TEXT NOT NULL,
+    PRIMARY KEY (sha256, parser_version, mode)
+);
+CREATE TABLE IF NOT EXISTS report_keys (
+    sha256 TEXT NOT NULL,
+    parser_version INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS report_keys_value ON report_keys (kind, value);
+CREATE INDEX IF NOT EXISTS report_keys_sha256 ON report_keys (sha256, parser_version);
+'''
+
+# Caches from before reports were stored per parse mode. Strict reports were only kept without
+# violations, so everything in them is valid for lax runs
+MIGRATE_MODE = '''
+ALTER TABLE reports RENAME TO reports_old;
+CREATE TABLE reports (
+    sha256 TEXT NOT NULL,
+    parser_version INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    report TEXT NOT NULL,
+    PRIMARY KEY (sha256, parser_version, mode)
+);
+INSERT INTO reports SELECT sha256, parser_version, 'lax', report FROM reports_old;
+DROP TABLE reports_old;
+'''
+
+# Record fields that can be queried, mapped to the kind stored in report_keys
+QUERY_KINDS = {'mvid': 'mvid', 'typelib_ids': 'typelib_id', 'assembly_name': 'assembly_name'}
+
+def cache_mode(limits):
+    # Reports are stored per parse mode, so a strict run never gets a report that skipped the
+    # bounds checks. The time and memory budgets don't change a report that finished, so only
+    # the caps are part of the mode
+    if limits is None:
+        return 'lax'
+    return f'strict:{limits.max_streams}:{limits.max_rows}:{limits.max_bytes}'
+
+class ReportCache:
+    # Local SQLite store of reports keyed by (SHA-256, parser version, mode). Paths are tracked
+    # with their mtime and size so unchanged files are skipped without being hashed.
+
+    def __init__(self, path, parser_version=dn_extract.PARSER_VERSION, commit_every=500):
+        self.parser_version = parser_version
+        self.commit_every = commit_every
+        self.pending = 0
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        if 'mode' not in [column for cid, column, *rest in self.db.execute('PRAGMA table_info(reports)')]:
+            self.db.executescript(MIGRATE_MODE)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_by_stat(self, path, stat: os.stat_result, mode='lax'):
+        # The cached record for path if the file hasn't changed since it was stored
+        row = self.db.execute('SELECT sha256 FROM files WHERE path = ? AND mtime_ns = ? AND size = ?', (path, stat.st_mtime_ns, stat.st_size)).fetchone()
+        return self.get(row[0], mode) if row else None
+
+    def get(self, sha256, mode='lax'):
+        # mode is from cache_mode, the report of a lax run is never returned for a strict one
+        row = self.db.execute('SELECT report FROM reports WHERE sha256 = ? AND parser_version = ? AND mode = ?', (sha256, self.parser_version, mode)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, path, stat: os.stat_result, record, mode='lax'):
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (path, stat.st_mtime_ns, stat.st_size, record['sha256']))
+        self.put_report(record, mode)
+
+    def put_report(self, record, mode='lax'):
+        # Store a report without a file on disk to track, e.g. an archive member
+        sha256 = record['sha256']
+        stored = {key: value for key, value in record.items() if key not in ('path', 'cached', 'stats')}
+        indexed = self.db.execute('SELECT 1 FROM reports WHERE sha256 = ? AND parser_version = ?', (sha256, self.parser_version)).fetchone()
+        if self.db.execute('INSERT OR IGNORE INTO reports VALUES (?, ?, ?, ?)', (sha256, self.parser_version, mode, json.dumps(stored))).rowcount and not indexed:
+            # The query keys are the same in every mode, so they are only stored once
+            keys = []
+            for field, kind in QUERY_KINDS.items():
+                values = record.get(field)
+                for value in values if isinstance(values, list) else [values]:
+                    if value:
+                        keys.append((sha256, self.parser_version, kind, value))
+            self.db.executemany('INSERT INTO report_keys VALUES (?, ?, ?, ?)', keys)
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.db.commit()
+            self.pending = 0
+
+    def iter_reports(self):
+        # Every sample stored for the current parser version, one report each whatever the mode
+        for (report,) in self.db.execute('SELECT report FROM reports WHERE parser_version = ? GROUP BY sha256', (self.parser_version,)):
+            yield json.loads(report)
+
+    def query(self, kind, value):
+        # Every cached report (any parser version) with a matching MVID, TypeLib ID or assembly name
+        rows = self.db.execute('''
+            SELECT reports.sha256, reports.parser_version, reports.report FROM report_keys
+            JOIN reports ON reports.sha256 = report_keys.sha256 AND reports.parser_version = report_keys.parser_version
+            WHERE report_keys.kind = ? AND report_keys.value = ?
+            GROUP BY reports.sha256, reports.parser_version
+            ORDER BY reports.parser_version DESC''', (kind, value))
+        for sha256, parser_version, report in rows:
+            record = json.loads(report)
+            record['parser_version'] = parser_version
+            record['paths'] = [path for (path,) in self.db.execute('SELECT path FROM files WHERE sha256 = ?', (sha256,))]
+            yield record
+
+def main():
+    parser = argparse.ArgumentParser(description='Query reports stored by parser_main.py --jsonl --cache.')
+    parser.add_argument('cache', help='The SQLite cache file.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--mvid', help='Module version ID, e.g. 7aaf2c8a-9184-478c-b5bf-5415b683eb30')
+    group.add_argument('--typelib', help='TypeLib ID from the assembly GuidAttribute.')
+    group.add_argument('--assembly-name', help='Assembly name (case-insensitive).')
+    args = parser.parse_args()
+    if args.mvid:
+        kind, value = 'mvid', args.mvid
+    elif args.typelib:
+        kind, value = 'typelib_id', args.typelib
+    else:
+        kind, value = 'assembly_name', args.assembly_name
+    with ReportCache(args.cache) as cache:
+        for record in cache.query(kind, value):
+            print(json.dumps(record))
+
+if __name__ == '__main__':
+    main()
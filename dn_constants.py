@@ -81,45 +81,411 @@ RESOLUTION_SCOPE = ['Module','ModuleRef','AssemblyRef','TypeRef']
 
 TYPE_OR_METHOD_DEF = ['TypeDef','MethodDef']
 
+# Indirection tables that only appear in unoptimized (#-) metadata. List columns such as
+# TypeDef.FieldList index into the Ptr table, which in turn holds the real row
+PTR_TABLES = {
+    'Field':        'FieldPtr',
+    'MethodDef':    'MethodPtr',
+    'Param':        'ParamPtr',
+    'Event':        'EventPtr',
+    'Property':     'PropertyPtr'
+}
+
+# (owner table, list column) -> table the list runs over
+LIST_COLUMNS = {
+    ('TypeDef', 'FieldList'):       'Field',
+    ('TypeDef', 'MethodList'):      'MethodDef',
+    ('MethodDef', 'ParamList'):     'Param',
+    ('EventMap', 'EventList'):      'Event',
+    ('PropertyMap', 'PropertyList'):'Property'
+}
+
+HAS_CUSTOM_DEBUG_INFORMATION = ['MethodDef', 'Field', 'TypeRef', 'TypeDef', 'Param', 'InterfaceImpl', 'MemberRef', 'Module', 'DeclSecurity', 'Property', 'Event', 'StandAloneSig', 'ModuleRef', 'TypeSpec', 'Assembly', 'AssemblyRef', 'File', 'ExportedType', 'ManifestResource', 'GenericParam', 'GenericParamConstraint', 'MethodSpec', 'Document', 'LocalScope', 'LocalVariable', 'LocalConstant', 'ImportScope']
+
+CODED_INDEXES = {
+    'HasCustomAttribute':           HAS_CUSTOM_ATTRIBUTE,
+    'TypeDefOrRef':                 TYPE_DEF_OR_REF,
+    'HasConstant':                  HAS_CONSTANT,
+    'HasFieldMarshal':              HAS_FIELD_MARSHAL,
+    'HasDeclSecurity':              HAS_DECL_SECURITY,
+    'MemberRefParent':              MEMBER_REF_PARENT,
+    'HasSemantics':                 HAS_SEMANTICS,
+    'MethodDefOrRef':               METHOD_DEF_OR_REF,
+    'MemberForwarded':              MEMBER_FORWARDED,
+    'Implementation':               IMPLEMENTATION,
+    'CustomAttributeType':          CUSTOM_ATTRIBUTE_TYPE,
+    'ResolutionScope':              RESOLUTION_SCOPE,
+    'TypeOrMethodDef':              TYPE_OR_METHOD_DEF,
+    'HasCustomDebugInformation':    HAS_CUSTOM_DEBUG_INFORMATION
+}
+
 #If e is a simple index into a table with index i, it is stored using 2 bytes if table i has
-#less than 216 rows, otherwise it is stored using 4 bytes.
-# Add all simple & coded indexes to the size list
-
-ROW_SIZE_FUNCS = {
-    'Module': lambda index_sizes: 2 + index_sizes['#Strings'] + 3 * index_sizes['#GUID'],
-    'TypeRef': lambda index_sizes: index_sizes['ResolutionScope'] + 2 * index_sizes['#Strings'],
-    'TypeDef': lambda index_sizes: 4 + 2 * index_sizes['#Strings'] + index_sizes['TypeDefOrRef'] + index_sizes['Field'] + index_sizes['MethodDef'],
-    'Field': lambda index_sizes: 2 + index_sizes['#Strings'] + index_sizes['#Blob'],
-    'MethodDef': lambda index_sizes: 4 + 2 + 2 + index_sizes['#Strings'] + index_sizes['#Blob'] + index_sizes['Param'],
-    'Param': lambda index_sizes: 2 + 2 + index_sizes['#Strings'],
-    'InterfaceImpl': lambda index_sizes: index_sizes['TypeDef'] + index_sizes['TypeDefOrRef'],
-    'MemberRef': lambda index_sizes: index_sizes['MemberRefParent'] + index_sizes['#Strings'] + index_sizes['#Blob'],
-    'Constant': lambda index_sizes: 1 + 1 + index_sizes['HasConstant'] + index_sizes['#Blob'],    
-    'CustomAttribute': lambda index_sizes: index_sizes['HasCustomAttribute'] + index_sizes['CustomAttributeType'] + index_sizes['#Blob'],
-    'FieldMarshal': lambda index_sizes: index_sizes['HasFieldMarshal'] + index_sizes['#Blob'],
-    'DeclSecurity': lambda index_sizes: 2 + index_sizes['HasDeclSecurity'] + index_sizes['#Blob'],
-    'ClassLayout': lambda index_sizes: 2 + 4 + index_sizes['TypeDef'],
-    'FieldLayout': lambda index_sizes: 4 + index_sizes['Field'],
-    'StandAloneSig': lambda index_sizes: index_sizes['#Blob'],
-    'EventMap': lambda index_sizes: index_sizes['TypeDef'] + index_sizes['Event'],
-    'Event': lambda index_sizes: 2 + index_sizes['#Strings'] + index_sizes['TypeDefOrRef'],
-    'PropertyMap': lambda index_sizes: index_sizes['TypeDef'] + index_sizes['Property'],
-    'Property': lambda index_sizes: 2 + index_sizes['#Strings'] + index_sizes['#Blob'],
-    'MethodSemantics': lambda index_sizes: 2 + index_sizes['MethodDef'] + index_sizes['HasSemantics'],
-    'MethodImpl': lambda index_sizes: index_sizes['TypeDef'] + 2 * index_sizes['MethodDefOrRef'],
-    'ModuleRef': lambda index_sizes: index_sizes['#Strings'],
-    'TypeSpec': lambda index_sizes: index_sizes['#Blob'],
-    'ImplMap': lambda index_sizes: 2 + index_sizes['MemberForwarded'] + index_sizes['#Strings'] + index_sizes['ModuleRef'],
-    'FieldRVA': lambda index_sizes: 4 + index_sizes['Field'],
-    'Assembly': lambda index_sizes: 4 + 2 + 2 + 2 + 2 + 4 + index_sizes['#Blob'] + 2 * index_sizes['#Strings'],
-    'AssemblyProcessor': lambda index_sizes: 4 + index_sizes['AssemblyRef'],
-    'AssemblyOS': lambda index_sizes: 4 + index_sizes['AssemblyRef'], 
-    'AssemblyRef': lambda index_sizes: 4 * 2 + 4 + index_sizes['#Blob'] + index_sizes['#Strings'] + index_sizes['#Strings'] + index_sizes['#Blob'],
-    'AssemblyRefProcessor': lambda index_sizes: 4 + index_sizes['AssemblyRef'],
-    'AssemblyRefOS': lambda index_sizes: 4 + 4 + 4 + index_sizes['AssemblyRef'],
-    'File': lambda index_sizes: 4 + index_sizes['#Strings'] + index_sizes['#Blob'],
-    'ExportedType': lambda index_sizes: 4 + 4 + index_sizes['#Strings'] + index_sizes['#Strings'] + index_sizes['Implementation'],
-    'ManifestResource': lambda index_sizes: 4 + 4 + index_sizes['#Strings'] + index_sizes['Implementation'],
-    'NestedClass': lambda index_sizes: index_sizes['TypeDef'] + index_sizes['TypeDef']
-    # Need to do the rest, but for now all we really need is up to AssemblyRef
-}
\ No newline at end of file
+#less than 2^16 rows, otherwise it is stored using 4 bytes.
+# Column sizes are either a fixed number of bytes or a key into Metadata.index_sizes (heap, table or coded index)
+# ECMA-335 II.22, plus the Portable PDB tables
+TABLE_COLUMNS = {
+    'Module':                   [('Generation', 2), ('Name', '#Strings'), ('Mvid', '#GUID'), ('EncId', '#GUID'), ('EncBaseId', '#GUID')],
+    'TypeRef':                  [('ResolutionScope', 'ResolutionScope'), ('TypeName', '#Strings'), ('TypeNamespace', '#Strings')],
+    'TypeDef':                  [('Flags', 4), ('TypeName', '#Strings'), ('TypeNamespace', '#Strings'), ('Extends', 'TypeDefOrRef'), ('FieldList', 'Field'), ('MethodList', 'MethodDef')],
+    'FieldPtr':                 [('Field', 'Field')],
+    'Field':                    [('Flags', 2), ('Name', '#Strings'), ('Signature', '#Blob')],
+    'MethodPtr':                [('Method', 'MethodDef')],
+    'MethodDef':                [('RVA', 4), ('ImplFlags', 2), ('Flags', 2), ('Name', '#Strings'), ('Signature', '#Blob'), ('ParamList', 'Param')],
+    'ParamPtr':                 [('Param', 'Param')],
+    'Param':                    [('Flags', 2), ('Sequence', 2), ('Name', '#Strings')],
+    'InterfaceImpl':            [('Class', 'TypeDef'), ('Interface', 'TypeDefOrRef')],
+    'MemberRef':                [('Class', 'MemberRefParent'), ('Name', '#Strings'), ('Signature', '#Blob')],
+    'Constant':                 [('Type', 1), ('Padding', 1), ('Parent', 'HasConstant'), ('Value', '#Blob')],
+    'CustomAttribute':          [('Parent', 'HasCustomAttribute'), ('Type', 'CustomAttributeType'), ('Value', '#Blob')],
+    'FieldMarshal':             [('Parent', 'HasFieldMarshal'), ('NativeType', '#Blob')],
+    'DeclSecurity':             [('Action', 2), ('Parent', 'HasDeclSecurity'), ('PermissionSet', '#Blob')],
+    'ClassLayout':              [('PackingSize', 2), ('ClassSize', 4), ('Parent', 'TypeDef')],
+    'FieldLayout':              [('Offset', 4), ('Field', 'Field')],
+    'StandAloneSig':            [('Signature', '#Blob')],
+    'EventMap':                 [('Parent', 'TypeDef'), ('EventList', 'Event')],
+    'EventPtr':                 [('Event', 'Event')],
+    'Event':                    [('EventFlags', 2), ('Name', '#Strings'), ('EventType', 'TypeDefOrRef')],
+    'PropertyMap':              [('Parent', 'TypeDef'), ('PropertyList', 'Property')],
+    'PropertyPtr':              [('Property', 'Property')],
+    'Property':                 [('Flags', 2), ('Name', '#Strings'), ('Type', '#Blob')],
+    'MethodSemantics':          [('Semantics', 2), ('Method', 'MethodDef'), ('Association', 'HasSemantics')],
+    'MethodImpl':               [('Class', 'TypeDef'), ('MethodBody', 'MethodDefOrRef'), ('MethodDeclaration', 'MethodDefOrRef')],
+    'ModuleRef':                [('Name', '#Strings')],
+    'TypeSpec':                 [('Signature', '#Blob')],
+    'ImplMap':                  [('MappingFlags', 2), ('MemberForwarded', 'MemberForwarded'), ('ImportName', '#Strings'), ('ImportScope', 'ModuleRef')],
+    'FieldRVA':                 [('RVA', 4), ('Field', 'Field')],
+    'EncLog':                   [('Token', 4), ('FuncCode', 4)],
+    'EncMap':                   [('Token', 4)],
+    'Assembly':                 [('HashAlgId', 4), ('MajorVersion', 2), ('MinorVersion', 2), ('BuildNumber', 2), ('RevisionNumber', 2), ('Flags', 4), ('PublicKey', '#Blob'), ('Name', '#Strings'), ('Culture', '#Strings')],
+    'AssemblyProcessor':        [('Processor', 4)],
+    'AssemblyOS':               [('OSPlatformID', 4), ('OSMajorVersion', 4), ('OSMinorVersion', 4)],
+    'AssemblyRef':              [('MajorVersion', 2), ('MinorVersion', 2), ('BuildNumber', 2), ('RevisionNumber', 2), ('Flags', 4), ('PublicKeyOrToken', '#Blob'), ('Name', '#Strings'), ('Culture', '#Strings'), ('HashValue', '#Blob')],
+    'AssemblyRefProcessor':     [('Processor', 4), ('AssemblyRef', 'AssemblyRef')],
+    'AssemblyRefOS':            [('OSPlatformID', 4), ('OSMajorVersion', 4), ('OSMinorVersion', 4), ('AssemblyRef', 'AssemblyRef')],
+    'File':                     [('Flags', 4), ('Name', '#Strings'), ('HashValue', '#Blob')],
+    'ExportedType':             [('Flags', 4), ('TypeDefId', 4), ('TypeName', '#Strings'), ('TypeNamespace', '#Strings'), ('Implementation', 'Implementation')],
+    'ManifestResource':         [('Offset', 4), ('Flags', 4), ('Name', '#Strings'), ('Implementation', 'Implementation')],
+    'NestedClass':              [('NestedClass', 'TypeDef'), ('EnclosingClass', 'TypeDef')],
+    'GenericParam':             [('Number', 2), ('Flags', 2), ('Owner', 'TypeOrMethodDef'), ('Name', '#Strings')],
+    'MethodSpec':               [('Method', 'MethodDefOrRef'), ('Instantiation', '#Blob')],
+    'GenericParamConstraint':   [('Owner', 'GenericParam'), ('Constraint', 'TypeDefOrRef')],
+    'Document':                 [('Name', '#Blob'), ('HashAlgorithm', '#GUID'), ('Hash', '#Blob'), ('Language', '#GUID')],
+    'MethodDebugInformation':   [('Document', 'Document'), ('SequencePoints', '#Blob')],
+    'LocalScope':               [('Method', 'MethodDef'), ('ImportScope', 'ImportScope'), ('VariableList', 'LocalVariable'), ('ConstantList', 'LocalConstant'), ('StartOffset', 4), ('Length', 4)],
+    'LocalVariable':            [('Attributes', 2), ('Index', 2), ('Name', '#Strings')],
+    'LocalConstant':            [('Name', '#Strings'), ('Signature', '#Blob')],
+    'ImportScope':              [('Parent', 'ImportScope'), ('Imports', '#Blob')],
+    'StateMachineMethod':       [('MoveNextMethod', 'MethodDef'), ('KickoffMethod', 'MethodDef')],
+    'CustomDebugInformation':   [('Parent', 'HasCustomDebugInformation'), ('Kind', '#GUID'), ('Value', '#Blob')]
+}
+
+STRUCT_FORMATS = {1: 'B', 2: 'H', 4: 'I'}
+
+# ECMA-335 II.23.1.16 element types used in signatures, plus the custom attribute only codes
+ELEMENT_TYPES = {
+    0x01:   'Void',
+    0x02:   'Boolean',
+    0x03:   'Char',
+    0x04:   'SByte',
+    0x05:   'Byte',
+    0x06:   'Int16',
+    0x07:   'UInt16',
+    0x08:   'Int32',
+    0x09:   'UInt32',
+    0x0A:   'Int64',
+    0x0B:   'UInt64',
+    0x0C:   'Single',
+    0x0D:   'Double',
+    0x0E:   'String',
+    0x0F:   'Ptr',
+    0x10:   'ByRef',
+    0x11:   'ValueType',
+    0x12:   'Class',
+    0x13:   'Var',
+    0x14:   'Array',
+    0x15:   'GenericInst',
+    0x16:   'TypedByRef',
+    0x18:   'IntPtr',
+    0x19:   'UIntPtr',
+    0x1B:   'FnPtr',
+    0x1C:   'Object',
+    0x1D:   'SZArray',
+    0x1E:   'MVar',
+    0x1F:   'CModReqd',
+    0x20:   'CModOpt',
+    0x41:   'Sentinel',
+    0x45:   'Pinned',
+    0x50:   'Type',
+    0x51:   'Boxed',
+    0x53:   'Field',
+    0x54:   'Property',
+    0x55:   'Enum'
+}
+
+# Fixed size values in custom attribute blobs, by element type
+ELEMENT_TYPE_FORMATS = {
+    0x02:   '<?',
+    0x03:   '<H',
+    0x04:   '<b',
+    0x05:   '<B',
+    0x06:   '<h',
+    0x07:   '<H',
+    0x08:   '<i',
+    0x09:   '<I',
+    0x0A:   '<q',
+    0x0B:   '<Q',
+    0x0C:   '<f',
+    0x0D:   '<d'
+}
+
+
+# ECMA-335 III.1.9 one-byte opcodes: (name, operand type)
+IL_OPCODES = {
+    0x00:   ('nop', 'InlineNone'),
+    0x01:   ('break', 'InlineNone'),
+    0x02:   ('ldarg.0', 'InlineNone'),
+    0x03:   ('ldarg.1', 'InlineNone'),
+    0x04:   ('ldarg.2', 'InlineNone'),
+    0x05:   ('ldarg.3', 'InlineNone'),
+    0x06:   ('ldloc.0', 'InlineNone'),
+    0x07:   ('ldloc.1', 'InlineNone'),
+    0x08:   ('ldloc.2', 'InlineNone'),
+    0x09:   ('ldloc.3', 'InlineNone'),
+    0x0A:   ('stloc.0', 'InlineNone'),
+    0x0B:   ('stloc.1', 'InlineNone'),
+    0x0C:   ('stloc.2', 'InlineNone'),
+    0x0D:   ('stloc.3', 'InlineNone'),
+    0x0E:   ('ldarg.s', 'ShortInlineVar'),
+    0x0F:   ('ldarga.s', 'ShortInlineVar'),
+    0x10:   ('starg.s', 'ShortInlineVar'),
+    0x11:   ('ldloc.s', 'ShortInlineVar'),
+    0x12:   ('ldloca.s', 'ShortInlineVar'),
+    0x13:   ('stloc.s', 'ShortInlineVar'),
+    0x14:   ('ldnull', 'InlineNone'),
+    0x15:   ('ldc.i4.m1', 'InlineNone'),
+    0x16:   ('ldc.i4.0', 'InlineNone'),
+    0x17:   ('ldc.i4.1', 'InlineNone'),
+    0x18:   ('ldc.i4.2', 'InlineNone'),
+    0x19:   ('ldc.i4.3', 'InlineNone'),
+    0x1A:   ('ldc.i4.4', 'InlineNone'),
+    0x1B:   ('ldc.i4.5', 'InlineNone'),
+    0x1C:   ('ldc.i4.6', 'InlineNone'),
+    0x1D:   ('ldc.i4.7', 'InlineNone'),
+    0x1E:   ('ldc.i4.8', 'InlineNone'),
+    0x1F:   ('ldc.i4.s', 'ShortInlineI'),
+    0x20:   ('ldc.i4', 'InlineI'),
+    0x21:   ('ldc.i8', 'InlineI8'),
+    0x22:   ('ldc.r4', 'ShortInlineR'),
+    0x23:   ('ldc.r8', 'InlineR'),
+    0x25:   ('dup', 'InlineNone'),
+    0x26:   ('pop', 'InlineNone'),
+    0x27:   ('jmp', 'InlineMethod'),
+    0x28:   ('call', 'InlineMethod'),
+    0x29:   ('calli', 'InlineSig'),
+    0x2A:   ('ret', 'InlineNone'),
+    0x2B:   ('br.s', 'ShortInlineBrTarget'),
+    0x2C:   ('brfalse.s', 'ShortInlineBrTarget'),
+    0x2D:   ('brtrue.s', 'ShortInlineBrTarget'),
+    0x2E:   ('beq.s', 'ShortInlineBrTarget'),
+    0x2F:   ('bge.s', 'ShortInlineBrTarget'),
+    0x30:   ('bgt.s', 'ShortInlineBrTarget'),
+    0x31:   ('ble.s', 'ShortInlineBrTarget'),
+    0x32:   ('blt.s', 'ShortInlineBrTarget'),
+    0x33:   ('bne.un.s', 'ShortInlineBrTarget'),
+    0x34:   ('bge.un.s', 'ShortInlineBrTarget'),
+    0x35:   ('bgt.un.s', 'ShortInlineBrTarget'),
+    0x36:   ('ble.un.s', 'ShortInlineBrTarget'),
+    0x37:   ('blt.un.s', 'ShortInlineBrTarget'),
+    0x38:   ('br', 'InlineBrTarget'),
+    0x39:   ('brfalse', 'InlineBrTarget'),
+    0x3A:   ('brtrue', 'InlineBrTarget'),
+    0x3B:   ('beq', 'InlineBrTarget'),
+    0x3C:   ('bge', 'InlineBrTarget'),
+    0x3D:   ('bgt', 'InlineBrTarget'),
+    0x3E:   ('ble', 'InlineBrTarget'),
+    0x3F:   ('blt', 'InlineBrTarget'),
+    0x40:   ('bne.un', 'InlineBrTarget'),
+    0x41:   ('bge.un', 'InlineBrTarget'),
+    0x42:   ('bgt.un', 'InlineBrTarget'),
+    0x43:   ('ble.un', 'InlineBrTarget'),
+    0x44:   ('blt.un', 'InlineBrTarget'),
+    0x45:   ('switch', 'InlineSwitch'),
+    0x46:   ('ldind.i1', 'InlineNone'),
+    0x47:   ('ldind.u1', 'InlineNone'),
+    0x48:   ('ldind.i2', 'InlineNone'),
+    0x49:   ('ldind.u2', 'InlineNone'),
+    0x4A:   ('ldind.i4', 'InlineNone'),
+    0x4B:   ('ldind.u4', 'InlineNone'),
+    0x4C:   ('ldind.i8', 'InlineNone'),
+    0x4D:   ('ldind.i', 'InlineNone'),
+    0x4E:   ('ldind.r4', 'InlineNone'),
+    0x4F:   ('ldind.r8', 'InlineNone'),
+    0x50:   ('ldind.ref', 'InlineNone'),
+    0x51:   ('stind.ref', 'InlineNone'),
+    0x52:   ('stind.i1', 'InlineNone'),
+    0x53:   ('stind.i2', 'InlineNone'),
+    0x54:   ('stind.i4', 'InlineNone'),
+    0x55:   ('stind.i8', 'InlineNone'),
+    0x56:   ('stind.r4', 'InlineNone'),
+    0x57:   ('stind.r8', 'InlineNone'),
+    0x58:   ('add', 'InlineNone'),
+    0x59:   ('sub', 'InlineNone'),
+    0x5A:   ('mul', 'InlineNone'),
+    0x5B:   ('div', 'InlineNone'),
+    0x5C:   ('div.un', 'InlineNone'),
+    0x5D:   ('rem', 'InlineNone'),
+    0x5E:   ('rem.un', 'InlineNone'),
+    0x5F:   ('and', 'InlineNone'),
+    0x60:   ('or', 'InlineNone'),
+    0x61:   ('xor', 'InlineNone'),
+    0x62:   ('shl', 'InlineNone'),
+    0x63:   ('shr', 'InlineNone'),
+    0x64:   ('shr.un', 'InlineNone'),
+    0x65:   ('neg', 'InlineNone'),
+    0x66:   ('not', 'InlineNone'),
+    0x67:   ('conv.i1', 'InlineNone'),
+    0x68:   ('conv.i2', 'InlineNone'),
+    0x69:   ('conv.i4', 'InlineNone'),
+    0x6A:   ('conv.i8', 'InlineNone'),
+    0x6B:   ('conv.r4', 'InlineNone'),
+    0x6C:   ('conv.r8', 'InlineNone'),
+    0x6D:   ('conv.u4', 'InlineNone'),
+    0x6E:   ('conv.u8', 'InlineNone'),
+    0x6F:   ('callvirt', 'InlineMethod'),
+    0x70:   ('cpobj', 'InlineType'),
+    0x71:   ('ldobj', 'InlineType'),
+    0x72:   ('ldstr', 'InlineString'),
+    0x73:   ('newobj', 'InlineMethod'),
+    0x74:   ('castclass', 'InlineType'),
+    0x75:   ('isinst', 'InlineType'),
+    0x76:   ('conv.r.un', 'InlineNone'),
+    0x79:   ('unbox', 'InlineType'),
+    0x7A:   ('throw', 'InlineNone'),
+    0x7B:   ('ldfld', 'InlineField'),
+    0x7C:   ('ldflda', 'InlineField'),
+    0x7D:   ('stfld', 'InlineField'),
+    0x7E:   ('ldsfld', 'InlineField'),
+    0x7F:   ('ldsflda', 'InlineField'),
+    0x80:   ('stsfld', 'InlineField'),
+    0x81:   ('stobj', 'InlineType'),
+    0x82:   ('conv.ovf.i1.un', 'InlineNone'),
+    0x83:   ('conv.ovf.i2.un', 'InlineNone'),
+    0x84:   ('conv.ovf.i4.un', 'InlineNone'),
+    0x85:   ('conv.ovf.i8.un', 'InlineNone'),
+    0x86:   ('conv.ovf.u1.un', 'InlineNone'),
+    0x87:   ('conv.ovf.u2.un', 'InlineNone'),
+    0x88:   ('conv.ovf.u4.un', 'InlineNone'),
+    0x89:   ('conv.ovf.u8.un', 'InlineNone'),
+    0x8A:   ('conv.ovf.i.un', 'InlineNone'),
+    0x8B:   ('conv.ovf.u.un', 'InlineNone'),
+    0x8C:   ('box', 'InlineType'),
+    0x8D:   ('newarr', 'InlineType'),
+    0x8E:   ('ldlen', 'InlineNone'),
+    0x8F:   ('ldelema', 'InlineType'),
+    0x90:   ('ldelem.i1', 'InlineNone'),
+    0x91:   ('ldelem.u1', 'InlineNone'),
+    0x92:   ('ldelem.i2', 'InlineNone'),
+    0x93:   ('ldelem.u2', 'InlineNone'),
+    0x94:   ('ldelem.i4', 'InlineNone'),
+    0x95:   ('ldelem.u4', 'InlineNone'),
+    0x96:   ('ldelem.i8', 'InlineNone'),
+    0x97:   ('ldelem.i', 'InlineNone'),
+    0x98:   ('ldelem.r4', 'InlineNone'),
+    0x99:   ('ldelem.r8', 'InlineNone'),
+    0x9A:   ('ldelem.ref', 'InlineNone'),
+    0x9B:   ('stelem.i', 'InlineNone'),
+    0x9C:   ('stelem.i1', 'InlineNone'),
+    0x9D:   ('stelem.i2', 'InlineNone'),
+    0x9E:   ('stelem.i4', 'InlineNone'),
+    0x9F:   ('stelem.i8', 'InlineNone'),
+    0xA0:   ('stelem.r4', 'InlineNone'),
+    0xA1:   ('stelem.r8', 'InlineNone'),
+    0xA2:   ('stelem.ref', 'InlineNone'),
+    0xA3:   ('ldelem', 'InlineType'),
+    0xA4:   ('stelem', 'InlineType'),
+    0xA5:   ('unbox.any', 'InlineType'),
+    0xB3:   ('conv.ovf.i1', 'InlineNone'),
+    0xB4:   ('conv.ovf.u1', 'InlineNone'),
+    0xB5:   ('conv.ovf.i2', 'InlineNone'),
+    0xB6:   ('conv.ovf.u2', 'InlineNone'),
+    0xB7:   ('conv.ovf.i4', 'InlineNone'),
+    0xB8:   ('conv.ovf.u4', 'InlineNone'),
+    0xB9:   ('conv.ovf.i8', 'InlineNone'),
+    0xBA:   ('conv.ovf.u8', 'InlineNone'),
+    0xC2:   ('refanyval', 'InlineType'),
+    0xC3:   ('ckfinite', 'InlineNone'),
+    0xC6:   ('mkrefany', 'InlineType'),
+    0xD0:   ('ldtoken', 'InlineTok'),
+    0xD1:   ('conv.u2', 'InlineNone'),
+    0xD2:   ('conv.u1', 'InlineNone'),
+    0xD3:   ('conv.i', 'InlineNone'),
+    0xD4:   ('conv.ovf.i', 'InlineNone'),
+    0xD5:   ('conv.ovf.u', 'InlineNone'),
+    0xD6:   ('add.ovf', 'InlineNone'),
+    0xD7:   ('add.ovf.un', 'InlineNone'),
+    0xD8:   ('mul.ovf', 'InlineNone'),
+    0xD9:   ('mul.ovf.un', 'InlineNone'),
+    0xDA:   ('sub.ovf', 'InlineNone'),
+    0xDB:   ('sub.ovf.un', 'InlineNone'),
+    0xDC:   ('endfinally', 'InlineNone'),
+    0xDD:   ('leave', 'InlineBrTarget'),
+    0xDE:   ('leave.s', 'ShortInlineBrTarget'),
+    0xDF:   ('stind.i', 'InlineNone'),
+    0xE0:   ('conv.u', 'InlineNone')
+}
+
+# Two-byte opcodes, the second byte after the 0xFE prefix
+IL_OPCODES_FE = {
+    0x00:   ('arglist', 'InlineNone'),
+    0x01:   ('ceq', 'InlineNone'),
+    0x02:   ('cgt', 'InlineNone'),
+    0x03:   ('cgt.un', 'InlineNone'),
+    0x04:   ('clt', 'InlineNone'),
+    0x05:   ('clt.un', 'InlineNone'),
+    0x06:   ('ldftn', 'InlineMethod'),
+    0x07:   ('ldvirtftn', 'InlineMethod'),
+    0x09:   ('ldarg', 'InlineVar'),
+    0x0A:   ('ldarga', 'InlineVar'),
+    0x0B:   ('starg', 'InlineVar'),
+    0x0C:   ('ldloc', 'InlineVar'),
+    0x0D:   ('ldloca', 'InlineVar'),
+    0x0E:   ('stloc', 'InlineVar'),
+    0x0F:   ('localloc', 'InlineNone'),
+    0x11:   ('endfilter', 'InlineNone'),
+    0x12:   ('unaligned.', 'ShortInlineI'),
+    0x13:   ('volatile.', 'InlineNone'),
+    0x14:   ('tail.', 'InlineNone'),
+    0x15:   ('initobj', 'InlineType'),
+    0x16:   ('constrained.', 'InlineType'),
+    0x17:   ('cpblk', 'InlineNone'),
+    0x18:   ('initblk', 'InlineNone'),
+    0x19:   ('no.', 'ShortInlineI'),
+    0x1A:   ('rethrow', 'InlineNone'),
+    0x1C:   ('sizeof', 'InlineType'),
+    0x1D:   ('refanytype', 'InlineNone'),
+    0x1E:   ('readonly.', 'InlineNone')
+}
+
+# Operand sizes in bytes. InlineSwitch is a count followed by that many 4-byte targets
+IL_OPERAND_SIZES = {
+    'InlineNone':           0,
+    'ShortInlineVar':       1,
+    'ShortInlineI':         1,
+    'ShortInlineBrTarget':  1,
+    'InlineVar':            2,
+    'InlineI':              4,
+    'ShortInlineR':         4,
+    'InlineBrTarget':       4,
+    'InlineField':          4,
+    'InlineMethod':         4,
+    'InlineSig':            4,
+    'InlineString':         4,
+    'InlineTok':            4,
+    'InlineType':           4,
+    'InlineI8':             8,
+    'InlineR':              8,
+    'InlineSwitch':         4
+}
+
+# Operands that are metadata tokens: the table in the high byte, the row in the low three
+IL_TOKEN_OPERANDS = {'InlineField', 'InlineMethod', 'InlineSig', 'InlineString', 'InlineTok', 'InlineType'}
@@ -0,0 +1,404 @@
+import mmap
+import pefile
+import copy
+import uuid
+import struct
+import hashlib
+import contextlib
+import metadata_util as mu
+import dn_hash
+import dn_attributes
+import dn_resources
+import dn_constants as const
+
+# Bump whenever the report contents change, so cached reports from older versions aren't reused
+PARSER_VERSION = 3
+
+class DotNetReport:
+    def __init__(self, name=None):
+        self.name = name
+        self.is_dotnet = False
+        self.clr_header_rva = None
+        self.metadata_rva = None
+        self.metadata_size = None
+        self.magic = None
+        self.num_streams = 0
+        self.streams = {}
+        self.assembly_name = None
+        self.assembly_version = None
+        self.assembly_version_hex = None
+        self.module_name = None
+        self.mvid = None # Raw 16 bytes as stored in #GUID
+        self.guids = [] # Every #GUID value, only filled when the MVID can't be located through Module
+        self.typelib_ids = []
+        self.attributes = [] # Decoded assembly-level custom attributes from dn_attributes
+        self.hashes = {} # Similarity hashes from dn_hash
+        self.resources = [] # ManifestResource entries, with the entries of .resources blobs
+        self.children = [] # Reports of PE files found in resources, see extract_children
+        self.oddities = []
+        self.violations = [] # Strict mode only: ParseViolation dicts, the first one aborted the sample
+        self.notes = {} # Section name -> messages explaining why a value is missing
+
+    def add_note(self, section, message):
+        self.notes.setdefault(section, []).append(message)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'is_dotnet': self.is_dotnet,
+            'clr_header_rva': self.clr_header_rva,
+            'metadata_rva': self.metadata_rva,
+            'metadata_size': self.metadata_size,
+            'magic': self.magic.hex() if self.magic is not None else None,
+            'num_streams': self.num_streams,
+            'streams': [{'name': s.name, 'size': s.size, 'rva': s.rva, 'phys_addr': s.phys_addr} for s in self.streams.values()],
+            'assembly_name': self.assembly_name,
+            'assembly_version': self.assembly_version,
+            'assembly_version_hex': self.assembly_version_hex,
+            'module_name': self.module_name,
+            'mvid': str(uuid.UUID(bytes_le=self.mvid)) if self.mvid else None,
+            'mvid_hex': self.mvid.hex() if self.mvid else None,
+            'guids': [str(uuid.UUID(bytes_le=guid)) for guid in self.guids],
+            'typelib_ids': self.typelib_ids,
+            'attributes': self.attributes,
+            'hashes': self.hashes,
+            'resources': self.resources,
+            'children': self.children,
+            'oddities': self.oddities,
+            'violations': self.violations,
+            'notes': self.notes
+        }
+
+def is_dotnet(pe: pefile.PE):
+    # Find the CLR dir in OPTIONAL_HEADER.  Validate that it has a VA and size
+    clr_header_entry = pe.OPTIONAL_HEADER.DATA_DIRECTORY[14]
+    return clr_header_entry.VirtualAddress > 0
+
+def check_rva_range(pe: pefile.PE, limits: mu.Limits, kind, what, rva, size):
+    try:
+        offset = pe.get_offset_from_rva(rva)
+    except pefile.PEFormatError:
+        raise mu.ParseViolation(kind, f'{what} RVA {rva:#X} is not inside any section')
+    limits.check_range(kind, what, offset, size, len(pe.__data__))
+
+def find_metadata(pe: pefile.PE, report: DotNetReport, limits: mu.Limits = None):
+    clr_header_entry = pe.OPTIONAL_HEADER.DATA_DIRECTORY[14]
+    report.clr_header_rva = clr_header_entry.VirtualAddress
+    if limits:
+        check_rva_range(pe, limits, 'metadata_bounds', 'CLR header', clr_header_entry.VirtualAddress, 72)
+    metadata_virtual_address = pe.get_dword_at_rva(rva = clr_header_entry.VirtualAddress + 4 + 2 + 2)
+    metadata_size = pe.get_dword_at_rva(rva = clr_header_entry.VirtualAddress + 4 + 2 + 2 + 4)
+    report.metadata_rva = metadata_virtual_address
+    report.metadata_size = metadata_size
+    if limits:
+        check_rva_range(pe, limits, 'metadata_bounds', 'Metadata', metadata_virtual_address, metadata_size)
+        if metadata_size > limits.max_bytes:
+            raise mu.ParseViolation('byte_count', f'Metadata is {metadata_size:#X} bytes, more than the limit of {limits.max_bytes:#X}')
+    report.magic = pe.get_data(metadata_virtual_address, 4)
+    if report.magic.decode("ascii", errors="replace") != 'BSJB':
+        report.add_note('metadata', 'Unexpected magic bytes. Something went wrong.')
+        return None
+    return metadata_virtual_address, metadata_size
+
+def get_padding(data_size, block_size):
+    return (-data_size) % block_size
+
+def get_streams(pe: pefile.PE, metadata_rva, report: DotNetReport, limits: mu.Limits = None):
+    # 4-byte magic number, major & minor versions (2 bytes each), 4 bytes reserved, len of ascii clr version (dword). ascii clr version, null-padded to 4-byte boundary, 2 bytes reserved, then # of streams
+    ver_str_len = pe.get_dword_at_rva(metadata_rva + 12)
+    padding = get_padding(ver_str_len, 4)
+    if limits:
+        limits.check_range('metadata_bounds', 'Version string', 16, ver_str_len + padding + 4, report.metadata_size)
+    num_streams = pe.get_word_at_rva(metadata_rva + 12 + 4 + ver_str_len + padding + 2)
+    report.num_streams = num_streams
+    if limits and num_streams > limits.max_streams:
+        raise mu.ParseViolation('stream_count', f'Header lists {num_streams} streams, more than the limit of {limits.max_streams}')
+    stream_hdrs_start = metadata_rva + 12 + 4 + ver_str_len + padding + 4
+    next_stream_hdr = stream_hdrs_start
+    streams = {}
+    # Create a table of: stream name, stream size, stream RVA, stream Phys Addr
+    for i in range(num_streams):
+        if limits:
+            # Offset, size and a name of at most 32 bytes including the terminator
+            limits.check_range('stream_bounds', f'Stream header {i}', next_stream_hdr - metadata_rva, 8 + 1, report.metadata_size)
+        rva = metadata_rva + pe.get_dword_at_rva(next_stream_hdr)
+        phys_addr = pe.get_physical_by_rva(rva)
+        size = pe.get_dword_at_rva(next_stream_hdr + 4)
+        name = pe.get_string_at_rva(next_stream_hdr + 8, max_length=32 if limits else pefile.MAX_STRING_LENGTH)
+        name_size = len(name) + 1 #null terminated
+        if limits:
+            limits.check_range('stream_bounds', f'Stream header {i}', next_stream_hdr - metadata_rva, 8 + name_size, report.metadata_size)
+            if name_size > 32 or not name.isascii():
+                raise mu.ParseViolation('stream_name', f'Stream header {i} has an invalid name {name!r}')
+            limits.check_range('stream_bounds', f'Stream {name.decode(errors="replace")!r}', rva - metadata_rva, size, report.metadata_size)
+        padding = get_padding(name_size, 4)
+        streams[name.decode()] = mu.Stream(name.decode(), size, rva, phys_addr)
+        next_stream_hdr = next_stream_hdr + 8 + name_size + padding
+    report.streams = streams
+    return streams
+
+def read_guid_stream(pe: pefile.PE, streams, index = 1, all = True):
+    guids = streams.get('#GUID')
+    data = pe.get_data(guids.rva, guids.size)
+    if all:
+        return [data[16 * i:16 * (i + 1)] for i in range(guids.size // 16)]
+    return [data[16 * (index - 1):16 * index]] # indexes start at 1 not 0
+
+def has_heap(metadata: mu.Metadata, report: DotNetReport, section, heap_name, what):
+    # Missing heaps are a violation in strict mode and a note otherwise
+    if heap_name in metadata.heaps:
+        return True
+    if metadata.limits:
+        raise mu.ParseViolation('missing_heap', f'No {heap_name} stream to read the {what} from')
+    report.add_note(section, f'Cannot identify {what} - missing {heap_name} stream.')
+    return False
+
+def get_mvid_by_metadata(pe: pefile.PE, streams, metadata_stream, metadata: mu.Metadata, report: DotNetReport):
+    if 'Module' not in metadata.tables:
+        report.add_note('mvid', "No module table. Can't grab MVID from there so dumping #GUIDS instead.")
+        report.guids = read_guid_stream(pe, streams)
+        return
+    generation, mname_index, mvid_index, enc_id, enc_base_id = metadata.get_row('Module', 1)
+    if has_heap(metadata, report, 'mvid', '#Strings', 'module name'):
+        report.module_name = metadata.get_string(mname_index)
+    report.mvid = metadata.get_guid(mvid_index)
+
+def get_assembly_attributes(metadata: mu.Metadata, report: DotNetReport):
+    if 'CustomAttribute' not in metadata.tables or 'Assembly' not in metadata.tables:
+        return
+    if not has_heap(metadata, report, 'attributes', '#Strings', 'attribute types'):
+        return
+    report.attributes = dn_attributes.attributes_of(metadata, 'Assembly')
+    for attribute in report.attributes:
+        if 'error' in attribute:
+            report.add_note('attributes', f'Could not decode {attribute["type"] or "an unresolved"} attribute: {attribute["error"]}')
+
+def get_typelib_id(pe: pefile.PE, streams, metadata_stream, metadata: mu.Metadata, report: DotNetReport):
+    typelib_ids = []
+    if 'CustomAttribute' not in metadata.tables or 'Assembly' not in metadata.tables:
+        report.add_note('typelib', 'Could not find TypeLib ID. Missing CustomAttribute or Assembly metadata tables.')
+        return typelib_ids
+    # The TypeLib ID is the string argument of the assembly's GuidAttribute
+    for attribute in report.attributes:
+        if attribute['type'] == 'System.Runtime.InteropServices.GuidAttribute' and attribute['args'] and isinstance(attribute['args'][0], str):
+            typelib_ids.append(attribute['args'][0])
+    if len(typelib_ids) == 0:
+        report.add_note('typelib', 'Could not identify TypeLib ID.')
+    elif len(typelib_ids) > 1:
+        report.add_note('typelib', 'Identified multiple TypeLib IDs. Something is strange.')
+    return typelib_ids
+
+def extract_guids(pe: pefile.PE, streams: dict[str, mu.Stream], metadata: mu.Metadata, report: DotNetReport):
+    if streams.get('#GUID') == None:
+        report.add_note('mvid', 'No #GUID stream, something went wrong.')
+        return
+    metadata_stream = streams.get('#~') if '#~' in streams else streams.get('#-')
+    if metadata_stream:
+        get_mvid_by_metadata(pe, streams, metadata_stream, metadata, report)
+        if streams.get('#Blob'):
+            report.typelib_ids = get_typelib_id(pe, streams, metadata_stream, metadata, report)
+        else:
+            report.add_note('typelib', 'Cannot identify TypeLib ID - missing #Blob stream.')
+    else:
+        report.add_note('mvid', 'Cannot identify MVID - missing metadata stream (#~ or #-). Dumping all values from #GUIDS instead.')
+        report.guids = read_guid_stream(pe, streams)
+
+def check_for_oddities(pe: pefile.PE, streams: dict[str, mu.Stream], metadata: mu.Metadata, report: DotNetReport):
+    expected_stream_len = 5
+    expected_streams = ['#Strings', '#US', '#Blob', '#GUID', '#-', '#~']
+    oddities = []
+    found_streams = streams.keys()
+    if (strlen := len(found_streams)) != expected_stream_len:
+        oddities.append(f'Expected {expected_stream_len} streams. Found {strlen}.')
+    if report.num_streams != len(found_streams):
+        oddities.append('There are duplicate stream names.')
+    if '#-' in found_streams and '#~' in found_streams:
+        oddities.append('Found both #- and #~ metadata streams.')
+    if metadata.is_unoptimized:
+        ptr_tables = [table for table in const.PTR_TABLES.values() if metadata.table_rowcounts.get(table)]
+        oddities.append(f'Unoptimized (#-) metadata stream. Ptr tables: {ptr_tables or "none"}')
+    if metadata.has_extra:
+        oddities.append('Metadata tables header has the extra data flag set.')
+    unknown = [x for x in found_streams if x not in expected_streams]
+    if unknown:
+        oddities.append(f'Nonstandard streams: {unknown}')
+    if (mod_rows := metadata.table_rowcounts.get('Module', 0)) != 1:
+        oddities.append(f'More than one row in Module metadata table. Count: {mod_rows}')
+    if (assembly_rows := metadata.table_rowcounts.get('Assembly', 0)) != 1:
+        oddities.append(f'More than one row in Assembly metadata table. Count: {assembly_rows}')
+    return oddities
+
+def get_assembly_name(pe: pefile.PE, streams: dict[str, mu.Stream], metadata: mu.Metadata, report: DotNetReport):
+    if 'Assembly' not in metadata.tables:
+        report.add_note('assembly', 'Could not find assembly name. Missing Assembly metadata table.')
+        return
+    metadata_stream = streams.get('#~') if '#~' in streams else streams.get('#-')
+    if not metadata_stream:
+        report.add_note('assembly', 'No metadata stream identified. Cannot extract assembly details.')
+        return
+    # Assembly should have 1 row
+    hash_alg, major, minor, build, revision, flags, public_key, name_index, culture = metadata.get_row('Assembly', 1)
+    report.assembly_version = f'{major}.{minor}.{build}.{revision}'
+    report.assembly_version_hex = struct.pack('<4H', major, minor, build, revision).hex()
+    if has_heap(metadata, report, 'assembly', '#Strings', 'assembly name'):
+        report.assembly_name = metadata.get_string(name_index)
+
+def get_resources(pe: pefile.PE, metadata: mu.Metadata, report: DotNetReport, limits: mu.Limits, options: dn_resources.ResourceOptions):
+    if not metadata.table_rowcounts.get('ManifestResource') or '#Strings' not in metadata.heaps:
+        return
+    # Resources are read through slices of one view of the file, so large ones are never copied
+    # unless they turn out to hold a PE
+    with memoryview(pe.__data__) as view:
+        for resource, data in dn_resources.iter_manifest_resources(pe, metadata, view, limits):
+            report.resources.append(resource)
+            if data is None:
+                continue
+            with data:
+                for source, compression, payload in dn_resources.describe(resource, data, options):
+                    extract_child(report, source, compression, payload, limits, options)
+
+def extract_child(report: DotNetReport, source, compression, payload, limits: mu.Limits, options: dn_resources.ResourceOptions):
+    # Parse a PE found in a resource as a report of its own. Each payload is parsed once per sample
+    sha256 = hashlib.sha256(payload).hexdigest()
+    child = {'source': source, 'compression': compression, 'sha256': sha256, 'size': len(payload)}
+    report.children.append(child)
+    if options.out_dir:
+        child['file'] = dn_resources.dump(payload, options, sha256)
+    if sha256 in options.seen:
+        child['duplicate'] = True
+        return
+    if options.depth >= options.max_depth:
+        child['skipped'] = f'Depth limit of {options.max_depth} reached'
+        return
+    if len(options.seen) >= options.max_children:
+        child['skipped'] = f'More than {options.max_children} nested payloads'
+        return
+    options.seen.add(sha256)
+    if limits:
+        limits.check_time()
+    try:
+        # Children get their own time budget and count towards the parent's watchdog
+        child['report'] = extract(payload, f'{report.name}!{source}', copy.copy(limits), resources=options.child()).to_dict()
+    except Exception as e:
+        child['error'] = f'{type(e).__name__}: {e}'
+
+def load_pe(path_or_bytes):
+    # Only the headers and section table are parsed. Everything else is read on demand
+    # through the CLR data directory, so imports, resources, relocations etc. are skipped.
+    if hasattr(path_or_bytes, 'read'):
+        path_or_bytes = path_or_bytes.read()
+    if isinstance(path_or_bytes, (bytes, bytearray, memoryview)):
+        return pefile.PE(data=bytes(path_or_bytes), fast_load=True)
+    return pefile.PE(path_or_bytes, fast_load=True)
+
+def close_pe(pe: pefile.PE):
+    # pefile's close() runs a full gc.collect() after unmapping the file. That is most of the
+    # time spent on a small sample, and grows with the heap of a long-lived worker. Nothing
+    # here leaves reference cycles behind, so just unmap and let the regular collector run
+    data = pe.__dict__.pop('__data__', None)
+    if isinstance(data, mmap.mmap):
+        data.close()
+
+def no_phase(name):
+    return contextlib.nullcontext()
+
+def extract_pe(pe: pefile.PE, name=None, limits: mu.Limits = None, stats=None, resources: dn_resources.ResourceOptions = None):
+    # stats is an optional dn_stats.FileStats that times each phase. resources controls how far
+    # embedded resources are followed, see dn_resources.ResourceOptions
+    phase = stats.phase if stats else no_phase
+    if resources is None:
+        resources = dn_resources.ResourceOptions()
+    if resources.depth == 0:
+        resources.start()
+    report = DotNetReport(name)
+    # Make sure it is .NET (probably needs more validation)
+    if not is_dotnet(pe):
+        return report
+    report.is_dotnet = True
+    metadata = mu.Metadata(limits)
+    if stats:
+        stats.attach(pe, metadata)
+    try:
+        if limits:
+            limits.start()
+        with phase('find_metadata'):
+            located = find_metadata(pe, report, limits)
+        if located is None:
+            return report
+        metadata_rva, metadata_size = located
+        with phase('get_streams'):
+            streams = get_streams(pe, metadata_rva, report, limits)
+        with phase('parse'):
+            metadata.parse(pe, streams)
+        if metadata.error:
+            report.add_note('metadata', metadata.error)
+        with phase('assembly'):
+            get_assembly_name(pe, streams, metadata, report)
+        with phase('attributes'):
+            get_assembly_attributes(metadata, report)
+        with phase('guids'):
+            extract_guids(pe, streams, metadata, report)
+        if limits:
+            limits.check_time()
+        with phase('hashes'):
+            report.hashes = dn_hash.compute_hashes(metadata, streams)
+        with phase('resources'):
+            get_resources(pe, metadata, report, limits, resources)
+        with phase('oddities'):
+            report.oddities = check_for_oddities(pe, streams, metadata, report)
+    except mu.ParseViolation as violation:
+        if not limits:
+            raise
+        report.violations.append(violation.to_dict())
+    except MemoryError:
+        if not limits:
+            raise
+        report.violations.append({'kind': 'memory_budget', 'detail': 'Ran out of memory while parsing the sample'})
+    finally:
+        metadata.release()
+        if stats:
+            stats.detach(pe)
+    return report
+
+def extract(path_or_bytes, name=None, limits: mu.Limits = None, stats=None, resources: dn_resources.ResourceOptions = None):
+    # path_or_bytes can also be a binary file object. limits turns on strict mode: see metadata_util.Limits
+    if name is None and hasattr(path_or_bytes, 'read'):
+        name = getattr(path_or_bytes, 'name', None)
+    elif name is None and not isinstance(path_or_bytes, (bytes, bytearray, memoryview)):
+        name = str(path_or_bytes)
+    phase = stats.phase if stats else no_phase
+    with phase('load'):
+        pe = load_pe(path_or_bytes)
+    try:
+        return extract_pe(pe, name, limits, stats, resources)
+    finally:
+        with phase('close'):
+            close_pe(pe)
+
+@contextlib.contextmanager
+def open_metadata(path_or_bytes, limits: mu.Limits = None):
+    # (pe, streams, metadata) for tools that need more than the report, or None when the file
+    # has no .NET metadata. Both are released when the block exits
+    pe = load_pe(path_or_bytes)
+    metadata = mu.Metadata(limits)
+    try:
+        if limits:
+            limits.start()
+        report = DotNetReport()
+        if not is_dotnet(pe) or (located := find_metadata(pe, report, limits)) is None:
+            yield None
+            return
+        streams = get_streams(pe, located[0], report, limits)
+        metadata.parse(pe, streams)
+        yield pe, streams, metadata
+    finally:
+        metadata.release()
+        close_pe(pe)
+
+def extract_strings(path_or_bytes, heap_names=('#Strings', '#US')):
+    # Every value of the given heaps, each heap walked in a single pass: {heap name: [(offset, value), ...]}
+    with open_metadata(path_or_bytes) as opened:
+        if opened is None:
+            return {}
+        metadata = opened[2]
+        return {name: list(metadata.heaps[name].iter_all()) for name in heap_names if name in metadata.heaps}
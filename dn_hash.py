@@ -0,0 +1,109 @@
+import sys
+import json
+import hashlib
+import argparse
+import metadata_util as mu
+
+HASH_KINDS = ['typeref_hash', 'methoddef_hash', 'memberref_hash', 'stream_hash']
+
+# The stream layout is shared by almost every compiler output, so it would link everything together
+LINK_KINDS = ['typeref_hash', 'methoddef_hash', 'memberref_hash']
+
+def hash_names(names):
+    # Order-independent hash over a set of names, None when there is nothing to hash
+    if not names:
+        return None
+    return hashlib.sha256(','.join(sorted(names)).encode()).hexdigest()
+
+def typeref_names(metadata: mu.Metadata):
+    # namespace-name pairs, like TypeRefHash
+    if '#Strings' not in metadata.heaps:
+        return set()
+    typerefs = metadata.get_table('TypeRef')
+    return {f'{metadata.get_string(namespace)}-{metadata.get_string(name)}' for name, namespace in zip(typerefs.column('TypeName'), typerefs.column('TypeNamespace'))}
+
+def member_names(metadata: mu.Metadata, table_name):
+    if '#Strings' not in metadata.heaps:
+        return set()
+    return {metadata.get_string(name) for name in metadata.get_table(table_name).column('Name')}
+
+def compute_hashes(metadata: mu.Metadata, streams: dict[str, mu.Stream]):
+    return {
+        'typeref_hash': hash_names(typeref_names(metadata)),
+        'methoddef_hash': hash_names(member_names(metadata, 'MethodDef')),
+        'memberref_hash': hash_names(member_names(metadata, 'MemberRef')),
+        # Stream order matters here, so don't sort
+        'stream_hash': hashlib.sha256('|'.join(streams).encode()).hexdigest() if streams else None
+    }
+
+class HashIndex:
+    # Buckets samples by each hash value. Adding a sample is O(number of hash kinds), so a
+    # corpus is clustered in one pass without comparing samples pairwise.
+
+    def __init__(self, kinds=None):
+        self.kinds = kinds or HASH_KINDS
+        self.buckets = {kind: {} for kind in self.kinds}
+
+    def add(self, sample_id, hashes):
+        for kind in self.kinds:
+            value = hashes.get(kind)
+            if value:
+                self.buckets[kind].setdefault(value, []).append(sample_id)
+
+    def clusters(self, kind, min_size=2):
+        # {hash value: [sample ids]} for one hash kind, largest clusters first
+        groups = [(value, ids) for value, ids in self.buckets[kind].items() if len(ids) >= min_size]
+        return dict(sorted(groups, key=lambda group: len(group[1]), reverse=True))
+
+    def linked_clusters(self, min_size=2):
+        # Samples sharing any hash end up in the same group (union-find over the buckets)
+        parent = {}
+
+        def find(sample_id):
+            root = sample_id
+            while parent.setdefault(root, root) != root:
+                root = parent[root]
+            while parent[sample_id] != root:
+                parent[sample_id], sample_id = root, parent[sample_id]
+            return root
+
+        for kind in self.kinds:
+            for ids in self.buckets[kind].values():
+                first = find(ids[0])
+                for sample_id in ids[1:]:
+                    other = find(sample_id)
+                    if other != first:
+                        parent[other] = first
+        groups = {}
+        for sample_id in parent:
+            groups.setdefault(find(sample_id), []).append(sample_id)
+        return sorted((ids for ids in groups.values() if len(ids) >= min_size), key=len, reverse=True)
+
+def load_records(paths):
+    for path in paths:
+        with (sys.stdin if path == '-' else open(path)) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster JSON Lines reports from parser_main.py --jsonl by their similarity hashes.')
+    parser.add_argument('reports', nargs='+', help='JSON Lines files. Use - for stdin.')
+    parser.add_argument('-k', '--kind', action='append', choices=HASH_KINDS, help='Hash kinds to cluster on (default: all).')
+    parser.add_argument('--linked', action='store_true', help='Merge samples that share any of the selected hashes into one cluster (default kinds: everything but stream_hash).')
+    parser.add_argument('--min-size', type=int, default=2, help='Smallest cluster to print.')
+    args = parser.parse_args()
+    index = HashIndex(args.kind or (LINK_KINDS if args.linked else HASH_KINDS))
+    for record in load_records(args.reports):
+        if record.get('hashes'):
+            index.add(record.get('path') or record.get('name'), record['hashes'])
+    if args.linked:
+        for ids in index.linked_clusters(args.min_size):
+            print(json.dumps({'size': len(ids), 'samples': ids}))
+        return
+    for kind in index.kinds:
+        for value, ids in index.clusters(kind, args.min_size).items():
+            print(json.dumps({'kind': kind, 'hash': value, 'size': len(ids), 'samples': ids}))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+import sys
+import json
+import struct
+import hashlib
+import argparse
+import concurrent.futures
+import pefile
+import metadata_util as mu
+import dn_constants as const
+import dn_extract
+import dn_batch
+import dn_hash
+import dn_yara
+
+# Methods with less IL than this are left out of bulk hashing: trivial getters, setters and
+# constructors compile to the same bytes in every assembly and would link everything together
+MIN_HASH_SIZE = 32
+
+# Longest YARA hex string emitted per method, cut at an instruction boundary
+MAX_PATTERN_BYTES = 256
+
+# MethodDef ImplFlags code types: only IL bodies are decoded, native and runtime bodies are skipped
+CODE_TYPE_MASK = 0x0003
+CODE_TYPE_IL = 0x0000
+
+class MethodBody:
+    # Header fields and IL of one method. Both header formats are described in ECMA-335 II.25.4
+
+    def __init__(self, row, name, rva):
+        self.row = row
+        self.token = 0x06000000 | row
+        self.name = name
+        self.rva = rva
+        self.format = None # 'tiny' or 'fat'
+        self.flags = 0
+        self.max_stack = 8 # Tiny headers don't store it
+        self.code_size = 0
+        self.local_var_sig_token = 0
+        self.locals = None # Number of local variables, from the StandAloneSig signature
+        self.exception_clauses = 0
+        self.il = b''
+        self.error = None
+
+    def to_dict(self):
+        return {
+            'token': f'{self.token:#010x}',
+            'name': self.name,
+            'rva': self.rva,
+            'format': self.format,
+            'max_stack': self.max_stack,
+            'code_size': self.code_size,
+            'init_locals': bool(self.flags & 0x10),
+            'local_var_sig_token': f'{self.local_var_sig_token:#010x}' if self.local_var_sig_token else None,
+            'locals': self.locals,
+            'exception_clauses': self.exception_clauses,
+            'il_hash': il_hash(self.il) if self.il else None,
+            'error': self.error
+        }
+
+def iter_instructions(il):
+    # (offset, opcode name, operand type, operand bytes) for each instruction. An unknown opcode
+    # or a truncated operand ends the walk with an 'unknown' entry holding the rest of the IL
+    offset = 0
+    while offset < len(il):
+        start = offset
+        opcode = il[offset]
+        offset += 1
+        if opcode == 0xFE and offset < len(il):
+            entry = const.IL_OPCODES_FE.get(il[offset])
+            offset += 1
+        else:
+            entry = const.IL_OPCODES.get(opcode)
+        if entry is None:
+            yield start, 'unknown', None, il[start:]
+            return
+        name, operand_type = entry
+        size = const.IL_OPERAND_SIZES[operand_type]
+        if operand_type == 'InlineSwitch' and offset + 4 <= len(il):
+            size += 4 * struct.unpack_from('<I', il, offset)[0]
+        if offset + size > len(il):
+            yield start, 'unknown', None, il[start:]
+            return
+        yield start, name, operand_type, il[offset:offset + size]
+        offset += size
+
+def iter_masked(il, max_bytes=None):
+    # (opcode bytes, operand bytes, mask) per instruction, where mask marks the operand bytes that
+    # are metadata token rows. Tokens differ between builds of the same code; the table byte doesn't
+    for offset, name, operand_type, operand in iter_instructions(il):
+        if name == 'unknown':
+            opcode = b''
+        else:
+            opcode = il[offset:offset + (2 if il[offset] == 0xFE else 1)]
+        if max_bytes is not None and offset + len(opcode) + len(operand) > max_bytes:
+            return
+        mask = (True, True, True, False) if operand_type in const.IL_TOKEN_OPERANDS else (False,) * len(operand)
+        yield opcode, operand, mask
+
+def il_hash(il):
+    # SHA-256 of the IL with token rows zeroed, so the same method body matches across assemblies
+    normalized = bytearray()
+    for opcode, operand, mask in iter_masked(il):
+        normalized += opcode
+        normalized += bytes(0 if masked else value for value, masked in zip(operand, mask))
+    return hashlib.sha256(normalized).hexdigest()
+
+def pattern(il, max_bytes=MAX_PATTERN_BYTES):
+    # YARA hex string for the IL with token rows as wildcards, e.g. { 28 ?? ?? ?? 0A 2A }
+    parts = []
+    for opcode, operand, mask in iter_masked(il, max_bytes):
+        parts.extend(f'{value:02X}' for value in opcode)
+        parts.extend('??' if masked else f'{value:02X}' for value, masked in zip(operand, mask))
+    return '{ ' + ' '.join(parts) + ' }' if parts else None
+
+class MethodReader:
+    # Lazy access to the method bodies of one module: nothing is read until a body is asked for,
+    # and then only that body's header and IL
+
+    def __init__(self, pe: pefile.PE, metadata: mu.Metadata):
+        self.pe = pe
+        self.metadata = metadata
+        self.data = pe.__data__
+        self.section = None # Last section an RVA was found in, bodies are almost always in .text
+        self.names = None # Full method name -> [rows], built on first use
+        self.method_defs = metadata.get_table('MethodDef') if metadata.table_rowcounts.get('MethodDef') else None
+
+    def __len__(self):
+        return len(self.method_defs) if self.method_defs else 0
+
+    def get_offset(self, rva):
+        if self.section is None or not self.section.contains_rva(rva):
+            self.section = self.pe.get_section_by_rva(rva)
+            if self.section is None:
+                return self.pe.get_offset_from_rva(rva)
+        return self.section.get_offset_from_rva(rva)
+
+    def method_name(self, row):
+        # Namespace.Type::Method
+        name = self.metadata.get_string(self.method_defs.column('Name')[row - 1])
+        type_row = self.metadata.get_owner('TypeDef', 'MethodList', row)
+        if not self.metadata.check_row('TypeDef', type_row):
+            return name
+        type_defs = self.metadata.get_table('TypeDef')
+        type_name = self.metadata.get_string(type_defs.column('TypeName')[type_row - 1])
+        namespace = self.metadata.get_string(type_defs.column('TypeNamespace')[type_row - 1])
+        return f'{namespace}.{type_name}::{name}' if namespace else f'{type_name}::{name}'
+
+    def has_body(self, row):
+        return self.method_defs.column('RVA')[row - 1] != 0 and self.method_defs.column('ImplFlags')[row - 1] & CODE_TYPE_MASK == CODE_TYPE_IL
+
+    def find(self, selector):
+        # MethodDef rows matching a token (0x06000001), a full name (Type::Method) or a bare method name
+        if not self.method_defs:
+            return []
+        if selector.lower().startswith('0x06'):
+            try:
+                row = int(selector, 16) & 0xFFFFFF
+            except ValueError:
+                return []
+            return [row] if 0 < row <= len(self) else []
+        if self.names is None:
+            self.names = {}
+            for row in range(1, len(self) + 1):
+                full_name = self.method_name(row)
+                self.names.setdefault(full_name, []).append(row)
+                if '::' in full_name:
+                    self.names.setdefault(full_name.rsplit('::', 1)[-1], []).append(row)
+        return self.names.get(selector, [])
+
+    def body(self, row, with_name=True):
+        # MethodBody for a MethodDef row, None for abstract, extern and native methods
+        if not self.method_defs or not self.metadata.check_row('MethodDef', row) or not self.has_body(row):
+            return None
+        rva = self.method_defs.column('RVA')[row - 1]
+        body = MethodBody(row, self.method_name(row) if with_name else None, rva)
+        try:
+            offset = self.get_offset(rva)
+            if offset is None or offset >= len(self.data):
+                raise ValueError(f'Body RVA {rva:#X} is outside of the file')
+            first = self.data[offset]
+            if first & 3 == 2:
+                body.format = 'tiny'
+                body.code_size = first >> 2
+                header_size = 1
+            elif first & 3 == 3:
+                body.format = 'fat'
+                flags_size, body.max_stack, body.code_size, body.local_var_sig_token = struct.unpack_from('<HHII', self.data, offset)
+                body.flags = flags_size & 0x0FFF
+                header_size = (flags_size >> 12) * 4
+                if header_size < 12:
+                    raise ValueError(f'Fat header size {header_size} is too small')
+            else:
+                raise ValueError(f'Invalid method header format {first & 3}')
+            if self.metadata.limits:
+                self.metadata.limits.check_range('method_bounds', f'Method {body.token:#010x}', offset + header_size, body.code_size, len(self.data))
+            elif offset + header_size + body.code_size > len(self.data):
+                raise ValueError(f'Code of {body.code_size} bytes runs past the end of the file')
+            body.il = self.data[offset + header_size:offset + header_size + body.code_size]
+            if body.flags & 0x08:
+                body.exception_clauses = self.count_clauses(offset + header_size + body.code_size, rva + header_size + body.code_size)
+            if body.local_var_sig_token:
+                body.locals = self.count_locals(body.local_var_sig_token)
+        except (ValueError, IndexError, struct.error, pefile.PEFormatError) as e:
+            body.error = str(e)
+        return body
+
+    def count_clauses(self, offset, rva):
+        # Extra data sections follow the code, aligned to 4 bytes. Each is an exception handling
+        # table in the small (12-byte clauses) or fat (24-byte clauses) format
+        clauses = 0
+        while True:
+            offset += (-rva) % 4
+            rva += (-rva) % 4
+            kind = self.data[offset]
+            if kind & 0x40:
+                size = int.from_bytes(self.data[offset + 1:offset + 4], 'little')
+                clauses += (size - 4) // 24
+            else:
+                size = self.data[offset + 1]
+                clauses += (size - 4) // 12
+            if not kind & 0x80 or size < 4:
+                return clauses
+            offset += size
+            rva += size
+
+    def count_locals(self, token):
+        # LOCAL_SIG (0x07) followed by the compressed number of locals
+        if token >> 24 != 0x11 or '#Blob' not in self.metadata.heaps or not self.metadata.check_row('StandAloneSig', token & 0xFFFFFF):
+            return None
+        data = self.metadata.get_blob(self.metadata.get_table('StandAloneSig').column('Signature')[(token & 0xFFFFFF) - 1])
+        if len(data) < 2 or data[0] != 0x07:
+            return None
+        return mu.decode_compressed_uint(data, 1)[0]
+
+    def iter_bodies(self, rows=None, with_name=True):
+        # Bodies of the given rows, or of every method with IL, one at a time
+        for row in rows if rows is not None else range(1, len(self) + 1):
+            if self.metadata.limits and row & 0xFFF == 0:
+                self.metadata.limits.check_time()
+            body = self.body(row, with_name)
+            if body is not None:
+                yield body
+
+    def operand_text(self, offset, name, operand_type, operand):
+        if operand_type is None:
+            return operand.hex()
+        if operand_type in ('ShortInlineBrTarget', 'InlineBrTarget'):
+            delta = int.from_bytes(operand, 'little', signed=True)
+            return f'IL_{offset + (2 if operand_type == "ShortInlineBrTarget" else 5) + delta:04x}'
+        if operand_type == 'InlineSwitch':
+            count = len(operand) // 4 - 1
+            end = offset + 1 + len(operand)
+            return '(' + ', '.join(f'IL_{end + delta:04x}' for delta in struct.unpack_from(f'<{count}i', operand, 4)) + ')'
+        if operand_type == 'InlineString':
+            token = struct.unpack('<I', operand)[0]
+            if '#US' in self.metadata.heaps:
+                try:
+                    return json.dumps(self.metadata.get_user_string(token & 0xFFFFFF))
+                except (ValueError, IndexError, mu.ParseViolation):
+                    pass
+            return f'{token:#010x}'
+        if operand_type in const.IL_TOKEN_OPERANDS:
+            token = struct.unpack('<I', operand)[0]
+            if token >> 24 == 0x06 and self.metadata.check_row('MethodDef', token & 0xFFFFFF):
+                return f'{token:#010x} {self.method_name(token & 0xFFFFFF)}'
+            return f'{token:#010x}'
+        if operand_type in ('ShortInlineR', 'InlineR'):
+            return str(struct.unpack('<f' if operand_type == 'ShortInlineR' else '<d', operand)[0])
+        return str(int.from_bytes(operand, 'little', signed=operand_type not in ('ShortInlineVar', 'InlineVar')))
+
+    def disassemble(self, body: MethodBody):
+        lines = []
+        for offset, name, operand_type, operand in iter_instructions(body.il):
+            text = self.operand_text(offset, name, operand_type, operand) if operand else ''
+            lines.append(f'IL_{offset:04x}: {name} {text}'.rstrip())
+        return lines
+
+def method_hashes(pe: pefile.PE, metadata: mu.Metadata, min_size=MIN_HASH_SIZE):
+    # {il_hash: [method names]} for every method with at least min_size bytes of IL
+    reader = MethodReader(pe, metadata)
+    hashes = {}
+    for body in reader.iter_bodies(with_name=False):
+        if body.error is None and len(body.il) >= min_size:
+            hashes.setdefault(il_hash(body.il), []).append(body.row)
+    return {value: [reader.method_name(row) for row in rows] for value, rows in hashes.items()}
+
+def hash_file(path, min_size=MIN_HASH_SIZE):
+    # Record for --hash output: {'name', 'methods': {il_hash: [method names]}}, with 'error' on failure
+    record = {'name': str(path)}
+    try:
+        with dn_extract.open_metadata(path) as opened:
+            record['methods'] = method_hashes(opened[0], opened[2], min_size) if opened else {}
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    return record
+
+def hash_files(paths, workers=None, min_size=MIN_HASH_SIZE):
+    if workers == 1:
+        yield from (hash_file(path, min_size) for path in paths)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(hash_file, paths, [min_size] * len(paths), chunksize=16)
+
+def shared_methods(records, min_size=2):
+    # Method bodies found in at least min_size files: [(il_hash, [files], [method names])], most shared first
+    index = dn_hash.HashIndex(['il_hash'])
+    names = {}
+    for record in records:
+        for value, methods in record.get('methods', {}).items():
+            index.add(record['name'], {'il_hash': value})
+            names.setdefault(value, set()).update(methods)
+    return [(value, files, sorted(names[value])) for value, files in index.clusters('il_hash', min_size).items()]
+
+def method_rule(name, bodies, max_bytes=MAX_PATTERN_BYTES):
+    meta = {'author': 'dnparser', 'description': f'IL of {len(bodies)} method(s) from {name}'}
+    strings = []
+    for i, body in enumerate(bodies):
+        meta[f'method{i}'] = f'{body.token:#010x} {body.name}'
+        if value := pattern(body.il, max_bytes):
+            strings.append((f'$m{i}', value))
+    if not strings:
+        return None
+    return dn_yara.render_rule(dn_yara.rule_name('dnparser_il', bodies[0].name, name.rsplit('/', 1)[-1]), meta, strings, 'uint16(0) == 0x5A4D and all of them')
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode .NET method bodies: disassembly, YARA patterns with masked tokens, and IL hashes for finding shared code.')
+    parser.add_argument('files', nargs='+', help='Files, directories or globs. With -m only the first file is read.')
+    parser.add_argument('-m', '--method', action='append', default=[], help='Method to decode: a MethodDef token (0x06000001), Type::Method or a bare method name. Repeatable.')
+    parser.add_argument('--all', action='store_true', help='Decode every method with a body.')
+    parser.add_argument('--disassemble', action='store_true', help='Print the instructions of the selected methods.')
+    parser.add_argument('--yara', action='store_true', help='Print a YARA rule matching the selected methods.')
+    parser.add_argument('--max-bytes', type=int, default=MAX_PATTERN_BYTES, help='Longest pattern per method in YARA rules.')
+    parser.add_argument('--hash', action='store_true', help='Write the IL hashes of every method of every file as JSON Lines.')
+    parser.add_argument('--shared', type=int, metavar='N', help='Print the method bodies found in at least N files.')
+    parser.add_argument('--min-size', type=int, default=MIN_HASH_SIZE, help='Smallest method, in bytes of IL, that is hashed.')
+    parser.add_argument('-j', '--workers', type=int, help='Worker processes for --hash and --shared.')
+    args = parser.parse_args()
+    paths = list(dn_batch.iter_paths(args.files))
+    if args.hash or args.shared:
+        records = hash_files(paths, args.workers, args.min_size)
+        if args.hash:
+            records = list(records)
+            for record in records:
+                print(json.dumps(record))
+        if args.shared:
+            for value, files, names in shared_methods(records, args.shared):
+                print(f'{value}  {len(files)} files  {", ".join(names[:5])}')
+                for path in files:
+                    print(f'    {path}')
+        return
+    if not paths:
+        parser.error('No input files.')
+    with dn_extract.open_metadata(paths[0]) as opened:
+        if opened is None:
+            sys.exit(f'{paths[0]}: no .NET metadata')
+        reader = MethodReader(opened[0], opened[2])
+        rows = None if args.all else [row for selector in args.method for row in reader.find(selector)]
+        if rows == []:
+            sys.exit(f'{paths[0]}: no method matches {args.method}' if args.method else 'Select methods with -m or --all.')
+        bodies = list(reader.iter_bodies(rows))
+        missing = [row for row in rows or () if not reader.has_body(row)]
+        for row in missing:
+            print(f'{paths[0]}: {0x06000000 | row:#010x} {reader.method_name(row)} has no method body (abstract, extern or native)', file=sys.stderr)
+        if missing and not bodies:
+            sys.exit(1)
+        if args.yara:
+            print(method_rule(paths[0], [body for body in bodies if body.error is None], args.max_bytes) or '// No IL to match')
+            return
+        for body in bodies:
+            if args.disassemble:
+                print(f'// {body.token:#010x} {body.name}: {body.format}, {body.code_size} bytes, max stack {body.max_stack}, {body.locals or 0} locals' + (f', error: {body.error}' if body.error else ''))
+                print('\n'.join(reader.disassemble(body)))
+                print()
+            else:
+                print(json.dumps(body.to_dict()))
+
+if __name__ == '__main__':
+    main()
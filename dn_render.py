@@ -0,0 +1,166 @@
+import uuid
+from dn_extract import DotNetReport
+
+def print_divider():
+    print('-------------------------------------------------------------------------------------')
+
+def print_header(header):
+    print(f'{header:^85}\n')
+
+def print_notes(report: DotNetReport, section):
+    for message in report.notes.get(section, []):
+        print(message)
+
+def print_guids(guids):
+    print("{:<40} {:<40}".format('Hex','UUID'))
+    for guid_val in guids:
+        print(f'{guid_val.hex():<40} {uuid.UUID(bytes_le=guid_val)}')
+
+def render_metadata(report: DotNetReport):
+    print_divider()
+    print_header('Locating Metadata')
+    print(f'CLR header RVA: {report.clr_header_rva:#04X}')
+    print(f'Metadata header RVA: {report.metadata_rva:#04X}')
+    print(f'Metadata size: {report.metadata_size:#04X}')
+    print(f'Metadata magic bytes: \n   - Hex: {report.magic.hex()} \n   - ASCII: {report.magic.decode("ascii", errors="replace")}')
+    print_notes(report, 'metadata')
+
+def render_streams(report: DotNetReport):
+    print_header('STREAMS')
+    print("{:<20} {:<20} {:<20} {:<20}".format('Stream','Size','RVA', 'Physical Address'))
+    for name, stream in report.streams.items():
+        print(f'{str(name):<20} {stream.size:<#20X} {stream.rva:<#20X} {stream.phys_addr:<#20X}')
+
+def render_assembly(report: DotNetReport):
+    if report.assembly_name is None:
+        print_notes(report, 'assembly')
+        return
+    print_header('Assembly Details')
+    print(f'Name: {report.assembly_name}')
+    print(f'Version: {report.assembly_version}')
+    print(f'Version Hex: {report.assembly_version_hex}')
+
+def render_attributes(report: DotNetReport):
+    print_notes(report, 'attributes')
+    if not report.attributes:
+        return
+    print_header('Assembly Attributes')
+    for attribute in report.attributes:
+        if 'error' in attribute:
+            continue
+        values = [repr(arg) for arg in attribute['args']] + [f'{name}={value!r}' for name, value in attribute['named'].items()]
+        print(f'{attribute["type"]}({", ".join(values)})')
+
+def render_guids(report: DotNetReport):
+    print_notes(report, 'mvid')
+    if report.guids:
+        print_header('#GUID')
+        print_guids(report.guids)
+        print_divider()
+    if report.module_name is not None:
+        print_header('Module Name')
+        print(report.module_name)
+        print_divider()
+    if report.mvid is not None:
+        print_header('MVID')
+        print_guids([report.mvid])
+        print_divider()
+    if report.typelib_ids or 'typelib' in report.notes:
+        print_header('TypeLib ID')
+        print_notes(report, 'typelib')
+        for typelibid in report.typelib_ids:
+            print(typelibid)
+
+def render_hashes(report: DotNetReport):
+    print_divider()
+    print_header('Similarity Hashes')
+    for kind, value in report.hashes.items():
+        print(f'{kind:<20} {value}')
+
+def render_resources(report: DotNetReport):
+    if not report.resources:
+        return
+    print_divider()
+    print_header('Resources')
+    print("{:<40} {:<24} {:<12} {}".format('Name', 'Location / Type', 'Size', 'Contents'))
+    for resource in report.resources:
+        contents = resource.get('error') or resource.get('target') or (f'{resource["entry_count"]} entries' if 'entry_count' in resource else payload_text(resource))
+        print(f'{resource["name"]:<40} {resource["location"]:<24} {resource.get("size", ""):<12} {contents}')
+        for entry in resource.get('entries', []):
+            contents = repr(entry['value']) if 'value' in entry else payload_text(entry)
+            print(f'   {entry["name"]:<37} {entry["type"].split(",")[0]:<24} {entry.get("size", ""):<12} {contents}')
+    if report.children:
+        print()
+        print_header('Nested Files')
+        print_children(report.children)
+
+def payload_text(item):
+    if not item.get('payload'):
+        return ''
+    return f'PE ({item["compression"]})' if item['compression'] else 'PE'
+
+def print_children(children, indent=0):
+    for child in children:
+        child_report = child.get('report')
+        if child_report:
+            summary = f'{child_report["assembly_name"]} {child_report["assembly_version"]}' if child_report.get('assembly_name') else ('.NET' if child_report['is_dotnet'] else 'not .NET')
+        else:
+            summary = 'duplicate' if child.get('duplicate') else child.get('skipped') or child.get('error')
+        compression = f', {child["compression"]}' if child['compression'] else ''
+        print(f'{" " * indent}{child["source"]} ({child["size"]} bytes{compression}, SHA-256 {child["sha256"][:16]}...): {summary}')
+        if child_report:
+            print_children(child_report['children'], indent + 3)
+
+def render_oddities(report: DotNetReport):
+    print_divider()
+    print_header('Notable Irregularities')
+    for oddity in report.oddities:
+        print(oddity)
+    render_violations(report)
+
+def render_violations(report: DotNetReport):
+    for violation in report.violations:
+        print(f'Strict mode stopped parsing ({violation["kind"]}): {violation["detail"]}')
+
+def render_yara_tips():
+    print_header('YARA Tips')
+    print('*  .NET binaries should have 5 standard streams. Any extra or missing?')
+    print('\n*  Assembly name and Module name are in the #Strings stream,\n   so they make good strings in rules.')
+    print('\n*  Unique Assembly version? Use the hex output.')
+    print('\n*  MVID is the module version ID. This changes with recompilation, \n   but can track a sample that has been repacked/modified.\n   This is in the #GUID stream so use the hex output.')
+    print('\n*  TypeLib ID is unique per project and robust against recompilation. \n   This is in plaintext, use the string value. \n   NOTE: The fullword modifier will fail here since the value is prepended\n   by its length: 0x24 ($ in ASCII)')
+
+def render_report(report: DotNetReport):
+    if not report.is_dotnet:
+        print('Invalid!')
+        return
+    if report.magic is None:
+        print_divider()
+        print_header('Locating Metadata')
+        render_violations(report)
+        return
+    render_metadata(report)
+    if not report.streams:
+        render_violations(report)
+        return
+    print_divider()
+    render_streams(report)
+    print_divider()
+    render_assembly(report)
+    render_attributes(report)
+    print_divider()
+    render_guids(report)
+    render_hashes(report)
+    render_resources(report)
+    render_oddities(report)
+    print_divider()
+    render_yara_tips()
+    print_divider()
+
+def render_strings(strings):
+    for heap_name, values in strings.items():
+        print_header(heap_name)
+        print("{:<12} {}".format('Offset', 'Value'))
+        for offset, value in values:
+            print(f'{offset:<#12X} {value!r}')
+        print_divider()
@@ -0,0 +1,269 @@
+import os
+import zlib
+import copy
+import struct
+import bisect
+import hashlib
+import pefile
+import metadata_util as mu
+
+# How many levels of resources inside resources are parsed
+MAX_DEPTH = 2
+
+# Nested payloads parsed per top-level sample, across all levels
+MAX_CHILDREN = 64
+
+# Decompressed payloads larger than this are not inflated any further
+MAX_PAYLOAD_SIZE = 256 << 20
+
+# String values of .resources entries are cut to this many characters in the report
+MAX_STRING_VALUE = 256
+
+# System.Resources.ResourceManager header, as written by ResourceWriter and resgen
+RESOURCE_SET_MAGIC = 0xBEEFCACE
+
+# ResourceTypeCode of version 2 resource sets. Codes from 0x40 up index the user type list
+RESOURCE_TYPES = {
+    0x00: 'null',
+    0x01: 'string',
+    0x02: 'bool',
+    0x03: 'char',
+    0x04: 'byte',
+    0x05: 'sbyte',
+    0x06: 'int16',
+    0x07: 'uint16',
+    0x08: 'int32',
+    0x09: 'uint32',
+    0x0A: 'int64',
+    0x0B: 'uint64',
+    0x0C: 'single',
+    0x0D: 'double',
+    0x0E: 'decimal',
+    0x0F: 'DateTime',
+    0x10: 'TimeSpan',
+    0x20: 'byte[]',
+    0x21: 'stream'
+}
+USER_TYPES = 0x40
+
+# Compressed payloads tried by the decompression probe, as (name, zlib wbits)
+COMPRESSIONS = [('gzip', 31), ('zlib', 15), ('deflate', -15)]
+
+class ResourceOptions:
+    # What extract_pe does with embedded resources. depth and seen are the state of one sample
+    # and its nested payloads: start() resets them, child() is used for the next level down
+
+    def __init__(self, max_depth=MAX_DEPTH, decompress=True, out_dir=None, strings=False, max_children=MAX_CHILDREN, max_size=MAX_PAYLOAD_SIZE):
+        self.max_depth = max_depth # 0 lists resources without parsing what is inside them
+        self.decompress = decompress
+        self.strings = strings # Also list the string entries of .resources blobs, with their values
+        self.out_dir = out_dir # Write every resource and payload here, named by SHA-256
+        self.max_children = max_children
+        self.max_size = max_size
+        self.depth = 0
+        self.seen = set() # SHA-256 of every payload parsed so far, shared by all levels
+
+    def start(self):
+        self.depth = 0
+        self.seen = set()
+
+    def child(self):
+        options = copy.copy(self)
+        options.depth = self.depth + 1
+        return options
+
+def read_7bit_int(data, offset):
+    # BinaryWriter.Write7BitEncodedInt: 7 bits per byte, low bits first. Returns (value, bytes used)
+    value = 0
+    for i in range(5):
+        byte = data[offset + i]
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value, i + 1
+    raise ValueError(f'Invalid 7-bit encoded integer at {offset:#X}')
+
+def read_string(data, offset, encoding='utf-8'):
+    # Length prefixed BinaryWriter string. Returns (value, offset after it)
+    length, size = read_7bit_int(data, offset)
+    offset += size
+    if offset + length > len(data):
+        raise ValueError(f'String of {length} bytes at {offset:#X} runs past the end of the resource')
+    return bytes(data[offset:offset + length]).decode(encoding, errors='replace'), offset + length
+
+def is_pe(data):
+    if len(data) < 0x40 or data[:2] != b'MZ':
+        return False
+    e_lfanew = struct.unpack_from('<I', data, 0x3C)[0]
+    return e_lfanew + 4 <= len(data) and data[e_lfanew:e_lfanew + 4] == b'PE\x00\x00'
+
+def decompress_pe(data, max_size=MAX_PAYLOAD_SIZE):
+    # (compression, PE bytes) when data is a compressed PE, otherwise None. Only the first
+    # few KB are inflated until the output is known to start with MZ
+    for name, wbits in COMPRESSIONS:
+        if name == 'gzip' and data[:2] != b'\x1f\x8b':
+            continue
+        if name == 'zlib' and (len(data) < 2 or data[0] & 0x0F != 8 or (data[0] << 8 | data[1]) % 31):
+            continue
+        try:
+            if zlib.decompressobj(wbits).decompress(data[:4096], 2) != b'MZ':
+                continue
+            decompressor = zlib.decompressobj(wbits)
+            payload = decompressor.decompress(data, max_size)
+        except zlib.error:
+            continue
+        if decompressor.unconsumed_tail:
+            raise ValueError(f'{name} payload inflates to more than {max_size} bytes')
+        if is_pe(payload):
+            return name, payload
+    return None
+
+def resources_directory(pe: pefile.PE):
+    # (file offset, size) of the CLR header's Resources directory, which holds every embedded ManifestResource
+    clr_header_rva = pe.OPTIONAL_HEADER.DATA_DIRECTORY[14].VirtualAddress
+    directory_rva, directory_size = pe.get_dword_at_rva(clr_header_rva + 24), pe.get_dword_at_rva(clr_header_rva + 28)
+    if not directory_rva:
+        raise ValueError('The CLR header has no Resources directory')
+    try:
+        return pe.get_offset_from_rva(directory_rva), directory_size or 0
+    except pefile.PEFormatError:
+        raise ValueError(f'Resources directory RVA {directory_rva:#X} is not inside any section')
+
+def iter_manifest_resources(pe: pefile.PE, metadata: mu.Metadata, view: memoryview, limits: mu.Limits = None):
+    # (resource dict, data) for each ManifestResource row. data is a slice of view for embedded
+    # resources and None for ones linked from another file or assembly. The caller releases it
+    resources = metadata.get_table('ManifestResource')
+    directory = None
+    for row in range(1, len(resources) + 1):
+        if limits:
+            limits.check_time()
+        offset, flags, name, implementation = metadata.get_row('ManifestResource', row)
+        resource = {'name': metadata.get_string(name), 'visibility': {1: 'public', 2: 'private'}.get(flags & 7), 'location': 'embedded'}
+        table, target = resources.get_coded('Implementation', row)
+        if target:
+            # Linked: the data lives in a File of this assembly or in another assembly
+            resource['location'] = table
+            if table in ('File', 'AssemblyRef') and metadata.check_row(table, target):
+                resource['target'] = metadata.get_string(metadata.get_table(table).column('Name')[target - 1])
+            yield resource, None
+            continue
+        resource['offset'] = offset
+        try:
+            if directory is None:
+                directory = resources_directory(pe)
+            base, directory_size = directory
+            if limits:
+                limits.check_range('resource_bounds', f'Resource {resource["name"]!r}', offset, 4, directory_size)
+            size = struct.unpack_from('<I', view, base + offset)[0]
+            resource['size'] = size
+            if limits:
+                limits.check_range('resource_bounds', f'Resource {resource["name"]!r}', offset + 4, size, directory_size)
+            if base + offset + 4 + size > len(view):
+                raise ValueError(f'{size} bytes at {offset:#X} run past the end of the file')
+        except (ValueError, struct.error) as e:
+            resource['error'] = str(e)
+            yield resource, None
+            continue
+        yield resource, view[base + offset + 4:base + offset + 4 + size]
+
+def parse_resource_set(data):
+    # Entries of a .resources blob as (name, type name, value offset, value end). Values are
+    # stored back to back, so each one runs until the next one starts
+    magic, header_version, skip = struct.unpack_from('<III', data, 0)
+    if magic != RESOURCE_SET_MAGIC:
+        raise ValueError('Not a .resources blob')
+    offset = 12 + skip # Reader and resource set type names
+    version, count, type_count = struct.unpack_from('<Iii', data, offset)
+    offset += 12
+    if count < 0 or type_count < 0 or 8 * count + type_count > len(data):
+        raise ValueError(f'Invalid entry count {count} or type count {type_count}')
+    types = []
+    for i in range(type_count):
+        type_name, offset = read_string(data, offset)
+        types.append(type_name)
+    offset += (-offset) % 8 # "PAD" bytes up to 8 byte alignment
+    offset += 4 * count # Name hashes
+    positions = struct.unpack_from(f'<{count}i', data, offset)
+    offset += 4 * count
+    data_start = struct.unpack_from('<i', data, offset)[0]
+    names_start = offset + 4
+    entries = []
+    for position in positions:
+        name, name_end = read_string(data, names_start + position, 'utf-16-le')
+        entries.append((name, data_start + struct.unpack_from('<i', data, name_end)[0]))
+    starts = sorted(start for name, start in entries) + [len(data)]
+    result = []
+    for name, start in entries:
+        end = starts[bisect.bisect_right(starts, start)]
+        type_code, size = read_7bit_int(data, start)
+        if version == 1:
+            # Version 1 stores an index into the type list, -1 for null
+            type_name = types[type_code] if type_code < len(types) else 'null'
+        elif type_code >= USER_TYPES:
+            type_name = types[type_code - USER_TYPES] if type_code - USER_TYPES < len(types) else f'unknown type {type_code:#x}'
+        else:
+            type_name = RESOURCE_TYPES.get(type_code, f'unknown type {type_code:#x}')
+        result.append((name, type_name, start + size, end))
+    return result
+
+def payload_of(data, options: ResourceOptions):
+    # (compression or None, PE bytes) if data is a PE or a compressed one, otherwise None.
+    # A depth limit of 0 only lists resources, so nothing is probed
+    if options.max_depth == 0:
+        return None
+    if is_pe(data):
+        return None, bytes(data)
+    if options.decompress:
+        return decompress_pe(data, options.max_size)
+    return None
+
+def dump(data, options: ResourceOptions, sha256):
+    path = os.path.join(options.out_dir, sha256)
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return path
+
+def describe_entries(resource, data, options: ResourceOptions):
+    # Fill resource['entries'] from a .resources blob and yield the (source, compression, PE bytes)
+    # found in its byte[], stream and serialized values. Most blobs are localized string tables,
+    # so only binary entries are listed unless options.strings is set
+    entries = parse_resource_set(data)
+    resource['entry_count'] = len(entries)
+    resource['entries'] = []
+    for name, type_name, start, end in entries:
+        if type_name == 'string':
+            if options.strings:
+                resource['entries'].append({'name': name, 'type': type_name, 'value': read_string(data, start)[0][:MAX_STRING_VALUE]})
+            continue
+        if type_name in ('byte[]', 'stream'):
+            start, end = start + 4, min(end, start + 4 + struct.unpack_from('<i', data, start)[0])
+        elif type_name in RESOURCE_TYPES.values():
+            continue # Numbers, dates and the like
+        entry = {'name': name, 'type': type_name}
+        resource['entries'].append(entry)
+        with data[start:end] as value:
+            entry['size'] = len(value)
+            entry['sha256'] = hashlib.sha256(value).hexdigest()
+            if options.out_dir:
+                entry['file'] = dump(value, options, entry['sha256'])
+            found = payload_of(value, options)
+        if found:
+            entry['payload'] = 'pe'
+            entry['compression'] = found[0]
+            yield f'{resource["name"]}!{name}', *found
+
+def describe(resource, data, options: ResourceOptions):
+    # Hash, dump and look inside one embedded resource. Yields (source, compression, PE bytes)
+    # for every payload found, one at a time so only one of them is held in memory
+    resource['sha256'] = hashlib.sha256(data).hexdigest()
+    if options.out_dir:
+        resource['file'] = dump(data, options, resource['sha256'])
+    try:
+        if len(data) >= 4 and struct.unpack_from('<I', data, 0)[0] == RESOURCE_SET_MAGIC:
+            yield from describe_entries(resource, data, options)
+        elif found := payload_of(data, options):
+            resource['payload'] = 'pe'
+            resource['compression'] = found[0]
+            yield resource['name'], *found
+    except (ValueError, IndexError, struct.error) as e:
+        resource['error'] = str(e)
@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import hashlib
+import argparse
+import collections
+import urllib.parse
+from http import HTTPStatus
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import dn_batch
+import dn_cache
+import dn_stats
+import metadata_util as mu
+
+# Accepted scans per worker, running or queued. Past that, new scans get 503 right away
+QUEUE_PER_WORKER = 4
+
+# Extra seconds a scan may take past its budget, for the worker's watchdog to fire and the result to come back
+TIMEOUT_GRACE = 1.0
+
+# Idle keep-alive connections are closed after this many seconds
+IDLE_TIMEOUT = 60
+
+MAX_HEADERS = 100
+
+# Request latencies kept for the /metrics quantiles
+LATENCY_WINDOW = 10000
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+def warm():
+    # Runs once in each worker at startup, so the first real scans don't pay for the fork
+    return os.getpid()
+
+def run_scan(scan, deadline, limits: mu.Limits, *args):
+    # Runs in a worker. deadline is the wall clock time the scan has to finish by, so the time
+    # it spent queued behind other scans comes out of its budget
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return {'name': args[0], 'path': args[0], 'is_dotnet': None, 'violations': [{'kind': 'time_budget', 'detail': 'Sample was still queued when its timeout ran out'}]}
+    limits.time_budget = remaining
+    return scan(*args, limits)
+
+def response(status, body, content_type='application/json', headers=None, keep_alive=True):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body)
+    if isinstance(body, str):
+        body = body.encode()
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}', f'Content-Type: {content_type}', f'Content-Length: {len(body)}']
+    lines.extend(f'{key}: {value}' for key, value in (headers or {}).items())
+    if not keep_alive:
+        lines.append('Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+
+async def read_request(reader: asyncio.StreamReader):
+    # (method, path, query, headers) of the next request on a connection, None once it is closed
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, 'Malformed request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HttpError(431, 'Too many headers')
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    if version == 'HTTP/1.0' and headers.get('connection', '').lower() != 'keep-alive':
+        headers['connection'] = 'close'
+    return method.upper(), url.path, query, headers
+
+class ScanServer:
+    # HTTP front end for dn_batch.scan_data/scan_file. Requests are handled on one event loop and
+    # parsed in a pool of worker processes that stay up, so no scan pays for interpreter startup or
+    # imports. At most workers * queue_per_worker scans are accepted at once; the rest are turned
+    # away with 503 and Retry-After, so a burst can't build a queue that blows every later deadline.
+
+    def __init__(self, workers=None, queue_per_worker=QUEUE_PER_WORKER, timeout=30.0, max_timeout=300.0, max_body=256 << 20, memory_budget=None, cache: dn_cache.ReportCache = None, allowed_paths=()):
+        self.workers = workers or os.cpu_count() or 1
+        self.capacity = self.workers * queue_per_worker
+        self.timeout = timeout
+        self.max_timeout = max_timeout
+        self.max_body = max_body
+        self.memory_budget = memory_budget # Bytes of address space per worker
+        self.cache = cache
+        self.allowed_paths = [os.path.realpath(path) for path in allowed_paths]
+        self.executor = None
+        self.in_flight = 0
+        self.started = time.monotonic()
+        self.responses = collections.Counter() # Status code -> count
+        self.rejected = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.server = None
+        self.stopping = None
+
+    async def start_pool(self):
+        limits = mu.Limits(memory_budget=self.memory_budget) if self.memory_budget else None
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=dn_batch.limit_memory, initargs=(limits,))
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, warm) for i in range(self.workers)))
+
+    async def restart_pool(self, broken):
+        # A worker died (killed for memory, crashed in native code). Only the first request to see
+        # the broken pool replaces it, the others that were in it just fail
+        if self.executor is broken:
+            self.restarts += 1
+            broken.shutdown(wait=False, cancel_futures=True)
+            await self.start_pool()
+
+    def check_path(self, path):
+        real = os.path.realpath(path)
+        if not any(os.path.commonpath([real, allowed]) == allowed for allowed in self.allowed_paths):
+            raise HttpError(403, f'{path} is not under an allowed directory')
+        if not os.path.isfile(real):
+            raise HttpError(404, f'{path} is not a file')
+        return real
+
+    def parse_timeout(self, query):
+        try:
+            timeout = float(query.get('timeout', self.timeout))
+        except ValueError:
+            raise HttpError(400, 'timeout must be a number of seconds')
+        if timeout <= 0:
+            raise HttpError(400, 'timeout must be positive')
+        return min(timeout, self.max_timeout)
+
+    async def read_body(self, reader: asyncio.StreamReader, headers):
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HttpError(411, 'Send the sample with a Content-Length')
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400, 'Invalid Content-Length')
+        if length <= 0:
+            raise HttpError(400, 'Empty body. POST the sample bytes, or pass ?path= for a file on this host')
+        if length > self.max_body:
+            raise HttpError(413, f'Sample is {length} bytes, more than the limit of {self.max_body}')
+        try:
+            return await asyncio.wait_for(reader.readexactly(length), IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HttpError(408, f'Body was not received within {IDLE_TIMEOUT}s')
+
+    async def scan(self, reader, query, headers):
+        # The record dn_batch writes for --jsonl. Every scan is strict, with the timeout as its time
+        # budget. The timeout runs from the moment the sample is received, so it includes queueing.
+        # A scan counts against the capacity until its worker is done with it, even after a 504
+        if self.in_flight >= self.capacity:
+            self.rejected += 1
+            raise HttpError(503, f'{self.in_flight} scans in progress, try again later', {'Retry-After': 1})
+        self.in_flight += 1
+        submitted = False
+        try:
+            timeout = self.parse_timeout(query)
+            limits = mu.Limits(time_budget=timeout)
+            if 'path' in query:
+                if not self.allowed_paths:
+                    raise HttpError(403, 'Scanning by path is disabled, start the server with --allow-path')
+                if headers.get('content-length', '0').strip() not in ('', '0') or 'transfer-encoding' in headers:
+                    # The body would be left unread on the connection
+                    raise HttpError(400, 'Send either the sample bytes or ?path=, not both')
+                path = self.check_path(query['path'])
+                function, args = dn_batch.scan_file, (path, True)
+            else:
+                data = await self.read_body(reader, headers)
+                name = query.get('name') or '<upload>'
+                if self.cache is not None:
+                    record = self.cache.get(hashlib.sha256(data).hexdigest(), dn_cache.cache_mode(limits))
+                    if record is not None:
+                        return dn_batch.from_cache(record, name)
+                function, args = dn_batch.scan_data, (name, data, True)
+            start = time.perf_counter()
+            executor = self.executor
+            future = executor.submit(run_scan, function, time.time() + timeout, limits, *args)
+            submitted = True
+            loop = asyncio.get_running_loop()
+            future.add_done_callback(lambda done: loop.call_soon_threadsafe(self.scan_done))
+            try:
+                record = await asyncio.wait_for(asyncio.wrap_future(future), timeout + TIMEOUT_GRACE)
+            except asyncio.TimeoutError:
+                # Drops the scan if it is still queued. A running one is stopped by its watchdog
+                future.cancel()
+                self.timeouts += 1
+                raise HttpError(504, f'Scan did not finish within {timeout}s')
+            except BrokenProcessPool:
+                await self.restart_pool(executor)
+                raise HttpError(500, 'The worker process died while scanning the sample')
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+            return dn_batch.store(record, None, self.cache, dn_cache.cache_mode(limits))
+        finally:
+            if not submitted:
+                self.in_flight -= 1
+
+    def scan_done(self):
+        self.in_flight -= 1
+
+    def health(self):
+        return {
+            'status': 'stopping' if self.stopping and self.stopping.is_set() else 'ok',
+            'workers': self.workers,
+            'in_flight': self.in_flight,
+            'capacity': self.capacity,
+            'uptime': time.monotonic() - self.started
+        }
+
+    def metrics(self):
+        # Prometheus text format
+        lines = [
+            '# HELP dnparser_server_responses_total Responses sent, by status code',
+            '# TYPE dnparser_server_responses_total counter'
+        ]
+        lines.extend(f'dnparser_server_responses_total{{status="{status}"}} {count}' for status, count in sorted(self.responses.items()))
+        for name, kind, value, description in [
+            ('in_flight', 'gauge', self.in_flight, 'Scans running or queued'),
+            ('capacity', 'gauge', self.capacity, 'Scans accepted at once before returning 503'),
+            ('rejected_total', 'counter', self.rejected, 'Scans turned away with 503'),
+            ('timeouts_total', 'counter', self.timeouts, 'Scans that returned 504'),
+            ('pool_restarts_total', 'counter', self.restarts, 'Worker pools replaced after a worker died')
+        ]:
+            lines.append(f'# HELP dnparser_server_{name} {description}')
+            lines.append(f'# TYPE dnparser_server_{name} {kind}')
+            lines.append(f'dnparser_server_{name} {value}')
+        latencies = sorted(self.latencies)
+        lines.append(f'# HELP dnparser_server_scan_seconds Seconds from submission to result of the last {LATENCY_WINDOW} requests')
+        lines.append('# TYPE dnparser_server_scan_seconds summary')
+        for q in dn_stats.QUANTILES:
+            lines.append(f'dnparser_server_scan_seconds{{quantile="{q}"}} {dn_stats.quantile(latencies, q)}')
+        lines.append(f'dnparser_server_scan_seconds_sum {sum(latencies)}')
+        lines.append(f'dnparser_server_scan_seconds_count {len(latencies)}')
+        return '\n'.join(lines) + '\n'
+
+    async def dispatch(self, reader, method, path, query, headers):
+        # (status, body, content type)
+        if path == '/scan':
+            if method != 'POST':
+                raise HttpError(405, 'Use POST /scan', {'Allow': 'POST'})
+            return 200, await self.scan(reader, query, headers), 'application/json'
+        if method != 'GET':
+            raise HttpError(405, f'Use GET {path}', {'Allow': 'GET'})
+        if path == '/health':
+            return 200, self.health(), 'application/json'
+        if path == '/metrics':
+            return 200, self.metrics(), 'text/plain; version=0.0.4'
+        raise HttpError(404, f'No such endpoint {path}')
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # One connection, with keep-alive. An error before the request body was read leaves the
+        # stream out of sync, so those close the connection
+        try:
+            while not self.stopping.is_set():
+                try:
+                    request = await asyncio.wait_for(read_request(reader), IDLE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except (HttpError, ValueError, asyncio.LimitOverrunError) as e:
+                    status = e.status if isinstance(e, HttpError) else 400
+                    self.responses[status] += 1
+                    writer.write(response(status, {'error': str(e)}, keep_alive=False))
+                    break
+                if request is None:
+                    break
+                method, path, query, headers = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                try:
+                    status, body, content_type = await self.dispatch(reader, method, path, query, headers)
+                    extra = {}
+                except HttpError as e:
+                    status, body, content_type, extra = e.status, {'error': str(e)}, 'application/json', e.headers
+                    # Only timeouts and dead workers happen after the body was read
+                    keep_alive = keep_alive and (status in (500, 504) or headers.get('content-length', '0').strip() in ('', '0'))
+                except asyncio.IncompleteReadError:
+                    break
+                self.responses[status] += 1
+                writer.write(response(status, body, content_type, extra, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, socket_path=None):
+        self.stopping = asyncio.Event()
+        await self.start_pool()
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path) # Left behind by a previous run
+            self.server = await asyncio.start_unix_server(self.handle, socket_path)
+            where = socket_path
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+            where = f'http://{host}:{port}'
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopping.set)
+        print(f'Listening on {where} with {self.workers} workers', file=sys.stderr)
+        try:
+            await self.stopping.wait()
+        finally:
+            # Stop accepting, let accepted scans finish, then stop the workers
+            self.server.close()
+            await self.server.wait_closed()
+            while self.in_flight:
+                await asyncio.sleep(0.05)
+            self.executor.shutdown(wait=True)
+            if socket_path and os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan samples submitted over HTTP on localhost or a Unix socket, with a warm pool of worker processes.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1).')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port to listen on (default: 8765).')
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of TCP.')
+    parser.add_argument('-j', '--workers', type=int, help='Worker processes (default: all cores).')
+    parser.add_argument('--queue', type=int, default=QUEUE_PER_WORKER, help=f'Scans accepted per worker before answering 503 (default: {QUEUE_PER_WORKER}).')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Default seconds per scan, including time spent queued (default: 30).')
+    parser.add_argument('--max-timeout', type=float, default=300.0, help='Largest ?timeout= a client may ask for (default: 300).')
+    parser.add_argument('--max-body', type=int, default=256, help='Largest sample accepted, in MB (default: 256).')
+    parser.add_argument('--memory-budget', type=int, help='MB of address space per worker process.')
+    parser.add_argument('--cache', help='SQLite file to answer repeated samples from and store new reports in.')
+    parser.add_argument('--allow-path', action='append', default=[], help='Directory whose files may be scanned with ?path= instead of uploading them. Repeatable.')
+    args = parser.parse_args()
+    cache = dn_cache.ReportCache(args.cache) if args.cache else None
+    server = ScanServer(args.workers, args.queue, args.timeout, args.max_timeout, args.max_body << 20, args.memory_budget << 20 if args.memory_budget else None, cache, args.allow_path)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.socket))
+    finally:
+        if cache is not None:
+            cache.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import os
+import json
+import math
+import time
+import pstats
+import cProfile
+import argparse
+import contextlib
+import dn_extract
+
+# In the order dn_extract runs them
+PHASES = ['load', 'find_metadata', 'get_streams', 'parse', 'assembly', 'attributes', 'guids', 'hashes', 'resources', 'oddities', 'close']
+
+METRICS = {
+    'seconds': 'Wall time of each extraction phase per file',
+    'bytes_read': 'Bytes read through pefile get_data and from the metadata tables and heaps per file and phase',
+    'get_data_calls': 'Calls to pefile get_data per file and phase'
+}
+
+QUANTILES = [0.5, 0.9, 0.99]
+
+class FileStats:
+    # Counters for one file, filled through dn_extract.extract(..., stats=FileStats())
+
+    def __init__(self, name=None):
+        self.name = name
+        self.phases = {} # Phase -> {metric: value}
+        self.get_data_bytes = 0
+        self.get_data_calls = 0
+        self.metadata = None
+
+    def attach(self, pe, metadata=None):
+        # Count every get_data call, including the ones pefile makes for get_dword_at_rva etc.
+        get_data = pe.get_data
+
+        def counting_get_data(*args, **kwargs):
+            data = get_data(*args, **kwargs)
+            self.get_data_calls += 1
+            self.get_data_bytes += len(data)
+            return data
+
+        pe.get_data = counting_get_data
+        self.metadata = metadata
+
+    def detach(self, pe):
+        # The wrapper holds a reference to pe, so drop it before the file is closed
+        pe.__dict__.pop('get_data', None)
+
+    def counters(self):
+        return time.perf_counter(), self.get_data_bytes + (self.metadata.get_bytes_read() if self.metadata else 0), self.get_data_calls
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        before = self.counters()
+        try:
+            yield
+        finally:
+            after = self.counters()
+            entry = self.phases.setdefault(name, dict.fromkeys(METRICS, 0))
+            for metric, start, end in zip(METRICS, before, after):
+                entry[metric] += end - start
+
+    def to_dict(self):
+        return {'name': self.name, 'phases': self.phases, 'seconds': sum(entry['seconds'] for entry in self.phases.values())}
+
+def quantile(values, q):
+    # Nearest rank on sorted values
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))] if values else 0
+
+class RunStats:
+    # Per-file stats of a whole run, summarized as quantiles per phase
+
+    def __init__(self):
+        self.files = []
+
+    def add(self, file_stats):
+        # A FileStats or its to_dict() from a worker process
+        self.files.append(file_stats.to_dict() if isinstance(file_stats, FileStats) else file_stats)
+
+    def summary(self):
+        # {phase: {metric: {'count', 'sum', 'p50', 'p90', 'p99', 'max'}}}, plus a 'total' phase per file
+        summary = {}
+        for phase in PHASES + ['total']:
+            for metric in METRICS:
+                if phase == 'total':
+                    values = sorted(sum(entry[metric] for entry in stats['phases'].values()) for stats in self.files)
+                else:
+                    values = sorted(stats['phases'][phase][metric] for stats in self.files if phase in stats['phases'])
+                if not values:
+                    continue
+                entry = {'count': len(values), 'sum': sum(values), 'max': values[-1]}
+                for q in QUANTILES:
+                    entry[f'p{round(q * 100)}'] = quantile(values, q)
+                summary.setdefault(phase, {})[metric] = entry
+        return summary
+
+    def slowest(self, count):
+        return sorted(self.files, key=lambda stats: stats['seconds'], reverse=True)[:count]
+
+    def to_json(self):
+        return json.dumps({'files': len(self.files), 'phases': self.summary(), 'slowest': [{'name': stats['name'], 'seconds': stats['seconds']} for stats in self.slowest(10)]}, indent=2)
+
+    def to_prometheus(self):
+        # Prometheus text exposition format, one summary per metric labelled by phase
+        lines = []
+        summary = self.summary()
+        for metric, description in METRICS.items():
+            name = f'dnparser_phase_{metric}'
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} summary')
+            for phase, metrics in summary.items():
+                entry = metrics[metric]
+                for q in QUANTILES:
+                    lines.append(f'{name}{{phase="{phase}",quantile="{q}"}} {entry[f"p{round(q * 100)}"]}')
+                lines.append(f'{name}_sum{{phase="{phase}"}} {entry["sum"]}')
+                lines.append(f'{name}_count{{phase="{phase}"}} {entry["count"]}')
+        lines.append('# HELP dnparser_files Files with stats in this run')
+        lines.append('# TYPE dnparser_files gauge')
+        lines.append(f'dnparser_files {len(self.files)}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, format='json'):
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if format == 'prometheus' else self.to_json())
+
+def profile_slowest(run_stats: RunStats, count, out_dir, limits=None):
+    # Parse the slowest files again under cProfile. Writes <n>_<file>.prof for pstats/snakeviz
+    # and a .txt with the top functions by cumulative time. Returns the files written
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for i, stats in enumerate(run_stats.slowest(count)):
+        path = stats['name']
+        if not path or not os.path.isfile(path):
+            continue # Archive members and stdin can't be read again
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            dn_extract.extract(path, limits=limits)
+        except Exception:
+            pass
+        finally:
+            profile.disable()
+        base = os.path.join(out_dir, f'{i:02d}_{os.path.basename(path)}')
+        profile.dump_stats(base + '.prof')
+        with open(base + '.txt', 'w') as f:
+            f.write(f'{path}: {stats["seconds"] * 1000:.3f} ms in the batch run\n\n')
+            pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(30)
+        written.append(base + '.prof')
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the per-file stats in parser_main.py --jsonl --stats output.')
+    parser.add_argument('stats', help='JSON file written by --stats.')
+    args = parser.parse_args()
+    with open(args.stats) as f:
+        summary = json.load(f)
+    print("{:<14} {:>12} {:>12} {:>12} {:>12} {:>14} {:>10}".format('Phase', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'max (ms)', 'p50 bytes', 'p50 calls'))
+    for phase, metrics in summary['phases'].items():
+        seconds = metrics['seconds']
+        print(f'{phase:<14} {seconds["p50"] * 1000:>12.3f} {seconds["p90"] * 1000:>12.3f} {seconds["p99"] * 1000:>12.3f} {seconds["max"] * 1000:>12.3f} {metrics["bytes_read"]["p50"]:>14} {metrics["get_data_calls"]["p50"]:>10}')
+    print(f'\n{summary["files"]} files. Slowest:')
+    for stats in summary['slowest']:
+        print(f'{stats["seconds"] * 1000:>10.3f} ms  {stats["name"]}')
+
+if __name__ == '__main__':
+    main()
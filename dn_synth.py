@@ -0,0 +1,310 @@
+import os
+import sys
+import uuid
+import struct
+import argparse
+import dn_constants as const
+import dn_extract
+import metadata_util as mu
+
+# Rows per table unless overridden. Module, Assembly and AssemblyRef always have exactly one
+DEFAULT_ROWS = {'TypeRef': 4, 'TypeDef': 4, 'Field': 8, 'MethodDef': 8, 'Param': 8, 'MemberRef': 4, 'CustomAttribute': 8}
+
+# Named corpora for dn_bench and dn_synth --check. Rows are picked to land on both sides of the
+# 2 to 4 byte index widths: simple indexes widen at 2^16 rows, coded ones at 2^(16 - tag bits)
+SCENARIOS = {
+    'small': {},
+    'coded_wide': {'rows': {'TypeRef': 1 << 14, 'MemberRef': 1 << 11, 'CustomAttribute': 1 << 11}},
+    'simple_wide': {'rows': {'TypeDef': 1 << 16, 'MethodDef': 1 << 16}},
+    'heaps_wide': {'heap_padding': {'#Strings': 1 << 16, '#Blob': 1 << 16, '#GUID': 1 << 12}},
+    'attributes': {'rows': {'CustomAttribute': 100000}},
+    'unoptimized': {'rows': {'Field': 64, 'MethodDef': 64}, 'unoptimized': True}
+}
+
+FILE_ALIGNMENT = 0x200
+SECTION_ALIGNMENT = 0x2000
+TEXT_RVA = 0x2000
+CLR_HEADER_SIZE = 72
+
+def align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+def compressed_uint(value):
+    if value < 0x80:
+        return bytes([value])
+    if value < 0x4000:
+        return struct.pack('>H', value | 0x8000)
+    return struct.pack('>I', value | 0xC0000000)
+
+def ser_string(value):
+    data = value.encode('utf-8')
+    return compressed_uint(len(data)) + data
+
+def tiny_body(il):
+    # Tiny header: the code size in the upper 6 bits, so at most 63 bytes of IL and no locals or
+    # exception handlers
+    return bytes([len(il) << 2 | 0x02]) + il
+
+def fat_body(il, max_stack=8, local_var_sig_token=0, init_locals=False, sections=()):
+    # Fat header, then an extra data section per (fat, clauses) pair: an exception handling table
+    # of zeroed clauses, aligned to 4 bytes after the code or the previous section
+    flags_size = 0x3003 | (0x08 if sections else 0) | (0x10 if init_locals else 0)
+    data = bytearray(struct.pack('<HHII', flags_size, max_stack, len(il), local_var_sig_token) + il)
+    for i, (fat, clauses) in enumerate(sections):
+        data += b'\x00' * (align(len(data), 4) - len(data))
+        more = 0x80 if i < len(sections) - 1 else 0
+        if fat:
+            size = 4 + 24 * clauses
+            data += bytes([0x41 | more]) + size.to_bytes(3, 'little')
+        else:
+            size = 4 + 12 * clauses
+            data += bytes([0x01 | more, size, 0, 0])
+        data += b'\x00' * (size - 4)
+    return bytes(data)
+
+class HeapBuilder:
+    # #Strings and #Blob contents, with identical values stored once
+
+    def __init__(self, blob=False):
+        self.blob = blob
+        self.data = bytearray(b'\x00')
+        self.offsets = {}
+
+    def add(self, value):
+        if value not in self.offsets:
+            self.offsets[value] = len(self.data)
+            if self.blob:
+                self.data += compressed_uint(len(value)) + value
+            else:
+                self.data += value.encode('utf-8') + b'\x00'
+        return self.offsets[value]
+
+def spread(owner_count, target_count, row):
+    # First row of an evenly split list column, e.g. the MethodList of TypeDef row
+    return 1 + (row - 1) * target_count // owner_count
+
+class AssemblyBuilder:
+    # Builds a minimal but valid PE32 DLL with a CLR header and metadata. The row values are
+    # generated so names, signatures and attribute blobs all resolve like a compiler's output.
+    # bodies maps MethodDef rows to method bodies from tiny_body or fat_body, the other methods
+    # have none (RVA 0).
+
+    def __init__(self, rows=None, heap_padding=None, unoptimized=False, name='Synthetic', version=(1, 2, 3, 4), mvid=None, typelib_id=None, bodies=None):
+        self.name = name
+        self.version = version
+        self.mvid = mvid or uuid.uuid4()
+        self.typelib_id = typelib_id or str(uuid.uuid4())
+        self.unoptimized = unoptimized
+        self.heap_padding = heap_padding or {}
+        # Bodies go between the CLR header and the metadata, 4 byte aligned as fat headers must be
+        self.bodies = dict(sorted((bodies or {}).items()))
+        self.body_rvas = {}
+        rva = TEXT_RVA + CLR_HEADER_SIZE
+        for row, body in self.bodies.items():
+            self.body_rvas[row] = rva
+            rva += align(len(body), 4)
+        counts = {'Module': 1, 'Assembly': 1, 'AssemblyRef': 1, **DEFAULT_ROWS, **(rows or {})}
+        # The first TypeRefs and MemberRefs are the assembly attributes, TypeDef 1 is <Module>
+        for table, minimum in (('TypeRef', 3), ('MemberRef', 2), ('CustomAttribute', 2), ('TypeDef', 2), ('MethodDef', 1)):
+            counts[table] = max(counts[table], minimum)
+        if unoptimized:
+            counts['FieldPtr'] = counts['Field']
+            counts['MethodPtr'] = counts['MethodDef']
+        self.counts = {name: counts[name] for name in const.METADATA_TABLE_FLAGS.values() if counts.get(name)}
+
+    def index_sizes(self, heap_sizes):
+        sizes = {table: 4 if self.counts.get(table, 0) > 0xFFFF else 2 for table in const.METADATA_TABLE_FLAGS.values()}
+        for name, tables in const.CODED_INDEXES.items():
+            bits = (len(tables) - 1).bit_length()
+            sizes[name] = 4 if max(self.counts.get(table, 0) for table in tables) >= 1 << (16 - bits) else 2
+        sizes.update(heap_sizes)
+        return sizes
+
+    def coded(self, index, table, row):
+        tables = const.CODED_INDEXES[index]
+        return row << (len(tables) - 1).bit_length() | tables.index(table)
+
+    def row_values(self, table, row):
+        counts = self.counts
+        strings = self.strings.add
+        blobs = self.blobs.add
+        if table == 'Module':
+            return [0, strings(self.name + '.dll'), 1, 0, 0]
+        if table == 'TypeRef':
+            names = {1: ('System.Runtime.InteropServices', 'GuidAttribute'), 2: ('System.Reflection', 'AssemblyTitleAttribute'), 3: ('System', 'Object')}
+            namespace, name = names.get(row, (f'Synthetic.Ref{row % 16}', f'Type{row}'))
+            return [self.coded('ResolutionScope', 'AssemblyRef', 1), strings(name), strings(namespace)]
+        if table == 'TypeDef':
+            namespace, name = ('', '<Module>') if row == 1 else (f'{self.name}.Ns{row % 8}', f'Class{row}')
+            return [0 if row == 1 else 0x100001, strings(name), strings(namespace), 0 if row == 1 else self.coded('TypeDefOrRef', 'TypeRef', 3),
+                    spread(counts['TypeDef'], counts['Field'], row), spread(counts['TypeDef'], counts['MethodDef'], row)]
+        if table == 'Field':
+            return [0x0006, strings(f'field{row}'), blobs(b'\x06\x08')]
+        if table == 'MethodDef':
+            # Every method has a parameterless constructor signature so it can be an attribute's
+            return [self.body_rvas.get(row, 0), 0, 0x1886, strings('.ctor' if row % 2 else f'Method{row}'), blobs(b'\x20\x00\x01'), spread(counts['MethodDef'], counts['Param'], row)]
+        if table == 'Param':
+            return [0, 1, strings(f'p{row}')]
+        if table == 'MemberRef':
+            if row <= 2:
+                return [self.coded('MemberRefParent', 'TypeRef', row), strings('.ctor'), blobs(b'\x20\x01\x01\x0e')]
+            return [self.coded('MemberRefParent', 'TypeRef', (row - 1) % counts['TypeRef'] + 1), strings(f'Member{row}'), blobs(b'\x20\x00\x01')]
+        if table == 'CustomAttribute':
+            if row == 1:
+                return [self.coded('HasCustomAttribute', 'Assembly', 1), self.coded('CustomAttributeType', 'MemberRef', 1), blobs(b'\x01\x00' + ser_string(self.typelib_id) + b'\x00\x00')]
+            if row == 2:
+                return [self.coded('HasCustomAttribute', 'Assembly', 1), self.coded('CustomAttributeType', 'MemberRef', 2), blobs(b'\x01\x00' + ser_string(self.name) + b'\x00\x00')]
+            return [self.coded('HasCustomAttribute', 'TypeDef', (row - 3) % counts['TypeDef'] + 1), self.coded('CustomAttributeType', 'MethodDef', (row - 3) % counts['MethodDef'] + 1), blobs(b'\x01\x00\x00\x00')]
+        if table == 'StandAloneSig':
+            # Locals of an int and a string
+            return [blobs(b'\x07\x02\x08\x0e')]
+        if table == 'Assembly':
+            return [0x8004, *self.version, 0, 0, strings(self.name), 0]
+        if table == 'AssemblyRef':
+            return [4, 0, 0, 0, 0, 0, strings('mscorlib'), 0, 0]
+        if table in ('FieldPtr', 'MethodPtr'):
+            # Reversed, so reading a list column without the Ptr table gives the wrong rows
+            return [counts[table] - row + 1]
+        return [0] * len(const.TABLE_COLUMNS[table])
+
+    def tables_stream(self):
+        # Also fills the heaps, which are rebuilt on every call
+        self.strings = HeapBuilder()
+        self.blobs = HeapBuilder(blob=True)
+        self.guids = [self.mvid.bytes_le]
+        rows = {table: [self.row_values(table, row) for row in range(1, count + 1)] for table, count in self.counts.items()}
+        if self.heap_padding.get('#Strings'):
+            self.strings.data += b'A' * self.heap_padding['#Strings'] + b'\x00'
+        if self.heap_padding.get('#Blob'):
+            self.blobs.add(b'\x00' * self.heap_padding['#Blob'])
+        self.guids += [uuid.UUID(int=i).bytes_le for i in range(self.heap_padding.get('#GUID', 0))]
+        heap_flags = 0
+        heap_sizes = {}
+        for flag, heap_name, size in ((0x01, '#Strings', len(self.strings.data)), (0x02, '#GUID', 16 * len(self.guids)), (0x04, '#Blob', len(self.blobs.data))):
+            heap_sizes[heap_name] = 4 if size > 0xFFFF else 2
+            if size > 0xFFFF:
+                heap_flags |= flag
+        sizes = self.index_sizes(heap_sizes)
+        valid = sum(flag for flag, name in const.METADATA_TABLE_FLAGS.items() if name in self.counts)
+        data = bytearray(struct.pack('<IBBBBQQ', 0, 2, 0, heap_flags, 1, valid, 0))
+        data += struct.pack(f'<{len(self.counts)}I', *self.counts.values())
+        for table, values in rows.items():
+            layout = struct.Struct('<' + ''.join(const.STRUCT_FORMATS[size if isinstance(size, int) else sizes[size]] for name, size in const.TABLE_COLUMNS[table]))
+            for row in values:
+                data += layout.pack(*row)
+        return bytes(data)
+
+    def metadata(self):
+        tables = self.tables_stream()
+        user_strings = b'\x00' + compressed_uint(len(self.name) * 2 + 1) + self.name.encode('utf-16-le') + b'\x00'
+        streams = [('#-' if self.unoptimized else '#~', tables), ('#Strings', bytes(self.strings.data)), ('#US', user_strings), ('#GUID', b''.join(self.guids)), ('#Blob', bytes(self.blobs.data))]
+        version = b'v4.0.30319'.ljust(12, b'\x00')
+        header_size = 16 + len(version) + 4 + sum(8 + align(len(name) + 1, 4) for name, data in streams)
+        root = bytearray(b'BSJB' + struct.pack('<HHII', 1, 1, 0, len(version)) + version + struct.pack('<HH', 0, len(streams)))
+        body = bytearray()
+        for name, data in streams:
+            data = data + b'\x00' * (align(len(data), 4) - len(data))
+            root += struct.pack('<II', header_size + len(body), len(data)) + name.encode().ljust(align(len(name) + 1, 4), b'\x00')
+            body += data
+        return bytes(root + body)
+
+    def build(self):
+        metadata = self.metadata()
+        code = b''.join(body.ljust(align(len(body), 4), b'\x00') for body in self.bodies.values())
+        metadata_rva = TEXT_RVA + CLR_HEADER_SIZE + len(code)
+        clr_header = struct.pack('<IHHIIII', CLR_HEADER_SIZE, 2, 5, metadata_rva, len(metadata), 1, 0).ljust(CLR_HEADER_SIZE, b'\x00')
+        text = clr_header + code + metadata
+        raw_size = align(len(text), FILE_ALIGNMENT)
+        image_size = align(TEXT_RVA + len(text), SECTION_ALIGNMENT)
+        dos_header = b'MZ'.ljust(0x3C, b'\x00') + struct.pack('<I', 0x80)
+        coff_header = struct.pack('<HHIIIHH', 0x14C, 1, 0, 0, 0, 0xE0, 0x2102)
+        optional_header = struct.pack('<HBBIIIIIIIIIHHHHHHIIIIHHIIIIII', 0x10B, 11, 0, raw_size, 0, 0, 0, TEXT_RVA, 0, 0x10000000, SECTION_ALIGNMENT, FILE_ALIGNMENT,
+                                      4, 0, 0, 0, 4, 0, 0, image_size, FILE_ALIGNMENT, 0, 3, 0x8540, 0x100000, 0x1000, 0x100000, 0x1000, 0, 16)
+        directories = [(0, 0)] * 16
+        directories[14] = (TEXT_RVA, CLR_HEADER_SIZE)
+        optional_header += b''.join(struct.pack('<II', rva, size) for rva, size in directories)
+        section = struct.pack('<8sIIIIIIHHI', b'.text', len(text), TEXT_RVA, raw_size, FILE_ALIGNMENT, 0, 0, 0, 0, 0x60000020)
+        headers = (dos_header.ljust(0x80, b'\x00') + b'PE\x00\x00' + coff_header + optional_header + section).ljust(FILE_ALIGNMENT, b'\x00')
+        return headers + text.ljust(raw_size, b'\x00')
+
+    def expected(self):
+        # What a correct parse of build() reports
+        return {
+            'assembly_name': self.name,
+            'assembly_version': '.'.join(str(part) for part in self.version),
+            'module_name': self.name + '.dll',
+            'mvid': str(self.mvid),
+            'typelib_ids': [self.typelib_id],
+            'row_counts': dict(self.counts)
+        }
+
+def build(rows=None, heap_padding=None, unoptimized=False, **kwargs):
+    return AssemblyBuilder(rows, heap_padding, unoptimized, **kwargs).build()
+
+def iter_corpus(scenario, count):
+    # count distinct samples of one scenario
+    for i in range(count):
+        builder = AssemblyBuilder(name=f'Synthetic{i}', mvid=uuid.UUID(int=i + 1), typelib_id=str(uuid.UUID(int=(i + 1) << 64)), **SCENARIOS[scenario])
+        yield f'{scenario}{i}.dll', builder.build()
+
+def check(scenario):
+    # Parse one sample of a scenario and compare against what was generated. Returns the mismatches.
+    # The generator and the parser share dn_constants, so this can't catch a wrong table layout:
+    # tests/test_synth.py checks the layout against row sizes from ECMA-335
+    builder = AssemblyBuilder(**SCENARIOS[scenario])
+    data = builder.build()
+    expected = builder.expected()
+    report = dn_extract.extract(data, scenario, mu.Limits(max_rows=1 << 24)).to_dict()
+    problems = [f'{key}: expected {expected[key]!r}, got {report.get(key)!r}' for key in ('assembly_name', 'assembly_version', 'module_name', 'mvid', 'typelib_ids') if report.get(key) != expected[key]]
+    problems += [f'violation: {violation}' for violation in report['violations']]
+    pe = dn_extract.load_pe(data)
+    metadata = mu.Metadata()
+    try:
+        streams = dn_extract.get_streams(pe, dn_extract.find_metadata(pe, dn_extract.DotNetReport())[0], dn_extract.DotNetReport())
+        metadata.parse(pe, streams)
+        for table, count in expected['row_counts'].items():
+            if metadata.table_rowcounts.get(table) != count:
+                problems.append(f'{table}: expected {count} rows, got {metadata.table_rowcounts.get(table)}')
+        # Every TypeDef must list the methods and fields it was generated with, through the Ptr tables if any
+        counts = expected['row_counts']
+        for row in range(1, counts['TypeDef'] + 1):
+            for owned, column in (('MethodDef', 'MethodList'), ('Field', 'FieldList')):
+                first, last = spread(counts['TypeDef'], counts[owned], row), spread(counts['TypeDef'], counts[owned], row + 1)
+                wanted = list(range(first, last))
+                if builder.unoptimized:
+                    wanted = [counts[owned] - i + 1 for i in wanted]
+                if metadata.get_list('TypeDef', column, row) != wanted:
+                    problems.append(f'TypeDef {row} {column}: expected {wanted}, got {metadata.get_list("TypeDef", column, row)}')
+                    break
+                if column == 'MethodList' and wanted and metadata.get_owner('TypeDef', column, wanted[0]) != row:
+                    problems.append(f'MethodDef {wanted[0]}: expected owner {row}, got {metadata.get_owner("TypeDef", column, wanted[0])}')
+            if problems:
+                break
+    finally:
+        metadata.release()
+        dn_extract.close_pe(pe)
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic .NET assemblies for benchmarks and parser checks.')
+    parser.add_argument('-s', '--scenario', choices=SCENARIOS, default='small', help='Table and heap sizes to generate.')
+    parser.add_argument('-n', '--count', type=int, default=1, help='Number of samples to write.')
+    parser.add_argument('-o', '--output', default='.', help='Directory to write the samples to.')
+    parser.add_argument('--check', action='store_true', help='Instead of writing files, parse one sample of every scenario and compare it with what was generated.')
+    args = parser.parse_args()
+    if args.check:
+        failed = False
+        for scenario in SCENARIOS:
+            problems = check(scenario)
+            print(f'{scenario:<16} {"ok" if not problems else "FAILED"}')
+            for problem in problems:
+                print(f'    {problem}')
+            failed = failed or bool(problems)
+        sys.exit(1 if failed else 0)
+    os.makedirs(args.output, exist_ok=True)
+    for name, data in iter_corpus(args.scenario, args.count):
+        with open(os.path.join(args.output, name), 'wb') as f:
+            f.write(data)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import re
+import sys
+import uuid
+import argparse
+import dn_hash
+import dn_cache
+
+# Cluster rules list at most this many member hashes in their meta
+MAX_META_SAMPLES = 10
+
+def escape_string(value):
+    # YARA text string literal for a str, or for raw bytes
+    escaped = ''
+    for char in value.encode('utf-8') if isinstance(value, str) else value:
+        if char in (0x22, 0x5C):
+            escaped += '\\' + chr(char)
+        elif 0x20 <= char < 0x7F:
+            escaped += chr(char)
+        else:
+            escaped += f'\\x{char:02x}'
+    return f'"{escaped}"'
+
+def hex_string(data_hex):
+    return '{ ' + ' '.join(data_hex[i:i + 2] for i in range(0, len(data_hex), 2)) + ' }'
+
+def rule_name(*parts):
+    name = '_'.join(re.sub(r'[^A-Za-z0-9_]', '_', str(part)) for part in parts if part)
+    if not name or name[0].isdigit():
+        name = 'dn_' + name
+    return name[:128]
+
+def render_rule(name, meta, strings, condition, tags=()):
+    lines = [f'rule {name}' + (' : ' + ' '.join(tags) if tags else ''), '{', '    meta:']
+    for key, value in meta.items():
+        lines.append(f'        {key} = {value if isinstance(value, int) else escape_string(str(value))}')
+    if strings:
+        lines.append('    strings:')
+        for identifier, value in strings:
+            lines.append(f'        {identifier} = {value}')
+    lines.append('    condition:')
+    lines.append(f'        {condition}')
+    lines.append('}')
+    return '\n'.join(lines)
+
+def compressed_length(length):
+    # ECMA-335 II.23.2 compressed unsigned integer, as used for SerString lengths
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    return (length | 0xC0000000).to_bytes(4, 'big')
+
+def typelib_string(typelib_id):
+    # The GuidAttribute blob stores the string with its length in front, so the fullword
+    # modifier can't be used. That is 0x24 ('$') for a bare GUID and 0x26 ('&') with braces
+    data = typelib_id.encode('utf-8')
+    return escape_string(compressed_length(len(data)) + data) + ' ascii'
+
+def sample_rule(record, use_dotnet=False):
+    # Rule for one report, or None when nothing in it is distinctive enough
+    if not record.get('is_dotnet') or 'error' in record:
+        return None
+    typelib_ids = record.get('typelib_ids') or []
+    mvid = record.get('mvid')
+    name = record.get('assembly_name')
+    version_hex = record.get('assembly_version_hex')
+    module_name = record.get('module_name')
+    meta = {'author': 'dnparser', 'description': f'{name or module_name or "Unknown"} .NET assembly'}
+    for key in ('sha256', 'assembly_name', 'assembly_version', 'module_name', 'mvid'):
+        if record.get(key):
+            meta[key] = record[key]
+    if typelib_ids:
+        meta['typelib_id'] = typelib_ids[0]
+    strings = []
+    if use_dotnet:
+        anchors = [f'dotnet.typelib == {escape_string(typelib_id)}' for typelib_id in typelib_ids]
+        if mvid:
+            anchors.append(f'for any i in (0..dotnet.number_of_guids - 1): (dotnet.guids[i] == {escape_string(mvid)})')
+        if name and version_hex:
+            major, minor, build, revision = record['assembly_version'].split('.')
+            anchors.append(f'(dotnet.assembly.name == {escape_string(name)} and dotnet.assembly.version.major == {major} and dotnet.assembly.version.minor == {minor} and dotnet.assembly.version.build_number == {build} and dotnet.assembly.version.revision_number == {revision})')
+        if not anchors:
+            return None
+        condition = 'dotnet.is_dotnet and (' + ' or '.join(anchors) + ')'
+    else:
+        anchors = []
+        for i, typelib_id in enumerate(typelib_ids):
+            strings.append((f'$typelib{i}', typelib_string(typelib_id)))
+            anchors.append(f'$typelib{i}')
+        if record.get('mvid_hex'):
+            # Raw #GUID bytes, which are the little-endian form of the UUID
+            strings.append(('$mvid', hex_string(record['mvid_hex'])))
+            anchors.append('$mvid')
+        # Assembly and module names live in #Strings, and are only distinctive next to the version
+        name_terms = []
+        if name:
+            strings.append(('$name', escape_string(name) + ' ascii fullword'))
+            name_terms.append('$name')
+        if module_name and module_name != name:
+            strings.append(('$module_name', escape_string(module_name) + ' ascii fullword'))
+            name_terms.append('$module_name')
+        if name_terms and version_hex:
+            strings.append(('$version', hex_string(version_hex)))
+            anchors.append(f'(({" or ".join(name_terms)}) and $version)')
+        elif name_terms:
+            strings = [string for string in strings if string[0] not in name_terms]
+        if not anchors:
+            return None
+        condition = 'uint16(0) == 0x5A4D and (' + ' or '.join(anchors) + ')'
+    return render_rule(rule_name('dnparser', name or module_name, (record.get('sha256') or record.get('mvid_hex') or '')[:12]), meta, strings, condition)
+
+def cluster_rules(records, kind, min_size=2, use_dotnet=False):
+    # One rule per TypeLib ID or MVID shared by at least min_size samples
+    field = {'typelib': 'typelib_ids', 'mvid': 'mvid'}[kind]
+    index = dn_hash.HashIndex([kind])
+    seen = set()
+    for record in records:
+        # The same file can be stored under several paths
+        sample_id = record.get('sha256') or record.get('path') or record.get('name')
+        if sample_id in seen:
+            continue
+        seen.add(sample_id)
+        values = record.get(field)
+        for value in values if isinstance(values, list) else [values]:
+            if value:
+                index.add(sample_id, {kind: value.lower()})
+    for value, samples in index.clusters(kind, min_size).items():
+        meta = {'author': 'dnparser', 'description': f'.NET samples sharing {kind} {value}', kind: value, 'samples': len(samples)}
+        for i, sample in enumerate(samples[:MAX_META_SAMPLES]):
+            meta[f'sample{i}'] = sample
+        if kind == 'typelib':
+            if use_dotnet:
+                # Values were lowercased to group them, and samples may spell them in either case
+                condition = f'dotnet.typelib iequals {escape_string(value)}'
+                strings = []
+            else:
+                strings = [('$typelib', typelib_string(value) + ' nocase')]
+                condition = 'uint16(0) == 0x5A4D and $typelib'
+        else:
+            if use_dotnet:
+                condition = f'for any i in (0..dotnet.number_of_guids - 1): (dotnet.guids[i] == {escape_string(value)})'
+                strings = []
+            else:
+                strings = [('$mvid', hex_string(uuid.UUID(value).bytes_le.hex()))]
+                condition = 'uint16(0) == 0x5A4D and $mvid'
+        yield render_rule(rule_name('dnparser', kind, value), meta, strings, condition, tags=['cluster'])
+
+def generate(records, per_sample=True, cluster_kinds=(), min_size=2, use_dotnet=False):
+    records = list(records)
+    rules = []
+    if use_dotnet:
+        rules.append('import "dotnet"\n')
+    seen = set()
+    if per_sample:
+        for record in records:
+            rule = sample_rule(record, use_dotnet)
+            if rule is not None and (name := rule.split('\n', 1)[0]) not in seen:
+                seen.add(name)
+                rules.append(rule)
+    for kind in cluster_kinds:
+        rules.extend(cluster_rules(records, kind, min_size, use_dotnet))
+    return '\n\n'.join(rules) + '\n'
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate YARA rules from parser_main.py --jsonl reports or a --cache database.')
+    parser.add_argument('reports', nargs='*', help='JSON Lines files. Use - for stdin.')
+    parser.add_argument('--cache', help='Read every report stored in this SQLite cache instead.')
+    parser.add_argument('--cluster', action='append', choices=['typelib', 'mvid'], default=[], help='Also emit one rule per TypeLib ID or MVID shared by several samples.')
+    parser.add_argument('--min-size', type=int, default=2, help='Smallest cluster that gets a rule.')
+    parser.add_argument('--no-samples', action='store_true', help='Only emit cluster rules.')
+    parser.add_argument('--dotnet', action='store_true', help='Use the YARA dotnet module instead of string matches.')
+    parser.add_argument('-o', '--output', help='Write the rules here instead of stdout.')
+    args = parser.parse_args()
+    if args.cache:
+        with dn_cache.ReportCache(args.cache) as cache:
+            records = list(cache.iter_reports())
+    else:
+        records = dn_hash.load_records(args.reports or ['-'])
+    rules = generate(records, not args.no_samples, args.cluster, args.min_size, args.dotnet)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(rules)
+    else:
+        sys.stdout.write(rules)
+
+if __name__ == '__main__':
+    main()
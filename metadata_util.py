@@ -1,8 +1,55 @@
 import pefile
 import uuid
+import sys
+import time
 import math
+import struct
+import bisect
+import itertools
+from array import array
 import dn_constants as const
 
+# #~ header: reserved dword, major & minor version, HeapSizes, reserved byte, Valid and Sorted bitmasks
+TABLES_HEADER = struct.Struct('<IBBBBQQ')
+
+# Number of low bits holding the table tag in each coded index
+CODED_INDEX_BITS = {name: math.ceil(math.log2(len(tables))) for name, tables in const.CODED_INDEXES.items()}
+
+ARRAY_TYPECODES = {1: 'B', 2: 'H', 4: 'I'}
+
+class ParseViolation(Exception):
+    # A header value or index that doesn't fit the real buffer, or a blown budget, in strict mode
+    def __init__(self, kind, detail):
+        super().__init__(f'{kind}: {detail}')
+        self.kind = kind
+        self.detail = detail
+
+    def to_dict(self):
+        return {'kind': self.kind, 'detail': self.detail}
+
+class Limits:
+    # Strict mode settings. Every stream, table and heap access is checked against the
+    # buffer it reads from, and these caps bound how much work a sample can cause.
+
+    def __init__(self, max_streams=64, max_rows=1 << 20, max_bytes=256 << 20, time_budget=None, memory_budget=None):
+        self.max_streams = max_streams
+        self.max_rows = max_rows # Per table
+        self.max_bytes = max_bytes # Metadata bytes scanned per sample
+        self.time_budget = time_budget # Seconds per sample
+        self.memory_budget = memory_budget # Bytes of address space per worker process
+        self.deadline = None
+
+    def start(self):
+        self.deadline = time.monotonic() + self.time_budget if self.time_budget else None
+
+    def check_time(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise ParseViolation('time_budget', f'Sample took longer than {self.time_budget}s')
+
+    def check_range(self, kind, what, start, size, limit):
+        if start < 0 or size < 0 or start + size > limit:
+            raise ParseViolation(kind, f'{what} at {start:#X} with size {size:#X} is outside of {limit:#X} bytes')
+
 class Stream:
     def __init__(self, name, size, rva, phys_addr):
         self.name = name
@@ -10,87 +57,370 @@ class Stream:
         self.rva = rva
         self.phys_addr = phys_addr
 
+def decode_compressed_uint(data, offset):
+    # ECMA-335 II.23.2 compressed unsigned integer. Returns (value, bytes used)
+    first = data[offset]
+    if first & 0x80 == 0:
+        return first, 1
+    if first & 0xC0 == 0x80:
+        return ((first & 0x3F) << 8) | data[offset + 1], 2
+    if first & 0xE0 == 0xC0:
+        return ((first & 0x1F) << 24) | (data[offset + 1] << 16) | (data[offset + 2] << 8) | data[offset + 3], 4
+    raise ValueError(f'Invalid compressed integer at {offset:#X}')
+
+class Heap:
+    # Reader for one heap stream. Lookups are memoized by heap offset since the same
+    # names and signatures are referenced from many rows.
+
+    def __init__(self, stream: Stream, data, limits: Limits = None):
+        self.stream = stream
+        self.data = data
+        self.limits = limits
+        if limits:
+            limits.check_range('heap_bounds', f'{stream.name} heap', stream.phys_addr, stream.size, len(data))
+        self.start = stream.phys_addr
+        self.end = min(stream.phys_addr + stream.size, len(data))
+        with memoryview(data) as view:
+            self.view = view[self.start:self.end]
+        self.cache = {}
+        self.bytes_read = 0 # For dn_stats
+
+    def get(self, index):
+        if index not in self.cache:
+            self.cache[index] = self.read(index)
+        return self.cache[index]
+
+    def read(self, index):
+        raise NotImplementedError
+
+    def release(self):
+        self.view.release()
+        self.data = None
+
+class StringHeap(Heap):
+
+    def read(self, index):
+        if self.limits and index >= self.end - self.start:
+            raise ParseViolation('heap_bounds', f'#Strings index {index:#X} is past the end of the heap')
+        start = self.start + index
+        terminator = self.data.find(b'\x00', start, self.end)
+        self.bytes_read += (terminator if terminator != -1 else self.end) - start + 1
+        return sys.intern(self.data[start:terminator if terminator != -1 else self.end].decode('utf-8', errors='replace'))
+
+    def iter_all(self):
+        # Every NUL-terminated string in one pass, as (offset, value). Names that only
+        # reference the tail of another string are not listed separately
+        offset = 0
+        for value in self.view.tobytes().split(b'\x00'):
+            if value:
+                yield offset, value.decode('utf-8', errors='replace')
+            offset += len(value) + 1
+
+class BlobHeap(Heap):
+
+    def read(self, index):
+        return self.view[slice(*self.get_bounds(index))].tobytes()
+
+    def get_bounds(self, index):
+        if self.limits and index >= len(self.view):
+            raise ParseViolation('heap_bounds', f'{self.stream.name} index {index:#X} is past the end of the heap')
+        length, length_size = decode_compressed_uint(self.view, index)
+        if self.limits:
+            self.limits.check_range('heap_bounds', f'{self.stream.name} entry', index + length_size, length, len(self.view))
+        self.bytes_read += length_size + length
+        return index + length_size, index + length_size + length
+
+    def get_view(self, index):
+        # Zero-copy access for large blobs. The caller must release it before the file is closed
+        return self.view[slice(*self.get_bounds(index))]
+
+    def iter_all(self):
+        offset = 0
+        while offset < len(self.view):
+            try:
+                start, end = self.get_bounds(offset)
+            except (ValueError, IndexError):
+                return # Garbage or padding at the end of the heap
+            yield offset, self.view[start:end].tobytes()
+            offset = end
+
+class UserStringHeap(BlobHeap):
+
+    def read(self, index):
+        start, end = self.get_bounds(index)
+        # UTF-16 characters followed by one flag byte for odd lengths
+        return self.view[start:end - (end - start) % 2].tobytes().decode('utf-16-le', errors='replace')
+
+    def iter_all(self):
+        offset = 0
+        while offset < len(self.view):
+            try:
+                start, end = self.get_bounds(offset)
+            except (ValueError, IndexError):
+                return # Garbage or padding at the end of the heap
+            if end > start:
+                yield offset, self.get(offset)
+            offset = end
+
+class GuidHeap(Heap):
+
+    def read(self, index):
+        if self.limits and not 0 < index <= len(self.view) // 16:
+            raise ParseViolation('heap_bounds', f'#GUID index {index} is outside of the heap')
+        self.bytes_read += 16
+        return self.view[16 * (index - 1):16 * index].tobytes() # indexes start at 1 not 0
+
+    def iter_all(self):
+        for index in range(1, len(self.view) // 16 + 1):
+            yield index, self.get(index)
+
+HEAP_CLASSES = {'#Strings': StringHeap, '#Blob': BlobHeap, '#GUID': GuidHeap, '#US': UserStringHeap}
+
+class Table:
+    # Array-backed columns for one metadata table. Nothing is decoded until a column is
+    # first asked for, and then only that column is read out of the table's rows.
+
+    def __init__(self, metadata, name):
+        self.name = name
+        self.row_count = metadata.table_rowcounts.get(name, 0)
+        self.column_names = [column for column, size in const.TABLE_COLUMNS[name]]
+        self.column_sizes = {column: size for column, size in const.TABLE_COLUMNS[name]}
+        self.metadata = metadata
+        self.columns = {}
+        self.coded_columns = {}
+        self.positions = {}
+
+    def __len__(self):
+        return self.row_count
+
+    def column(self, column_name):
+        if column_name not in self.columns:
+            self.columns[column_name] = self.decode_column(column_name)
+        return self.columns[column_name]
+
+    def decode_column(self, column_name):
+        if self.row_count == 0:
+            return array('B')
+        row_struct = self.metadata.row_structs[self.name]
+        offset = 0
+        for column, size in const.TABLE_COLUMNS[self.name]:
+            width = size if isinstance(size, int) else self.metadata.index_sizes[size]
+            if column == column_name:
+                break
+            offset += width
+        # Skip every other column with pad bytes so one iter_unpack pass yields just this column
+        column_struct = struct.Struct(f'<{offset}x{const.STRUCT_FORMATS[width]}{row_struct.size - offset - width}x')
+        start = self.metadata.table_offsets[self.name]
+        with memoryview(self.metadata.data) as view:
+            rows = view[start:start + self.row_count * row_struct.size]
+            self.metadata.bytes_read += len(rows)
+            values = array(ARRAY_TYPECODES[width], itertools.chain.from_iterable(column_struct.iter_unpack(rows)))
+            rows.release()
+        return values
+
+    def coded(self, column_name):
+        # Coded index column split into (table tag, row) arrays. Tags index into the
+        # coded index's table list in dn_constants, e.g. HAS_CUSTOM_ATTRIBUTE
+        if column_name not in self.coded_columns:
+            coded_index = self.column_sizes[column_name]
+            bits = CODED_INDEX_BITS[coded_index]
+            mask = (1 << bits) - 1
+            values = self.column(column_name)
+            tags = array('B', (value & mask for value in values))
+            rows = array('I', (value >> bits for value in values))
+            self.coded_columns[column_name] = (tags, rows)
+        return self.coded_columns[column_name]
+
+    def position(self, column_name, value):
+        # Row holding value in the column, built once per column. Used to invert Ptr tables,
+        # where each value appears once; the first row wins otherwise. 0 if none
+        if column_name not in self.positions:
+            values = self.column(column_name)
+            self.positions[column_name] = {value: row for row, value in zip(range(len(values), 0, -1), reversed(values))}
+        return self.positions[column_name].get(value, 0)
+
+    def get_coded(self, column_name, row):
+        # (table name, row) for one row of a coded index column. Table name is None for invalid tags
+        tags, rows = self.coded(column_name)
+        tables = const.CODED_INDEXES[self.column_sizes[column_name]]
+        tag = tags[row - 1]
+        return (tables[tag] if tag < len(tables) else None, rows[row - 1])
+
+    def row(self, row):
+        # Single row as a dict. Rows start at 1
+        return dict(zip(self.column_names, self.metadata.get_row(self.name, row)))
+
 class Metadata:
 
-    def __init__(self):
+    def __init__(self, limits: Limits = None):
+        self.limits = limits
         self.has_extra = False
+        self.is_unoptimized = False # #- stream, which may use the Ptr indirection tables
         self.tables = []
         self.index_sizes = {}
         self.table_rowcounts = {}
+        self.row_structs = {}
+        self.table_offsets = {} # Table name -> file offset of its first row, computed once in parse_tables
+        self.table_cache = {}
+        self.error = None
+        self.data = None # The whole file. pefile maps it with mmap when it is loaded from disk
+        self.tables_offset = 0 # File offset of the first row of the first table
+        self.heaps = {} # Heap name -> Heap reader
+        self.bytes_read = 0 # Table bytes scanned, see get_bytes_read
 
     def get_table_size(self, table_name):
-        return self.table_rowcounts[table_name] * const.ROW_SIZE_FUNCS[table_name](self.index_sizes)
+        return self.table_rowcounts[table_name] * self.get_row_size(table_name)
 
     def get_row_size(self, table_name):
-        return const.ROW_SIZE_FUNCS[table_name](self.index_sizes)
-    
-    def get_addr_in_table(self, metadata_stream_rva, tablename: str, row=1):        
-        offset = metadata_stream_rva + 24 + (4 * len(self.tables))
-        for table in self.tables:
-            if table == tablename:
-                break
-            offset += self.get_table_size(table)
-        row_size = self.get_row_size(tablename)        
-        offset += (row - 1) * row_size
-        return offset        
+        return self.row_structs[table_name].size
+
+    def get_addr_in_table(self, tablename: str, row=1):
+        return self.table_offsets[tablename] + (row - 1) * self.row_structs[tablename].size
+
+    def get_table(self, table_name):
+        if table_name not in self.table_cache:
+            self.table_cache[table_name] = Table(self, table_name)
+        return self.table_cache[table_name]
+
+    def resolve_ptr(self, table_name, row):
+        # Real row in table_name for a row number taken from a list column. Without a Ptr
+        # table this is the row itself, otherwise one lookup in the already decoded Ptr column
+        ptr_table = const.PTR_TABLES.get(table_name)
+        if ptr_table is None or not self.table_rowcounts.get(ptr_table):
+            return row
+        ptr = self.get_table(ptr_table)
+        targets = ptr.column(ptr.column_names[0])
+        return targets[row - 1] if 0 < row <= len(targets) else row
+
+    def get_list(self, owner_table, column_name, row):
+        # Rows of the target table owned by one row of owner_table, e.g. the fields of a TypeDef.
+        # The list runs until the next owner's start, or the end of the target (or its Ptr) table
+        target = const.LIST_COLUMNS[(owner_table, column_name)]
+        ptr_table = const.PTR_TABLES.get(target)
+        list_table = ptr_table if self.table_rowcounts.get(ptr_table) else target
+        last = self.table_rowcounts.get(list_table, 0)
+        owners = self.get_table(owner_table).column(column_name)
+        start = owners[row - 1]
+        end = owners[row] if row < len(owners) else last + 1
+        return [self.resolve_ptr(target, i) for i in range(start, min(end, last + 1))]
+
+    def get_owner(self, owner_table, column_name, row):
+        # Inverse of get_list: the owner_table row whose list holds row, e.g. the TypeDef that
+        # declares a MethodDef. List columns are sorted, so this is a binary search. 0 if none
+        target = const.LIST_COLUMNS[(owner_table, column_name)]
+        ptr_table = const.PTR_TABLES.get(target)
+        if self.table_rowcounts.get(ptr_table):
+            ptr = self.get_table(ptr_table)
+            row = ptr.position(ptr.column_names[0], row)
+            if not row:
+                return 0
+        return bisect.bisect_right(self.get_table(owner_table).column(column_name), row)
+
+    def check_row(self, table_name, row):
+        # Whether row exists in the table. Strict mode raises instead of returning False
+        if 0 < row <= self.table_rowcounts.get(table_name, 0):
+            return True
+        if self.limits:
+            raise ParseViolation('row_index', f'Row {row} is outside of the {table_name} table ({self.table_rowcounts.get(table_name, 0)} rows)')
+        return False
+
+    def get_row(self, table_name, row):
+        if self.limits:
+            self.check_row(table_name, row)
+        self.bytes_read += self.row_structs[table_name].size
+        return self.row_structs[table_name].unpack_from(self.data, self.get_addr_in_table(table_name, row))
+
+    def get_string(self, index):
+        return self.heaps['#Strings'].get(index)
+
+    def get_guid(self, index):
+        return self.heaps['#GUID'].get(index)
+
+    def get_blob(self, index):
+        return self.heaps['#Blob'].get(index)
+
+    def get_user_string(self, index):
+        return self.heaps['#US'].get(index)
+
+    def get_bytes_read(self):
+        # Bytes of tables and heaps read so far, counting memoized heap entries once
+        return self.bytes_read + sum(heap.bytes_read for heap in self.heaps.values())
+
+    def release(self):
+        # pefile can't close its mmap while slices of it are still exported
+        for heap in self.heaps.values():
+            heap.release()
+        self.data = None
 
     def parse(self, pe, streams):
+        self.data = pe.__data__
+        for name, heap_class in HEAP_CLASSES.items():
+            if name in streams:
+                self.heaps[name] = heap_class(streams[name], self.data, self.limits)
         metadata_stream = streams.get('#~') if '#~' in streams else streams.get('#-')
         if not metadata_stream:
-            print('!! No metadata stream. Cannot continue processing. !!')
+            self.error = 'No metadata stream. Cannot continue processing.'
             return
-        if metadata_stream.name == '#-':
-            print('!! Cannot process unoptimized metadata. !!')
-            return
-        offsetSizeFlags = int.from_bytes(pe.get_data(metadata_stream.rva + 4 + 1 + 1, 1), byteorder = 'little')        
+        self.is_unoptimized = metadata_stream.name == '#-'
+        if self.limits:
+            self.limits.check_range('stream_bounds', f'{metadata_stream.name} stream', metadata_stream.phys_addr, metadata_stream.size, len(self.data))
+            self.limits.check_range('table_bounds', 'Tables header', 0, TABLES_HEADER.size, metadata_stream.size)
+        reserved, major, minor, offsetSizeFlags, reserved2, tableFlags, sortedFlags = TABLES_HEADER.unpack_from(self.data, metadata_stream.phys_addr)
+        self.bytes_read += TABLES_HEADER.size
         self.parse_stream_offset_sizes(offsetSizeFlags)
-        tableFlags = pe.get_qword_at_rva(metadata_stream.rva + 4 + 1 + 1 + 1 + 1)    
-        self.parse_tables(tableFlags, pe, metadata_stream)
+        self.parse_tables(tableFlags, metadata_stream)
 
-    def parse_tables(self, tableFlags, pe, metadata_stream):        
+    def parse_tables(self, tableFlags, metadata_stream):
         for flag, name in const.METADATA_TABLE_FLAGS.items():
-            self.table_rowcounts[name] = 0            
+            self.table_rowcounts[name] = 0
             if flag & tableFlags == flag:
-                self.tables.append(name)  
-        start = metadata_stream.rva + 24
-        offset = 0
-        i = 0            
-        for table in self.tables:        
-            row_count = pe.get_dword_at_rva(start + (4 * i))        
-            self.table_rowcounts[table] = row_count                                    
-            i += 1               
+                self.tables.append(name)
+        start = metadata_stream.phys_addr + TABLES_HEADER.size
+        if self.limits:
+            self.limits.check_range('table_bounds', 'Row counts', TABLES_HEADER.size, 4 * len(self.tables), metadata_stream.size)
+        row_counts = struct.unpack_from(f'<{len(self.tables)}I', self.data, start)
+        self.bytes_read += 4 * len(self.tables)
+        for table, row_count in zip(self.tables, row_counts):
+            self.table_rowcounts[table] = row_count
+        self.tables_offset = start + 4 * len(self.tables)
+        if self.has_extra:
+            # An extra dword follows the row counts before the first table
+            self.tables_offset += 4
         for table, row_count in self.table_rowcounts.items():
             self.index_sizes[table] = 2 if row_count < 2 ** 16 else 4
-        self.index_sizes['HasCustomAttribute'] = self.calculate_coded_index_size(const.HAS_CUSTOM_ATTRIBUTE)
-        self.index_sizes['TypeDefOrRef'] = self.calculate_coded_index_size(const.TYPE_DEF_OR_REF)
-        self.index_sizes['HasConstant'] = self.calculate_coded_index_size(const.HAS_CONSTANT)
-        self.index_sizes['HasFieldMarshal'] = self.calculate_coded_index_size(const.HAS_FIELD_MARSHAL)
-        self.index_sizes['HasDeclSecurity'] = self.calculate_coded_index_size(const.HAS_DECL_SECURITY)
-        self.index_sizes['MemberRefParent'] = self.calculate_coded_index_size(const.MEMBER_REF_PARENT)
-        self.index_sizes['HasSemantics'] = self.calculate_coded_index_size(const.HAS_SEMANTICS)
-        self.index_sizes['MethodDefOrRef'] = self.calculate_coded_index_size(const.METHOD_DEF_OR_REF)
-        self.index_sizes['MemberForwarded'] = self.calculate_coded_index_size(const.MEMBER_FORWARDED)
-        self.index_sizes['Implementation'] = self.calculate_coded_index_size(const.IMPLEMENTATION)
-        self.index_sizes['CustomAttributeType'] = self.calculate_coded_index_size(const.CUSTOM_ATTRIBUTE_TYPE)
-        self.index_sizes['ResolutionScope'] = self.calculate_coded_index_size(const.RESOLUTION_SCOPE)
-        self.index_sizes['TypeOrMethodDef'] = self.calculate_coded_index_size(const.TYPE_OR_METHOD_DEF)  
-        
+        for coded_index, table_list in const.CODED_INDEXES.items():
+            self.index_sizes[coded_index] = self.calculate_coded_index_size(table_list)
+        for table in self.tables:
+            columns = const.TABLE_COLUMNS[table]
+            layout = ''.join(const.STRUCT_FORMATS[size if isinstance(size, int) else self.index_sizes[size]] for name, size in columns)
+            self.row_structs[table] = struct.Struct('<' + layout)
+        offset = self.tables_offset
+        for table in self.tables:
+            self.table_offsets[table] = offset
+            offset += self.get_table_size(table)
+        if self.limits:
+            for table in self.tables:
+                if self.table_rowcounts[table] > self.limits.max_rows:
+                    raise ParseViolation('row_count', f'{table} has {self.table_rowcounts[table]} rows, more than the limit of {self.limits.max_rows}')
+            tables_size = offset - metadata_stream.phys_addr
+            self.limits.check_range('table_bounds', 'Metadata tables', 0, tables_size, metadata_stream.size)
+            if tables_size > self.limits.max_bytes:
+                raise ParseViolation('byte_count', f'Metadata tables take {tables_size:#X} bytes, more than the limit of {self.limits.max_bytes:#X}')
 
     def calculate_coded_index_size(self, table_list):
-        n = len(table_list)                
-        row_max = 2 ** (16 - math.ceil(math.log2(n)))                
-        for table, row_count in self.table_rowcounts.items():                                    
-            if table in table_list and row_count >= row_max:             
-                return 4
+        n = len(table_list)
+        row_max = 2 ** (16 - math.ceil(math.log2(n)))
+        if max(self.table_rowcounts.get(table, 0) for table in table_list) >= row_max:
+            return 4
         return 2
-            
+
     def parse_stream_offset_sizes(self, offsetSizeFlags):
         strings = 0x01
         guids = 0x02
         blob = 0x04
-        extra = 0x40 
+        extra = 0x40
         self.index_sizes['#Strings'] = 4 if offsetSizeFlags & strings else 2
         self.index_sizes['#GUID'] = 4 if offsetSizeFlags & guids else 2
-        self.index_sizes['#Blob'] = 4 if offsetSizeFlags & blob else 2        
+        self.index_sizes['#Blob'] = 4 if offsetSizeFlags & blob else 2
         if offsetSizeFlags & extra == extra:
-            self.has_extra = True
\ No newline at end of file
+            self.has_extra = True
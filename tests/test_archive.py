@@ -0,0 +1,55 @@
+import io
+import tarfile
+import zipfile
+import pytest
+import dn_archive
+
+class ShortReads(io.RawIOBase):
+    # A pipe that hands out at most 100 bytes per read
+
+    def __init__(self, data):
+        self.data = data
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), len(self.data), 100)
+        buffer[:size] = self.data[:size]
+        self.data = self.data[size:]
+        return size
+
+def tar_bytes(files):
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode='w') as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return out.getvalue()
+
+def zip_bytes(files):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return out.getvalue()
+
+FILES = {'a.dll': b'MZ' + b'a' * 1000, 'b.dll': b'MZ' + b'b' * 10}
+
+@pytest.mark.parametrize('pack', [tar_bytes, zip_bytes])
+def test_archive_from_pipe(pack):
+    samples = list(dn_archive.iter_samples(ShortReads(pack(FILES)), '<stdin>'))
+    assert samples == [(f'<stdin>!{name}', data, None) for name, data in FILES.items()]
+
+@pytest.mark.parametrize('data', [FILES['a.dll'], FILES['b.dll'], b''])
+def test_plain_file_from_pipe(data):
+    # The bytes read to look for archive magic are still part of the sample
+    assert list(dn_archive.iter_samples(ShortReads(data), '<stdin>')) == [('<stdin>', data, None)]
+
+def test_read_head_seekable():
+    data = tar_bytes(FILES)
+    stream = io.BytesIO(data)
+    head, fileobj = dn_archive.read_head(stream)
+    assert head == data[:512]
+    assert fileobj is stream and stream.tell() == 0
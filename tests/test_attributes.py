@@ -0,0 +1,54 @@
+import pytest
+import dn_extract
+import dn_synth
+import metadata_util as mu
+
+TYPELIB_ID = '21373474-dfe8-4e53-8c9b-28c21d6efea1'
+
+class CraftedBuilder(dn_synth.AssemblyBuilder):
+    # Replaces the constructor signature and value blob of the second assembly attribute,
+    # AssemblyTitleAttribute. The first one, GuidAttribute, is left alone
+
+    def __init__(self, signature=None, value=None):
+        super().__init__(typelib_id=TYPELIB_ID)
+        self.signature = signature
+        self.value = value
+
+    def row_values(self, table, row):
+        values = super().row_values(table, row)
+        if table == 'MemberRef' and row == 2 and self.signature is not None:
+            values[2] = self.blobs.add(self.signature)
+        if table == 'CustomAttribute' and row == 2 and self.value is not None:
+            values[2] = self.blobs.add(self.value)
+        return values
+
+def title_attribute(builder, limits):
+    report = dn_extract.extract(builder.build(), limits=limits)
+    assert report.typelib_ids == [TYPELIB_ID]
+    assert report.violations == []
+    return report.attributes[1]
+
+@pytest.mark.parametrize('limits', [None, mu.Limits()], ids=['lax', 'strict'])
+def test_nested_array_parameter(limits):
+    attribute = title_attribute(CraftedBuilder(signature=b'\x20\x01\x01' + b'\x1d' * 3000), limits)
+    assert attribute['args'] is None
+    assert 'nested' in attribute['error']
+
+@pytest.mark.parametrize('limits', [None, mu.Limits()], ids=['lax', 'strict'])
+def test_nested_array_named_argument(limits):
+    value = b'\x01\x00\x01A\x01\x00\x53' + b'\x1d' * 3000
+    attribute = title_attribute(CraftedBuilder(value=value), limits)
+    assert 'nested' in attribute['error']
+
+@pytest.mark.parametrize('limits', [None, mu.Limits()], ids=['lax', 'strict'])
+def test_nested_boxed_values(limits):
+    # object parameter holding an object[] holding an object[] ...
+    value = b'\x01\x00' + b'\x1d\x51\x01\x00\x00\x00' * 3000
+    attribute = title_attribute(CraftedBuilder(signature=b'\x20\x01\x01\x1c', value=value), limits)
+    assert 'nested' in attribute['error']
+
+def test_boxed_array():
+    # object parameter holding new int[] { 1, 2 }, and a named string property
+    value = b'\x01\x00\x1d\x08\x02\x00\x00\x00\x01\x00\x00\x00\x02\x00\x00\x00\x01\x00\x54\x0e\x04Name\x01A'
+    attribute = title_attribute(CraftedBuilder(signature=b'\x20\x01\x01\x1c', value=value), None)
+    assert attribute == {'type': 'System.Reflection.AssemblyTitleAttribute', 'args': [[1, 2]], 'named': {'Name': 'A'}}
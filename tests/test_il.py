@@ -0,0 +1,70 @@
+import hashlib
+import pytest
+import dn_extract
+import dn_il
+import dn_synth
+
+# ldarg.0, call 0x0A000001, ldstr 0x70000001, pop, ret
+TINY_IL = bytes.fromhex('02 280100000A 7201000070 26 2A')
+# ldc.i4.s 10, stloc.0, ldloc.0, brtrue.s +5, newobj 0x0A000002, ldc.i4 0x1000, call 0x06000002,
+# leave.s +0, ret, and padding out to a fat body
+FAT_IL = bytes.fromhex('1F0A 0A 06 2D05 730200000A 2000100000 2802000006 DE00 2A') + bytes.fromhex('00') * 40
+
+def build():
+    bodies = {
+        2: dn_synth.tiny_body(TINY_IL),
+        4: dn_synth.fat_body(FAT_IL, max_stack=3, local_var_sig_token=0x11000001, init_locals=True, sections=[(False, 2), (True, 1)])
+    }
+    return dn_synth.AssemblyBuilder(rows={'StandAloneSig': 1}, bodies=bodies).build()
+
+@pytest.fixture
+def reader():
+    with dn_extract.open_metadata(build()) as (pe, streams, metadata):
+        yield dn_il.MethodReader(pe, metadata)
+
+def test_tiny_body(reader):
+    body = reader.body(2)
+    assert body.error is None
+    assert (body.format, body.code_size, body.max_stack, body.locals, body.exception_clauses) == ('tiny', len(TINY_IL), 8, None, 0)
+    assert body.il == TINY_IL
+    assert reader.disassemble(body) == ['IL_0000: ldarg.0', 'IL_0001: call 0x0a000001', 'IL_0006: ldstr "Synthetic"', 'IL_000b: pop', 'IL_000c: ret']
+
+def test_fat_body(reader):
+    body = reader.body(4)
+    assert body.error is None
+    assert (body.format, body.code_size, body.max_stack, body.locals, body.exception_clauses) == ('fat', len(FAT_IL), 3, 2, 3)
+    assert body.to_dict()['init_locals']
+    assert body.to_dict()['local_var_sig_token'] == '0x11000001'
+    assert body.il == FAT_IL
+    instructions = [(offset, name) for offset, name, operand_type, operand in dn_il.iter_instructions(body.il)]
+    assert instructions[:9] == [(0, 'ldc.i4.s'), (2, 'stloc.0'), (3, 'ldloc.0'), (4, 'brtrue.s'), (6, 'newobj'), (11, 'ldc.i4'), (16, 'call'), (21, 'leave.s'), (23, 'ret')]
+    assert reader.disassemble(body)[3] == 'IL_0004: brtrue.s IL_000b'
+    assert reader.disassemble(body)[6] == 'IL_0010: call 0x06000002 <Module>::Method2'
+
+def test_methods_without_body(reader):
+    assert reader.body(1) is None
+    assert [body.row for body in reader.iter_bodies()] == [2, 4]
+
+def test_pattern():
+    # Token rows are wildcards, the table byte and everything else stays
+    assert dn_il.pattern(TINY_IL) == '{ 02 28 ?? ?? ?? 0A 72 ?? ?? ?? 70 26 2A }'
+    assert dn_il.pattern(FAT_IL, max_bytes=16) == '{ 1F 0A 0A 06 2D 05 73 ?? ?? ?? 0A 20 00 10 00 00 }'
+
+def test_il_hash():
+    assert dn_il.il_hash(TINY_IL) == hashlib.sha256(bytes.fromhex('02 280000000A 7200000070 26 2A')).hexdigest()
+    # The same code calling through other tokens hashes the same, other code doesn't
+    assert dn_il.il_hash(bytes.fromhex('02 280700000A 7205000070 26 2A')) == dn_il.il_hash(TINY_IL)
+    assert dn_il.il_hash(bytes.fromhex('03 280100000A 7201000070 26 2A')) != dn_il.il_hash(TINY_IL)
+
+def test_method_hashes(reader):
+    # Only the fat body is long enough to be hashed
+    assert dn_il.method_hashes(reader.pe, reader.metadata) == {dn_il.il_hash(FAT_IL): ['Synthetic.Ns2.Class2::Method4']}
+
+def test_cli_method_without_body(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'sample.dll'
+    path.write_bytes(build())
+    monkeypatch.setattr('sys.argv', ['dn_il.py', str(path), '-m', '0x06000001'])
+    with pytest.raises(SystemExit) as exit:
+        dn_il.main()
+    assert exit.value.code == 1
+    assert 'has no method body' in capsys.readouterr().err
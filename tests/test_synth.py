@@ -0,0 +1,77 @@
+import uuid
+import struct
+import pytest
+import dn_extract
+import dn_synth
+
+# Tables the generator writes, in ECMA-335 table number order
+TABLE_ORDER = ['Module', 'TypeRef', 'TypeDef', 'FieldPtr', 'Field', 'MethodPtr', 'MethodDef', 'Param', 'MemberRef', 'CustomAttribute', 'Assembly', 'AssemblyRef']
+
+# Row sizes worked out by hand from the column lists in ECMA-335 II.22, for the index widths of
+# each scenario. Kept independent of dn_constants, which the generator and the parser both use
+NARROW = {'Module': 10, 'TypeRef': 6, 'TypeDef': 14, 'FieldPtr': 2, 'Field': 6, 'MethodPtr': 2, 'MethodDef': 14, 'Param': 6, 'MemberRef': 6, 'CustomAttribute': 6, 'Assembly': 22, 'AssemblyRef': 20}
+# The names of that many rows need a 4 byte #Strings index as well
+WIDE_STRINGS = {**NARROW, 'Module': 12, 'TypeRef': 10, 'TypeDef': 18, 'Field': 8, 'MethodDef': 16, 'Param': 8, 'MemberRef': 8, 'Assembly': 26, 'AssemblyRef': 24}
+ROW_SIZES = {
+    'small': NARROW,
+    'attributes': NARROW,
+    'unoptimized': NARROW,
+    # ResolutionScope and TypeDefOrRef widen at 2^14 TypeRefs, MemberRefParent at 2^13 and
+    # HasCustomAttribute at 2^11. CustomAttributeType stays narrow
+    'coded_wide': {**WIDE_STRINGS, 'TypeRef': 12, 'TypeDef': 20, 'MemberRef': 10, 'CustomAttribute': 8},
+    # 2^16 TypeDefs and MethodDefs widen their simple indexes and every coded index that includes them
+    'simple_wide': {**WIDE_STRINGS, 'TypeDef': 22, 'MemberRef': 10, 'CustomAttribute': 10},
+    # 4 byte #Strings, #GUID and #Blob indexes
+    'heaps_wide': {**NARROW, 'Module': 18, 'TypeRef': 10, 'TypeDef': 18, 'Field': 10, 'MethodDef': 18, 'Param': 8, 'MemberRef': 10, 'CustomAttribute': 8, 'Assembly': 28, 'AssemblyRef': 28}
+}
+
+MVID = uuid.UUID('7aaf2c8a-9184-478c-b5bf-5415b683eb30')
+TYPELIB_ID = '21373474-dfe8-4e53-8c9b-28c21d6efea1'
+
+def test_every_scenario_has_row_sizes():
+    assert set(ROW_SIZES) == set(dn_synth.SCENARIOS)
+
+@pytest.mark.parametrize('scenario', sorted(ROW_SIZES))
+def test_table_layout(scenario):
+    builder = dn_synth.AssemblyBuilder(**dn_synth.SCENARIOS[scenario])
+    with dn_extract.open_metadata(builder.build()) as (pe, streams, metadata):
+        tables = [table for table in TABLE_ORDER if table in builder.counts]
+        assert {table: metadata.row_structs[table].size for table in tables} == {table: ROW_SIZES[scenario][table] for table in tables}
+        offset = metadata.tables_offset
+        for table in tables:
+            assert metadata.table_offsets[table] == offset, table
+            offset += builder.counts[table] * ROW_SIZES[scenario][table]
+
+@pytest.mark.parametrize('scenario', ['small', 'heaps_wide'])
+def test_assembly_row(scenario):
+    # Read the Assembly row with a hand-written layout: HashAlgId, four version parts, Flags,
+    # then PublicKey, Name and Culture heap indexes
+    builder = dn_synth.AssemblyBuilder(name='Sample', version=(1, 2, 3, 4), **dn_synth.SCENARIOS[scenario])
+    with dn_extract.open_metadata(builder.build()) as (pe, streams, metadata):
+        index = 'I' if scenario == 'heaps_wide' else 'H'
+        row = struct.unpack_from(f'<IHHHHI{index}{index}{index}', metadata.data, metadata.get_addr_in_table('Assembly'))
+        assert row[:6] == (0x8004, 1, 2, 3, 4, 0)
+        assert metadata.get_string(row[7]) == 'Sample'
+        assert metadata.get_row('Assembly', 1) == row
+
+def test_report_values():
+    builder = dn_synth.AssemblyBuilder(name='Sample', version=(1, 2, 3, 4), mvid=MVID, typelib_id=TYPELIB_ID)
+    report = dn_extract.extract(builder.build()).to_dict()
+    assert report['assembly_name'] == 'Sample'
+    assert report['assembly_version'] == '1.2.3.4'
+    assert report['assembly_version_hex'] == '0100020003000400'
+    assert report['module_name'] == 'Sample.dll'
+    assert report['mvid'] == '7aaf2c8a-9184-478c-b5bf-5415b683eb30'
+    assert report['mvid_hex'] == '8a2caf7a84918c47b5bf5415b683eb30'
+    assert report['typelib_ids'] == [TYPELIB_ID]
+    assert [stream['name'] for stream in report['streams']] == ['#~', '#Strings', '#US', '#GUID', '#Blob']
+
+def test_ptr_tables():
+    # 4 TypeDefs split 64 methods 16 apiece, and MethodPtr lists the methods in reverse
+    builder = dn_synth.AssemblyBuilder(**dn_synth.SCENARIOS['unoptimized'])
+    with dn_extract.open_metadata(builder.build()) as (pe, streams, metadata):
+        assert metadata.is_unoptimized
+        assert metadata.get_list('TypeDef', 'MethodList', 2) == list(range(48, 32, -1))
+        assert metadata.get_owner('TypeDef', 'MethodList', 48) == 2
+        assert metadata.get_owner('TypeDef', 'MethodList', 64) == 1
+        assert metadata.get_owner('TypeDef', 'MethodList', 65) == 0